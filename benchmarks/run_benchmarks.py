@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite for E-commerce Semantic Search
+Targets:
+  embed   - /embed and /embed/batch latency/throughput at several concurrencies
+  ingest  - rows/sec through ingest_data.py's batch path
+  vector  - pgvector query latency against a local Postgres (temp tables only)
+  eval    - wall time of evaluate_search() against a stub search API
+Writes a JSON report with percentiles and compares it against a baseline
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+import requests
+
+from stub_stack import StubModel, StubServer, make_embedding_handler, make_search_handler
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'data-pipeline'))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'evaluation'))
+
+VOCABULARY = (
+    'wireless bluetooth headphones noise cancelling earbuds charger cable usb fast laptop '
+    'stand aluminum portable speaker waterproof smart watch fitness tracker kitchen blender '
+    'stainless steel coffee grinder gaming mouse keyboard mechanical camera lens tripod '
+    'backpack travel organizer led desk lamp monitor hdmi adapter battery pack solar'
+).split()
+
+# Word-count ranges for the text length classes
+LENGTH_CLASSES = {'short': (2, 6), 'medium': (20, 60), 'long': (150, 300)}
+
+# Metrics where a larger value is better; everything else is lower-is-better
+HIGHER_IS_BETTER = ('per_sec',)
+
+
+def parse_length_mix(spec: str) -> Dict[str, float]:
+    """Parse 'short=0.6,medium=0.3,long=0.1' into normalized weights"""
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in LENGTH_CLASSES:
+            raise ValueError(f"Unknown length class '{name}' (expected one of {sorted(LENGTH_CLASSES)})")
+        mix[name] = float(weight or 1.0)
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+
+def synthetic_texts(count: int, mix: Dict[str, float], rng: random.Random) -> List[str]:
+    """Reproducible texts drawn from the length mix"""
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    texts = []
+    for _ in range(count):
+        low, high = LENGTH_CLASSES[rng.choices(names, weights)[0]]
+        texts.append(' '.join(rng.choices(VOCABULARY, k=rng.randint(low, high))))
+    return texts
+
+
+def synthetic_products(count: int, rng: random.Random) -> List[Dict]:
+    """Reproducible product rows in the shape ingest_data.py expects"""
+    products = []
+    for i in range(count):
+        title = ' '.join(rng.choices(VOCABULARY, k=rng.randint(3, 8))).title()
+        products.append({
+            'product_id': f"BENCH{i:07d}",
+            'title': title,
+            'description': ' '.join(rng.choices(VOCABULARY, k=rng.randint(20, 80))),
+            'brand': rng.choice(['Acme', 'Globex', 'Initech', 'Umbrella']),
+            'category': rng.choice(['Electronics', 'Home', 'Sports', 'Office']),
+            'price': round(rng.uniform(5, 500), 2),
+            'rating': round(rng.uniform(1, 5), 1),
+            'review_count': rng.randint(0, 5000),
+        })
+    return products
+
+
+def percentiles(values_ms: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    if not values_ms:
+        return {}
+    arr = np.asarray(values_ms)
+    return {
+        'mean_ms': float(arr.mean()),
+        'p50_ms': float(np.percentile(arr, 50)),
+        'p90_ms': float(np.percentile(arr, 90)),
+        'p95_ms': float(np.percentile(arr, 95)),
+        'p99_ms': float(np.percentile(arr, 99)),
+        'max_ms': float(arr.max()),
+    }
+
+
+def run_load(url: str, payloads: List[Dict], concurrency: int) -> Tuple[List[float], int, float]:
+    """POST every payload with `concurrency` threads; returns (latencies_ms, errors, wall_seconds)"""
+    local = threading.local()
+
+    def send(payload):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, json=payload, timeout=120)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        return (time.perf_counter() - start) * 1000, ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(send, payloads))
+    wall = time.perf_counter() - start
+    latencies = [ms for ms, ok in outcomes if ok]
+    return latencies, sum(1 for _, ok in outcomes if not ok), wall
+
+
+def bench_embed(base_url: str, args, rng: random.Random) -> Dict:
+    """Latency and throughput of /embed and /embed/batch per concurrency level"""
+    mix = parse_length_mix(args.length_mix)
+    texts = synthetic_texts(args.requests, mix, rng)
+    results = {}
+    for concurrency in args.concurrency:
+        latencies, errors, wall = run_load(f"{base_url}/embed", [{'text': t} for t in texts], concurrency)
+        results[f'embed_c{concurrency}'] = {
+            **percentiles(latencies),
+            'requests_per_sec': len(latencies) / wall,
+            'errors': errors,
+        }
+
+        batches = [texts[i:i + args.batch_size] for i in range(0, len(texts), args.batch_size)]
+        latencies, errors, wall = run_load(f"{base_url}/embed/batch", [{'texts': b} for b in batches], concurrency)
+        results[f'batch_c{concurrency}'] = {
+            **percentiles(latencies),
+            'texts_per_sec': (len(latencies) * args.batch_size) / wall,
+            'errors': errors,
+        }
+    return results
+
+
+def connect_db(args):
+    """Connect to the benchmark Postgres, or return None when unavailable/offline"""
+    if args.offline and not args.db_dsn:
+        return None
+    try:
+        import psycopg2
+        return psycopg2.connect(args.db_dsn, connect_timeout=5) if args.db_dsn else psycopg2.connect(
+            host=os.getenv('DB_HOST', 'localhost'), port=os.getenv('DB_PORT', '5432'),
+            dbname=os.getenv('DB_NAME', 'ecommerce'), user=os.getenv('DB_USER', 'postgres'),
+            password=os.getenv('DB_PASSWORD', 'postgres'), connect_timeout=5
+        )
+    except Exception as e:
+        print(f"Postgres unavailable, skipping DB stages: {e}")
+        return None
+
+
+class NullConnection:
+    """Accepts and discards writes, so ingestion can be measured without a database"""
+
+    class _Cursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+
+        def execute(self, *args, **kwargs):
+            pass
+
+        def fetchone(self):
+            # Catalog lookups (e.g. partitioning.load_partition_map) find nothing: not partitioned
+            return None
+
+        def fetchall(self):
+            return []
+
+        def close(self):
+            pass
+
+    def cursor(self):
+        return self._Cursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def bench_ingest(embed_url: str, conn, args, rng: random.Random) -> Dict:
+    """
+    Rows/sec through ingest_data.process_batch. With a real connection, rows go
+    to a session-local TEMP copy of products that shadows the real table.
+    """
+    import ingest_data
+
+    products = synthetic_products(args.ingest_rows, rng)
+    target = 'null'
+    if conn is not None:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS products (LIKE public.products INCLUDING ALL)")
+            cursor.execute("TRUNCATE products")
+        conn.commit()
+        target = 'postgres-temp'
+    else:
+        conn = NullConnection()
+
+    batch_latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(products), ingest_data.BATCH_SIZE):
+        batch_start = time.perf_counter()
+        ingest_data.process_batch(conn, products[i:i + ingest_data.BATCH_SIZE], f"{embed_url}/embed")
+        batch_latencies.append((time.perf_counter() - batch_start) * 1000)
+    wall = time.perf_counter() - start
+
+    return {'ingest': {
+        'rows': len(products),
+        'rows_per_sec': len(products) / wall,
+        'wall_seconds': wall,
+        'target': target,
+        **{f'batch_{k}': v for k, v in percentiles(batch_latencies).items()},
+    }}
+
+
+def bench_vector(conn, args, rng: random.Random) -> Dict:
+    """pgvector ORDER BY <=> latency over a TEMP table of random unit vectors"""
+    from psycopg2.extras import execute_values
+
+    np_rng = np.random.default_rng(args.seed)
+    vectors = np_rng.standard_normal((args.vector_rows, 384)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    lists = max(1, int(np.sqrt(args.vector_rows)))
+
+    with conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_vectors")
+        cursor.execute("CREATE TEMP TABLE bench_vectors (id SERIAL PRIMARY KEY, embedding vector(384))")
+        execute_values(cursor, "INSERT INTO bench_vectors (embedding) VALUES %s",
+                       [(str(v.tolist()),) for v in vectors], page_size=1000)
+        cursor.execute(f"CREATE INDEX ON bench_vectors USING ivfflat (embedding vector_cosine_ops) "
+                       f"WITH (lists = {lists})")
+        cursor.execute("ANALYZE bench_vectors")
+    conn.commit()
+
+    queries = np_rng.standard_normal((args.vector_queries, 384)).astype(np.float32)
+    latencies = []
+    with conn.cursor() as cursor:
+        for q in queries:
+            start = time.perf_counter()
+            cursor.execute("SELECT id FROM bench_vectors ORDER BY embedding <=> %s::vector LIMIT %s",
+                           (str(q.tolist()), args.top_k))
+            cursor.fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+    conn.commit()
+    return {'vector_query': {'rows': args.vector_rows, 'lists': lists, **percentiles(latencies)}}
+
+
+def bench_eval(model: StubModel, args, rng: random.Random) -> Dict:
+    """Wall time of evaluate_search() over synthetic test queries against a stub search API"""
+    from evaluate_search import evaluate_search
+
+    products = synthetic_products(args.eval_products, rng)
+    for p in products:
+        p['text'] = f"{p['title']} {p['description']}"
+    test_queries = [{
+        'query': ' '.join(rng.choices(VOCABULARY, k=3)),
+        'relevant_product_ids': [p['product_id'] for p in rng.sample(products, 5)],
+    } for _ in range(args.eval_queries)]
+
+    with StubServer(make_search_handler(model, products)) as server:
+        start = time.perf_counter()
+        evaluate_search(f"{server.url}/api/search", test_queries, [5, 10, 20])
+        wall = time.perf_counter() - start
+    return {'eval': {'queries': len(test_queries), 'wall_seconds': wall,
+                     'queries_per_sec': len(test_queries) / wall}}
+
+
+def flatten(report: Dict) -> Dict[str, float]:
+    """'target.metric' -> value for every numeric metric in a report"""
+    flat = {}
+    for target, sections in report.get('results', {}).items():
+        for section, metrics in sections.items():
+            if not isinstance(metrics, dict):
+                continue
+            for name, value in metrics.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    flat[f"{target}.{section}.{name}"] = value
+    return flat
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """Metrics that got worse than baseline by more than `tolerance` (relative)"""
+    current, previous = flatten(report), flatten(baseline)
+    regressions = []
+    for key, value in current.items():
+        base = previous.get(key)
+        name = key.rsplit('.', 1)[1]
+        if not base or name in ('errors', 'rows', 'queries', 'lists'):
+            continue
+        higher_better = any(marker in name for marker in HIGHER_IS_BETTER)
+        if not (higher_better or name.endswith('_ms') or name.endswith('seconds')):
+            continue
+        change = (value - base) / base
+        if (higher_better and change < -tolerance) or (not higher_better and change > tolerance):
+            regressions.append({'metric': key, 'baseline': base, 'current': value,
+                                'change_pct': round(change * 100, 1)})
+    return regressions
+
+
+def environment_info(args) -> Dict:
+    """Enough context to judge whether two reports are comparable"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'args': vars(args),
+    }
+
+
+def run(args) -> Dict:
+    """Run the selected targets and assemble the report"""
+    rng = random.Random(args.seed)
+    model = StubModel(cost_per_token_ms=args.stub_cost_per_token_ms)
+    report = {'environment': environment_info(args), 'results': {}}
+
+    stub = None
+    embed_url = args.embedding_url
+    if args.offline or not embed_url:
+        stub = StubServer(make_embedding_handler(model)).__enter__()
+        embed_url = stub.url
+        report['environment']['embedding_service'] = 'stub'
+
+    conn = connect_db(args) if {'ingest', 'vector'} & set(args.targets) else None
+    try:
+        for target in args.targets:
+            print(f"Running {target} benchmark...")
+            if target == 'embed':
+                report['results']['embed'] = bench_embed(embed_url, args, rng)
+            elif target == 'ingest':
+                report['results']['ingest'] = bench_ingest(embed_url, conn, args, rng)
+            elif target == 'vector':
+                if conn is None:
+                    report['results']['vector'] = {'skipped': 'no Postgres connection'}
+                    print("Skipping vector benchmark: no Postgres connection")
+                else:
+                    report['results']['vector'] = bench_vector(conn, args, rng)
+            elif target == 'eval':
+                report['results']['eval'] = bench_eval(model, args, rng)
+    finally:
+        if stub:
+            stub.__exit__(None, None, None)
+        if conn is not None:
+            conn.close()
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the semantic search stack')
+    parser.add_argument('--targets', nargs='+', choices=['embed', 'ingest', 'vector', 'eval'],
+                        default=['embed', 'ingest', 'vector', 'eval'])
+    parser.add_argument('--offline', action='store_true',
+                        help='Use the stub model/stack only; DB stages run only with --db-dsn')
+    parser.add_argument('--embedding-url', help='Real embedding service base URL (default: stub)')
+    parser.add_argument('--db-dsn', help='Postgres DSN (default: DB_* environment variables)')
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--length-mix', default='short=0.6,medium=0.3,long=0.1')
+    parser.add_argument('--ingest-rows', type=int, default=1000)
+    parser.add_argument('--vector-rows', type=int, default=20000)
+    parser.add_argument('--vector-queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--eval-products', type=int, default=2000)
+    parser.add_argument('--eval-queries', type=int, default=200)
+    parser.add_argument('--stub-cost-per-token-ms', type=float, default=0.0,
+                        help='Simulated model compute per token in the stub')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--baseline', help='Previous report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression')
+
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report['regressions'] = compare_to_baseline(report, json.load(f), args.tolerance)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    for regression in report.get('regressions', []):
+        print(f"REGRESSION {regression['metric']}: {regression['baseline']:.3f} -> "
+              f"{regression['current']:.3f} ({regression['change_pct']:+.1f}%)")
+    sys.exit(1 if report.get('regressions') else 0)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Local stand-in stack for benchmarks
+Stub embedding service and search API that speak the same HTTP contracts as
+embedding-service/app.py and the Spring search API, with a deterministic
+hashing "model" so benchmarks run offline without downloading weights
+"""
+
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EMBEDDING_DIM = 384
+
+
+class StubModel:
+    """
+    Feature-hashing encoder: each token adds a fixed random direction, and the
+    sum is L2-normalized. Texts sharing words get similar vectors, which is
+    enough for search benchmarks. cost_per_token_ms simulates model compute.
+    """
+
+    def __init__(self, dimension: int = EMBEDDING_DIM, cost_per_token_ms: float = 0.0):
+        self.dimension = dimension
+        self.cost_per_token_ms = cost_per_token_ms
+        self._token_vectors = {}
+        self._lock = threading.Lock()
+
+    def _token_vector(self, token: str) -> np.ndarray:
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            with self._lock:
+                self._token_vectors[token] = vector
+        return vector
+
+    def encode_one(self, text: str) -> np.ndarray:
+        tokens = text.lower().split() or ['<empty>']
+        if self.cost_per_token_ms:
+            time.sleep(self.cost_per_token_ms * len(tokens) / 1000.0)
+        vector = np.sum([self._token_vector(t) for t in tokens], axis=0)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.encode_one(text) for text in texts])
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    """Small JSON request/response helper; silences per-request logging"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b'null')
+        except json.JSONDecodeError:
+            return None
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_embedding_handler(model: StubModel):
+    """Handler implementing /health, /embed and /embed/batch"""
+
+    class EmbeddingHandler(_JsonHandler):
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json({'status': 'healthy', 'model': 'stub-hashing-model'})
+            else:
+                self._send_json({'error': 'Not found'}, 404)
+
+        def do_POST(self):
+            data = self._read_json()
+            if self.path == '/embed':
+                if not data or not isinstance(data.get('text'), str) or not data['text'].strip():
+                    return self._send_json({'error': 'Text must be a non-empty string'}, 400)
+                embedding = model.encode_one(data['text']).tolist()
+                return self._send_json({'embedding': embedding, 'dimension': len(embedding)})
+            if self.path == '/embed/batch':
+                if not data or not isinstance(data.get('texts'), list) or not data['texts']:
+                    return self._send_json({'error': 'Texts must be a non-empty list'}, 400)
+                embeddings = model.encode(data['texts']).tolist()
+                return self._send_json({'embeddings': embeddings, 'count': len(embeddings)})
+            self._send_json({'error': 'Not found'}, 404)
+
+    return EmbeddingHandler
+
+
+def make_search_handler(model: StubModel, products: List[Dict]):
+    """Handler implementing POST /api/search over an in-memory product matrix"""
+    matrix = model.encode([p['text'] for p in products]).astype(np.float32)
+
+    class SearchHandler(_JsonHandler):
+        def do_GET(self):
+            if self.path == '/api/search/health':
+                self._send_json({'status': 'UP'})
+            else:
+                self._send_json({'error': 'Not found'}, 404)
+
+        def do_POST(self):
+            data = self._read_json()
+            if self.path != '/api/search' or not data or not data.get('query'):
+                return self._send_json({'error': 'Bad request'}, 400)
+            limit = int(data.get('limit', 10))
+            scores = matrix @ model.encode_one(data['query'])
+            top = np.argsort(-scores)[:limit]
+            results = [{
+                'productId': products[i]['product_id'],
+                'title': products[i]['title'],
+                'similarityScore': float(scores[i]),
+            } for i in top]
+            self._send_json({'results': results, 'total': len(results),
+                             'maxScore': results[0]['similarityScore'] if results else None})
+
+    return SearchHandler
+
+
+class StubServer:
+    """Runs a handler on 127.0.0.1 in a background thread; use as a context manager"""
+
+    def __init__(self, handler_class, port: int = 0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> 'StubServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the stub embedding service')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--cost-per-token-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with StubServer(make_embedding_handler(StubModel(cost_per_token_ms=args.cost_per_token_ms)), args.port) as s:
+        print(f"Stub embedding service listening on {s.url}")
+        try:
+            s.thread.join()
+        except KeyboardInterrupt:
+            pass
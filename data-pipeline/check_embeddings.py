@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Embedding integrity scanner for E-commerce Semantic Search
+Streams every products.embedding through a server-side cursor and checks the
+blocks in parallel worker processes: wrong dimensions, NaN/inf values, zero or
+non-unit norms, exact duplicate vectors (hash of the raw float32 bytes) and
+near-duplicate vectors (random-hyperplane buckets, verified by cosine within
+each bucket). A random sample is also re-embedded and compared with the stored
+vectors to catch rows left over from an older model. Offending product_ids are
+written out for targeted re-embedding
+"""
+
+import os
+import json
+import time
+import hashlib
+from collections import defaultdict, deque
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+
+from ingest_data import (
+    DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL, create_searchable_text,
+    get_embeddings_batch
+)
+
+DEFAULT_BLOCK_ROWS = 5000
+DEFAULT_NORM_TOLERANCE = 0.01
+DEFAULT_NEAR_THRESHOLD = 0.995
+DEFAULT_RECOMPUTE_THRESHOLD = 0.99
+# Near-duplicate search: independent hyperplane tables, sized so buckets hold
+# about this many rows; a pair is found if it shares a bucket in any table
+HASH_TABLES = 3
+TARGET_BUCKET_ROWS = 1024
+# Examples of each problem kept in the report (all ids go to --ids-out)
+REPORT_EXAMPLES = 20
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def column_dimension(conn, column: str = 'embedding') -> Optional[int]:
+    """Declared dimension of a vector(n) column, None if undeclared"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT atttypmod FROM pg_attribute
+            WHERE attrelid = 'products'::regclass AND attname = %s AND NOT attisdropped
+        """, (column,))
+        row = cursor.fetchone()
+    return row[0] if row and row[0] > 0 else None
+
+
+def hash_planes(dim: int, rows: int, seed: int = 7) -> np.ndarray:
+    """(tables, bits, dim) random hyperplanes, with enough bits per table for TARGET_BUCKET_ROWS"""
+    bits = int(np.clip(np.ceil(np.log2(max(rows, 1) / TARGET_BUCKET_ROWS)), 1, 24))
+    return np.random.default_rng(seed).standard_normal((HASH_TABLES, bits, dim)).astype(np.float32)
+
+
+def stream_blocks(conn, block_rows: int, column: str = 'embedding') -> Iterator[Tuple[List[str], List[str]]]:
+    """(product_ids, pgvector texts) blocks from a server-side cursor; parsing is left to the workers"""
+    with conn.cursor(name='check_embeddings_scan') as cursor:
+        cursor.itersize = block_rows
+        cursor.execute(f"SELECT product_id, {column}::text FROM products WHERE {column} IS NOT NULL ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(block_rows)
+            if not rows:
+                break
+            yield [row[0] for row in rows], [row[1] for row in rows]
+
+
+def check_block(task: Dict) -> Dict:
+    """
+    Worker: parse one block, run the per-row checks, hash every row, and
+    write the normalized valid rows into the shared memmap at their offset
+    for the near-duplicate pass.
+    """
+    start, texts, dim = task['start'], task['texts'], task['dim']
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    wrong_dim, non_finite = [], []
+    digests = np.zeros(len(texts), dtype=np.uint64)
+    for i, text in enumerate(texts):
+        values = np.array(text[1:-1].split(','), dtype=np.float32) if len(text) > 2 else np.zeros(0, np.float32)
+        digests[i] = int.from_bytes(hashlib.blake2b(values.tobytes(), digest_size=8).digest(), 'little')
+        if values.shape[0] != dim:
+            wrong_dim.append(i)
+        elif not np.isfinite(values).all():
+            non_finite.append(i)
+        else:
+            vectors[i] = values
+
+    norms = np.linalg.norm(vectors, axis=1)
+    valid = np.ones(len(texts), dtype=bool)
+    valid[wrong_dim + non_finite] = False
+    zero_norm = np.flatnonzero(valid & (norms == 0))
+    valid[zero_norm] = False
+    not_normalized = np.flatnonzero(valid & (np.abs(norms - 1.0) > task['norm_tolerance']))
+
+    normalized = vectors / np.maximum(norms, 1e-12)[:, None]
+    normalized[~valid] = 0
+    matrix = np.memmap(task['memmap_path'], dtype=np.float32, mode='r+', shape=(task['capacity'], dim))
+    matrix[start:start + len(texts)] = normalized
+    matrix.flush()
+    del matrix
+
+    # Bucket key per hash table from the signs of the hyperplane projections
+    planes = task['planes']
+    weights = (1 << np.arange(planes.shape[1], dtype=np.uint32)).astype(np.uint32)
+    buckets = np.stack([((normalized @ table.T) > 0).astype(np.uint32) @ weights for table in planes], axis=1)
+
+    return {
+        'start': start,
+        'wrong_dim': [start + i for i in wrong_dim],
+        'non_finite': [start + i for i in non_finite],
+        'zero_norm': (start + zero_norm).tolist(),
+        'not_normalized': (start + not_normalized).tolist(),
+        'norms': norms[valid].astype(np.float32),
+        'valid': valid,
+        'digests': digests,
+        'buckets': buckets,
+    }
+
+
+def near_duplicates_in(task: Dict) -> List[Tuple[int, int, float]]:
+    """Worker: pairs of rows within each bucket whose cosine reaches the threshold"""
+    matrix = np.memmap(task['memmap_path'], dtype=np.float32, mode='r', shape=(task['capacity'], task['dim']))
+    pairs = []
+    for rows in task['buckets']:
+        vectors = np.asarray(matrix[rows])
+        for offset in range(0, len(rows), TARGET_BUCKET_ROWS):
+            sims = vectors[offset:offset + TARGET_BUCKET_ROWS] @ vectors.T
+            for i, j in zip(*np.nonzero(sims >= task['threshold'])):
+                a, b = int(rows[offset + i]), int(rows[j])
+                if a < b:
+                    pairs.append((a, b, float(sims[i, j])))
+    return pairs
+
+
+def run_bounded(pool: Pool, func, tasks, workers: int) -> Iterator:
+    """Submit tasks with at most 2 x workers outstanding, yielding results in order"""
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(func, (task,)))
+        if len(pending) >= 2 * workers:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def group_buckets(buckets: np.ndarray, valid: np.ndarray, rows_per_task: int) -> Iterator[List[np.ndarray]]:
+    """Row index arrays of buckets with 2+ rows, packed into tasks of about rows_per_task rows"""
+    for table in range(buckets.shape[1]):
+        rows = np.flatnonzero(valid)
+        keys = buckets[rows, table]
+        order = np.argsort(keys, kind='stable')
+        rows, keys = rows[order], keys[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        task, size = [], 0
+        for group in np.split(rows, bounds):
+            if len(group) < 2:
+                continue
+            task.append(group)
+            size += len(group)
+            if size >= rows_per_task:
+                yield task
+                task, size = [], 0
+        if task:
+            yield task
+
+
+def recompute_sample(conn, sample: int, batch_url: str, threshold: float, column: str = 'embedding',
+                     seed: float = 0.42) -> Dict:
+    """Re-embed a random sample of products and compare with the stored vectors"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT setseed(%s)", (seed,))
+        cursor.execute(f"""
+            SELECT product_id, title, description, brand, category, {column}::text FROM products
+            WHERE {column} IS NOT NULL ORDER BY random() LIMIT %s
+        """, (sample,))
+        rows = cursor.fetchall()
+    conn.rollback()
+    if not rows:
+        return {'sampled': 0}
+
+    similarities, stale = [], []
+    for i in range(0, len(rows), 100):
+        batch = rows[i:i + 100]
+        texts = [create_searchable_text({'title': r[1], 'description': r[2], 'brand': r[3], 'category': r[4]})
+                 for r in batch]
+        fresh = get_embeddings_batch(texts, batch_url)
+        if fresh is None:
+            raise RuntimeError('Embedding service failed while recomputing the sample')
+        for row, vector in zip(batch, fresh):
+            stored = np.array(row[5][1:-1].split(','), dtype=np.float32)
+            vector = np.asarray(vector, dtype=np.float32)
+            if stored.shape != vector.shape or not np.isfinite(stored).all():
+                similarity = float('nan')
+            else:
+                similarity = float(stored @ vector / max(np.linalg.norm(stored) * np.linalg.norm(vector), 1e-12))
+            similarities.append(similarity)
+            if not similarity >= threshold:
+                stale.append(row[0])
+
+    finite = np.asarray([s for s in similarities if s == s])
+    return {
+        'sampled': len(rows),
+        'threshold': threshold,
+        'similarity': {f"p{p}": round(float(np.percentile(finite, p)), 4) for p in (1, 5, 50)} if len(finite) else None,
+        'below_threshold': len(stale),
+        'below_threshold_fraction': round(len(stale) / len(rows), 4),
+        'stale_ids': stale,
+    }
+
+
+def scan(workers: int = 4, block_rows: int = DEFAULT_BLOCK_ROWS, dim: Optional[int] = None,
+         norm_tolerance: float = DEFAULT_NORM_TOLERANCE, near_threshold: Optional[float] = DEFAULT_NEAR_THRESHOLD,
+         sample: int = 0, recompute_threshold: float = DEFAULT_RECOMPUTE_THRESHOLD,
+         batch_url: str = EMBEDDING_BATCH_URL, work_dir: str = '/tmp', column: str = 'embedding') -> Dict:
+    """Scan all embeddings; returns the report with an 'offenders' map of product_id -> reasons"""
+    started = time.perf_counter()
+    conn = connect()
+    dim = dim or column_dimension(conn, column) or 384
+    conn.rollback()
+    # One snapshot for the count and the scan, so offsets cannot overrun the memmap
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM products WHERE {column} IS NOT NULL")
+        capacity = cursor.fetchone()[0]
+    memmap_path = os.path.join(work_dir, f"check_embeddings_{os.getpid()}.f32")
+    np.memmap(memmap_path, dtype=np.float32, mode='w+', shape=(max(capacity, 1), dim)).flush()
+    planes = hash_planes(dim, capacity)
+    print(f"Scanning {capacity} embeddings ({dim} dims) with {workers} workers in blocks of {block_rows}")
+
+    product_ids: List[str] = []
+    problems: Dict[str, List[int]] = defaultdict(list)
+    norms, valid, digests, buckets = [], [], [], []
+
+    def tasks():
+        for ids, texts in stream_blocks(conn, block_rows, column):
+            start = len(product_ids)
+            product_ids.extend(ids)
+            yield {'start': start, 'texts': texts, 'dim': dim, 'norm_tolerance': norm_tolerance,
+                   'memmap_path': memmap_path, 'capacity': max(capacity, 1), 'planes': planes}
+
+    try:
+        with Pool(workers) as pool:
+            for result in run_bounded(pool, check_block, tasks(), workers):
+                for check in ('wrong_dim', 'non_finite', 'zero_norm', 'not_normalized'):
+                    problems[check].extend(result[check])
+                norms.append(result['norms'])
+                valid.append(result['valid'])
+                digests.append(result['digests'])
+                buckets.append(result['buckets'])
+                if len(valid) % 20 == 0:
+                    print(f"  {len(product_ids)} rows scanned")
+            conn.rollback()
+            scan_seconds = time.perf_counter() - started
+
+            valid = np.concatenate(valid) if valid else np.zeros(0, dtype=bool)
+            digests = np.concatenate(digests) if digests else np.zeros(0, dtype=np.uint64)
+
+            # Exact duplicates: rows sharing the hash of their raw float32 bytes
+            by_digest = defaultdict(list)
+            for row, digest in enumerate(digests):
+                by_digest[int(digest)].append(row)
+            exact_groups = [rows for rows in by_digest.values() if len(rows) > 1]
+            for rows in exact_groups:
+                problems['exact_duplicate'].extend(rows)
+
+            # Near duplicates: cosine within shared hyperplane buckets, excluding exact copies
+            near_pairs = set()
+            if near_threshold is not None and len(valid):
+                bucket_tasks = ({'buckets': group, 'threshold': near_threshold, 'memmap_path': memmap_path,
+                                 'capacity': max(capacity, 1), 'dim': dim}
+                                for group in group_buckets(np.concatenate(buckets), valid, 16 * TARGET_BUCKET_ROWS))
+                for pairs in run_bounded(pool, near_duplicates_in, bucket_tasks, workers):
+                    near_pairs.update((a, b, round(sim, 6)) for a, b, sim in pairs if digests[a] != digests[b])
+            for a, b, _ in near_pairs:
+                problems['near_duplicate'].extend((a, b))
+    finally:
+        os.remove(memmap_path)
+
+    offenders: Dict[str, List[str]] = defaultdict(list)
+    for check, rows in problems.items():
+        for row in sorted(set(rows)):
+            offenders[product_ids[row]].append(check)
+
+    recompute = None
+    if sample:
+        conn.set_session(isolation_level='READ COMMITTED', readonly=True)
+        recompute = recompute_sample(conn, sample, batch_url, recompute_threshold, column)
+        for product_id in recompute.pop('stale_ids'):
+            offenders[product_id].append('recompute_mismatch')
+    conn.close()
+
+    norms = np.concatenate(norms) if norms else np.zeros(0, dtype=np.float32)
+    checks = {check: {'count': len(set(rows)), 'examples': [product_ids[r] for r in sorted(set(rows))[:REPORT_EXAMPLES]]}
+              for check, rows in problems.items()}
+    checks.setdefault('exact_duplicate', {'count': 0, 'examples': []})['groups'] = len(exact_groups)
+    checks.setdefault('near_duplicate', {'count': 0, 'examples': []})['pairs'] = len(near_pairs)
+    checks['near_duplicate']['example_pairs'] = [
+        [product_ids[a], product_ids[b], sim] for a, b, sim in sorted(near_pairs, key=lambda p: -p[2])[:REPORT_EXAMPLES]
+    ]
+    return {
+        'rows': len(product_ids),
+        'dimension': dim,
+        'workers': workers,
+        'scan_seconds': round(scan_seconds, 2),
+        'rows_per_sec': round(len(product_ids) / scan_seconds, 1) if scan_seconds else None,
+        'norm': {f"p{p}": round(float(np.percentile(norms, p)), 5) for p in (0, 1, 50, 99, 100)} if len(norms) else None,
+        'checks': checks,
+        'recompute': recompute,
+        'offending_products': len(offenders),
+        'offenders': dict(offenders),
+    }
+
+
+def reembed_products(product_ids: List[str], batch_url: str = EMBEDDING_BATCH_URL, batch_size: int = 256) -> int:
+    """Re-embed the given products from their current text"""
+    from embedding_worker import reembed
+
+    conn = connect()
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM products WHERE product_id = ANY(%s) ORDER BY id", (product_ids,))
+        ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    written = 0
+    for i in range(0, len(ids), batch_size):
+        count, _ = reembed(conn, ids[i:i + batch_size], batch_url, track=False)
+        written += count
+        print(f"  {written}/{len(ids)} re-embedded")
+    conn.close()
+    return written
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check every stored embedding and list offending products')
+    parser.add_argument('command', nargs='?', choices=['scan', 'reembed'], default='scan',
+                        help='scan: check all embeddings; reembed: re-embed the products listed in --ids-in')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--block-rows', type=int, default=DEFAULT_BLOCK_ROWS, help='Rows per worker task')
+    parser.add_argument('--dim', type=int, help='Expected dimension (default: declared column dimension)')
+    parser.add_argument('--column', default='embedding')
+    parser.add_argument('--norm-tolerance', type=float, default=DEFAULT_NORM_TOLERANCE,
+                        help='Allowed |norm - 1| (the service stores unit vectors)')
+    parser.add_argument('--near-threshold', type=float, default=DEFAULT_NEAR_THRESHOLD,
+                        help='Cosine at which distinct vectors count as near duplicates')
+    parser.add_argument('--no-near', action='store_true', help='Skip the near-duplicate pass')
+    parser.add_argument('--sample', type=int, default=200, help='Products to re-embed and compare (0 to skip)')
+    parser.add_argument('--recompute-threshold', type=float, default=DEFAULT_RECOMPUTE_THRESHOLD)
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--work-dir', default='/tmp', help='Where the temporary vector file is written')
+    parser.add_argument('--output', help='Write the full JSON report here')
+    parser.add_argument('--ids-out', default='offending_products.txt', help='Offending product_ids and their checks (tab-separated), one per line')
+    parser.add_argument('--ids-in', help='reembed: product_ids to re-embed, one per line (default: --ids-out)')
+
+    args = parser.parse_args()
+
+    if args.command == 'reembed':
+        with open(args.ids_in or args.ids_out, 'r', encoding='utf-8') as f:
+            ids = [line.split('\t')[0].strip() for line in f if line.strip()]
+        print(f"{reembed_products(ids, args.batch_url)} products re-embedded")
+    else:
+        report = scan(args.workers, args.block_rows, args.dim, args.norm_tolerance,
+                      None if args.no_near else args.near_threshold, args.sample, args.recompute_threshold,
+                      args.batch_url, args.work_dir, args.column)
+        offenders = report.pop('offenders')
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({**report, 'offenders': offenders}, f, indent=2)
+        with open(args.ids_out, 'w', encoding='utf-8') as f:
+            for product_id, reasons in sorted(offenders.items()):
+                f.write(f"{product_id}\t{','.join(reasons)}\n")
+        print(json.dumps(report, indent=2))
+        print(f"{len(offenders)} offending products written to {args.ids_out}")
+        if offenders:
+            raise SystemExit(1)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for product ingestion
+MinHash/LSH over word shingles of the searchable text catches relisted and
+reseller copies before they are embedded; blocked cosine similarity over each
+batch's embeddings catches paraphrased variants. One canonical product per
+cluster is indexed, and every duplicate is recorded against it in a side table
+"""
+
+import re
+import json
+import zlib
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+DUPLICATES_DDL = """
+CREATE TABLE IF NOT EXISTS product_duplicates (
+    product_id VARCHAR(255) PRIMARY KEY,
+    canonical_id VARCHAR(255) NOT NULL,
+    method TEXT NOT NULL,              -- 'minhash' or 'cosine'
+    similarity REAL,
+    product JSONB,                     -- the variant as ingested, so nothing is lost
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS product_duplicates_canonical_idx ON product_duplicates (canonical_id);
+"""
+
+# (product_id, canonical_id, method, similarity)
+Duplicate = Tuple[str, str, str, float]
+
+
+def shingles(text: str, size: int = 3) -> List[str]:
+    """Word n-grams of lowercased text; short texts yield a single shingle"""
+    words = re.findall(r'\w+', text.lower())
+    if len(words) <= size:
+        return [' '.join(words)] if words else []
+    return [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class MinHasher:
+    """MinHash signatures from universal hashes (a*x + b) mod p over crc32 shingle hashes"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, tokens: Sequence[str]) -> np.ndarray:
+        if not tokens:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint32)
+        hashes = np.fromiter((zlib.crc32(t.encode('utf-8')) for t in set(tokens)), dtype=np.uint64)
+        hashes %= MERSENNE_PRIME
+        # a, h < 2^31, so a * h + b fits comfortably in uint64
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+def cosine_duplicates(embeddings: np.ndarray, threshold: float, block_size: int = 1024) -> List[Tuple[int, int, float]]:
+    """
+    Greedy within-batch clustering: each row is a duplicate of the most similar
+    earlier row that was kept, if that similarity reaches threshold. Similarities
+    are computed a block of rows at a time to bound memory.
+    Returns (row, canonical_row, similarity) for the duplicates.
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    kept = np.zeros(len(vectors), dtype=bool)
+    duplicates = []
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size] @ vectors[:start + block_size].T
+        for offset, sims in enumerate(block):
+            row = start + offset
+            candidates = np.where(kept[:row], sims[:row], -np.inf)
+            best = int(np.argmax(candidates)) if row else -1
+            if best >= 0 and candidates[best] >= threshold:
+                duplicates.append((row, best, float(candidates[best])))
+            else:
+                kept[row] = True
+    return duplicates
+
+
+class Deduplicator:
+    """
+    Streaming near-duplicate filter shared by the ingestion workers.
+
+    The LSH index (bands x rows of each signature) and canonical signatures are
+    kept for the whole run, so duplicates are caught across batches; first seen
+    wins. Memory is roughly num_perm * 4 bytes plus `bands` dict entries per
+    canonical product (~0.5 KB at the defaults).
+    """
+
+    def __init__(self, jaccard_threshold: float = 0.8, cosine_threshold: Optional[float] = 0.97,
+                 num_perm: int = 64, bands: int = 8, shingle_size: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.jaccard_threshold = jaccard_threshold
+        self.cosine_threshold = cosine_threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm, seed)
+        self._buckets = {}      # (band, band hash) -> canonical ids
+        self._signatures = {}   # canonical id -> signature
+        self._canonical_of = {}  # ids dropped after LSH registration -> their canonical
+        self._lock = threading.Lock()
+        self.stats = {'seen': 0, 'minhash_duplicates': 0, 'cosine_duplicates': 0}
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, int]]:
+        return [(band, hash(signature[band * self.rows:(band + 1) * self.rows].tobytes()))
+                for band in range(self.bands)]
+
+    def _resolve(self, product_id: str) -> str:
+        while product_id in self._canonical_of:
+            product_id = self._canonical_of[product_id]
+        return product_id
+
+    def filter_text(self, ids: List[str], texts: List[str]) -> Tuple[List[bool], List[Duplicate]]:
+        """Keep-mask and MinHash duplicates for a batch; kept items become canonicals"""
+        signatures = [self.hasher.signature(shingles(text, self.shingle_size)) for text in texts]
+        keep, duplicates = [], []
+        with self._lock:
+            for product_id, signature in zip(ids, signatures):
+                self.stats['seen'] += 1
+                keys = self._band_keys(signature)
+                best, best_sim = None, 0.0
+                candidates = {c for key in keys for c in self._buckets.get(key, ())}
+                for candidate in candidates:
+                    if candidate == product_id:
+                        continue
+                    similarity = float(np.mean(self._signatures[candidate] == signature))
+                    if similarity >= self.jaccard_threshold and similarity > best_sim:
+                        best, best_sim = candidate, similarity
+                if best is not None:
+                    keep.append(False)
+                    duplicates.append((product_id, self._resolve(best), 'minhash', best_sim))
+                    self.stats['minhash_duplicates'] += 1
+                    continue
+                keep.append(True)
+                self._signatures[product_id] = signature
+                for key in keys:
+                    self._buckets.setdefault(key, []).append(product_id)
+        return keep, duplicates
+
+    def filter_embeddings(self, ids: List[str], embeddings: List[List[float]]) -> Tuple[List[bool], List[Duplicate]]:
+        """Keep-mask and cosine duplicates within one batch of embeddings"""
+        keep = [True] * len(ids)
+        if self.cosine_threshold is None or len(ids) < 2:
+            return keep, []
+        duplicates = []
+        with self._lock:
+            for row, canonical_row, similarity in cosine_duplicates(np.asarray(embeddings), self.cosine_threshold):
+                keep[row] = False
+                canonical = self._resolve(ids[canonical_row])
+                # Later text matches against this product resolve to its canonical
+                self._canonical_of[ids[row]] = canonical
+                duplicates.append((ids[row], canonical, 'cosine', similarity))
+                self.stats['cosine_duplicates'] += 1
+        return keep, duplicates
+
+    def summary(self) -> Dict:
+        dropped = self.stats['minhash_duplicates'] + self.stats['cosine_duplicates']
+        return {**self.stats, 'canonical': self.stats['seen'] - dropped,
+                'duplicate_rate': round(dropped / self.stats['seen'], 4) if self.stats['seen'] else 0.0}
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(DUPLICATES_DDL)
+    conn.commit()
+
+
+def insert_duplicates(conn, duplicates: List[Duplicate], products: Dict[str, Dict],
+                      canonical_ids: Sequence[str] = ()) -> int:
+    """
+    Record duplicate -> canonical mappings (with the variant's raw fields).
+    canonical_ids are the products written as canonical in the same batch;
+    mappings left over from an earlier load that list them (or this batch's
+    canonicals) as duplicates are removed. Errors are rolled back and raised.
+    """
+    canonical = set(canonical_ids) | {canonical_id for _, canonical_id, _, _ in duplicates}
+    if not canonical:
+        return 0
+    from psycopg2.extras import execute_values
+
+    rows = {
+        product_id: (product_id, canonical_id, method, similarity,
+                     json.dumps(products.get(product_id, {}), default=str))
+        for product_id, canonical_id, method, similarity in duplicates
+    }
+    cursor = conn.cursor()
+    try:
+        # A reload in a different order can make an old duplicate canonical; its
+        # old mapping would otherwise list both X -> Y and Y -> X
+        cursor.execute("DELETE FROM product_duplicates WHERE product_id = ANY(%s)", (list(canonical),))
+        if rows:
+            execute_values(cursor, """
+                INSERT INTO product_duplicates (product_id, canonical_id, method, similarity, product) VALUES %s
+                ON CONFLICT (product_id) DO UPDATE SET
+                    canonical_id = EXCLUDED.canonical_id, method = EXCLUDED.method,
+                    similarity = EXCLUDED.similarity, product = EXCLUDED.product
+            """, list(rows.values()), page_size=len(rows))
+            # A product that is now a duplicate should not linger in the index from an earlier load
+            cursor.execute("DELETE FROM products WHERE product_id = ANY(%s)", (list(rows),))
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+if __name__ == '__main__':
+    import os
+    import argparse
+    from collections import Counter
+
+    from ingest_data import create_searchable_text, iter_amazon_records, product_id_of
+
+    parser = argparse.ArgumentParser(description='Dry run: report near-duplicate clusters in a product file (MinHash only)')
+    parser.add_argument('--data-file', default=os.getenv('DATA_FILE', 'data/amazon_products.json'))
+    parser.add_argument('--jaccard', type=float, default=0.8)
+    parser.add_argument('--num-perm', type=int, default=64)
+    parser.add_argument('--bands', type=int, default=8)
+    parser.add_argument('--examples', type=int, default=5, help='Largest clusters to print')
+
+    args = parser.parse_args()
+
+    deduper = Deduplicator(args.jaccard, None, args.num_perm, args.bands)
+    titles, clusters = {}, Counter()
+    for batch in iter_amazon_records(args.data_file, 1000):
+        ids = [str(product_id_of(product)) for product in batch]
+        _, duplicates = deduper.filter_text(ids, [create_searchable_text(product) for product in batch])
+        titles.update({pid: product.get('title') or product.get('product_name') for pid, product in zip(ids, batch)})
+        clusters.update(canonical for _, canonical, _, _ in duplicates)
+
+    print(json.dumps(deduper.summary(), indent=2))
+    for canonical, count in clusters.most_common(args.examples):
+        print(f"{count + 1:>5} x {canonical}: {str(titles.get(canonical))[:80]}")
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Incremental embedding worker for E-commerce Semantic Search
+Listens for product text edits made directly in Postgres (notified by the
+notify_products_text_changed trigger), coalesces them into micro-batches,
+re-embeds only those rows through /embed/batch and writes the vectors back in
+bulk. After downtime it catches up from its stored updated_at watermark
+"""
+
+import json
+import time
+import select
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from ingest_data import (
+    DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL, create_searchable_text,
+    get_embeddings_batch
+)
+
+CHANNEL = 'product_text_changed'
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT = 0.5
+# Edits whose transaction started before the watermark but committed after it
+# are re-read on catch-up if they fall within this window
+WATERMARK_OVERLAP_SECONDS = 60
+
+# Same trigger as infrastructure/init-db.sql, for databases created before it
+TRIGGER_SQL = f"""
+CREATE OR REPLACE FUNCTION notify_product_text_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('{CHANNEL}',
+        json_build_object('id', NEW.id, 'at', extract(epoch FROM clock_timestamp()))::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS notify_products_text_changed ON products;
+CREATE TRIGGER notify_products_text_changed AFTER UPDATE OF title, description, brand, category ON products
+    FOR EACH ROW
+    WHEN ((OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description
+           OR OLD.brand IS DISTINCT FROM NEW.brand OR OLD.category IS DISTINCT FROM NEW.category)
+          AND OLD.embedding IS NOT DISTINCT FROM NEW.embedding)
+    EXECUTE FUNCTION notify_product_text_changed();
+
+DROP TRIGGER IF EXISTS notify_products_inserted_without_embedding ON products;
+CREATE TRIGGER notify_products_inserted_without_embedding AFTER INSERT ON products
+    FOR EACH ROW WHEN (NEW.embedding IS NULL)
+    EXECUTE FUNCTION notify_product_text_changed();
+"""
+
+STATE_DDL = """
+CREATE TABLE IF NOT EXISTS embedding_worker_state (
+    channel TEXT PRIMARY KEY,
+    watermark TIMESTAMP NOT NULL,      -- edits up to here (less the overlap) are embedded
+    rows_embedded BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def install(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(TRIGGER_SQL)
+        cursor.execute(STATE_DDL)
+    conn.commit()
+
+
+def load_watermark(conn):
+    """Stored watermark, or now() (recorded) on first start: there is nothing to catch up on yet"""
+    with conn.cursor() as cursor:
+        cursor.execute(STATE_DDL)
+        cursor.execute("""
+            INSERT INTO embedding_worker_state (channel, watermark) VALUES (%s, now())
+            ON CONFLICT (channel) DO NOTHING
+        """, (CHANNEL,))
+        cursor.execute("SELECT watermark FROM embedding_worker_state WHERE channel = %s", (CHANNEL,))
+        watermark = cursor.fetchone()[0]
+    conn.commit()
+    return watermark
+
+
+def reembed(conn, ids: List[int], batch_url: str, watermark=None,
+            track: bool = True) -> Tuple[int, Optional[float]]:
+    """
+    Embed the current text of these products and write the vectors back in one
+    statement. Products left without searchable text lose their embedding.
+    With a watermark, advances the stored one in the same transaction; with
+    track=False (callers outside the worker) the worker state is left alone.
+    Returns (rows written, database time of the commit as epoch seconds).
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id, title, description, brand, category FROM products WHERE id = ANY(%s)",
+                       (list(ids),))
+        rows = cursor.fetchall()
+        texts = {row[0]: create_searchable_text({'title': row[1], 'description': row[2], 'brand': row[3],
+                                                 'category': row[4]}) for row in rows}
+        embed_ids = [product_id for product_id, text in texts.items() if text.strip()]
+        values = []
+        if embed_ids:
+            embeddings = get_embeddings_batch([texts[i] for i in embed_ids], batch_url)
+            if embeddings is None:
+                conn.rollback()
+                raise RuntimeError(f"Embedding service failed for {len(embed_ids)} products")
+            values = [(product_id, str(embedding)) for product_id, embedding in zip(embed_ids, embeddings)]
+        values += [(product_id, None) for product_id, text in texts.items() if not text.strip()]
+        if values:
+            execute_values(cursor, """
+                UPDATE products p SET embedding = v.embedding::vector
+                FROM (VALUES %s) AS v (id, embedding) WHERE p.id = v.id
+            """, values, page_size=len(values))
+        if track:
+            cursor.execute("""
+                UPDATE embedding_worker_state
+                SET watermark = greatest(watermark, coalesce(%s, watermark)), rows_embedded = rows_embedded + %s,
+                    updated_at = now()
+                WHERE channel = %s
+            """, (watermark, len(values), CHANNEL))
+        cursor.execute("SELECT extract(epoch FROM clock_timestamp())")
+        committed_at = float(cursor.fetchone()[0])
+    conn.commit()
+    return len(values), committed_at
+
+
+def catch_up(conn, watermark, batch_size: int, batch_url: str) -> int:
+    """
+    Re-embed everything updated since the watermark (less the overlap), which
+    covers edits made while the worker was down. This is a superset of the
+    text edits: updated_at also moves for price or vector changes.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT now()")
+        started = cursor.fetchone()[0]
+        cursor.execute(f"""
+            SELECT id FROM products
+            WHERE updated_at > %s - interval '{WATERMARK_OVERLAP_SECONDS} seconds'
+            ORDER BY updated_at
+        """, (watermark,))
+        ids = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    print(f"Catching up on {len(ids)} products updated since {watermark}")
+    written = 0
+    for i in range(0, len(ids), batch_size):
+        last = i + batch_size >= len(ids)
+        count, _ = reembed(conn, ids[i:i + batch_size], batch_url, started if last else None)
+        written += count
+    if not ids:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE embedding_worker_state SET watermark = greatest(watermark, %s) WHERE channel = %s",
+                           (started, CHANNEL))
+        conn.commit()
+    return written
+
+
+def drain(listener, pending: Dict[int, float]):
+    """Move delivered notifications into pending (id -> earliest notify time)"""
+    listener.poll()
+    while listener.notifies:
+        notify = listener.notifies.pop(0)
+        try:
+            payload = json.loads(notify.payload)
+            product_id, at = int(payload['id']), float(payload['at'])
+        except (ValueError, KeyError, TypeError):
+            continue
+        pending[product_id] = min(pending.get(product_id, at), at)
+
+
+class Stats:
+    """Throughput and freshness lag (notify -> vector committed) over a reporting window"""
+
+    def __init__(self):
+        self.rows = 0
+        self.batches = 0
+        self.lags: List[float] = []
+        self.window_started = time.perf_counter()
+
+    def record(self, rows: int, lags: List[float]):
+        self.rows += rows
+        self.batches += 1
+        self.lags.extend(lags)
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.window_started
+        lags = np.asarray(self.lags) if self.lags else np.zeros(1)
+        line = (f"{self.rows} rows in {self.batches} batches, {self.rows / elapsed:.1f} rows/s; "
+                f"lag p50 {np.percentile(lags, 50):.2f}s p95 {np.percentile(lags, 95):.2f}s "
+                f"max {lags.max():.2f}s")
+        self.__init__()
+        return line
+
+
+def run(max_batch: int = DEFAULT_MAX_BATCH, max_wait: float = DEFAULT_MAX_WAIT, batch_url: str = EMBEDDING_BATCH_URL,
+        report_every: float = 60.0, catch_up_first: bool = True):
+    """
+    LISTEN, then catch up from the watermark, then serve notifications.
+
+    Listening starts before the catch-up scan, so an edit made during the scan
+    is either in the scan or queued as a notification (or both; re-embedding
+    is idempotent). A batch is flushed when it reaches max_batch products or
+    its oldest notification has waited max_wait seconds.
+    """
+    listener = connect()
+    listener.autocommit = True
+    with listener.cursor() as cursor:
+        cursor.execute(f"LISTEN {CHANNEL}")
+    conn = connect()
+    watermark = load_watermark(conn)
+
+    if catch_up_first:
+        written = catch_up(conn, watermark, max_batch, batch_url)
+        print(f"Caught up: {written} products re-embedded")
+    print(f"Listening on '{CHANNEL}' (batches of <= {max_batch}, <= {max_wait}s wait)")
+
+    pending: Dict[int, float] = {}
+    first_seen: Optional[float] = None
+    stats = Stats()
+    last_report = time.perf_counter()
+    try:
+        while True:
+            timeout = report_every
+            if first_seen is not None:
+                timeout = max(0.0, max_wait - (time.perf_counter() - first_seen))
+            if select.select([listener], [], [], timeout)[0]:
+                drain(listener, pending)
+                if pending and first_seen is None:
+                    first_seen = time.perf_counter()
+
+            due = first_seen is not None and time.perf_counter() - first_seen >= max_wait
+            if pending and (len(pending) >= max_batch or due):
+                batch: Set[int] = set(list(pending)[:max_batch])
+                notified = {product_id: pending.pop(product_id) for product_id in batch}
+                try:
+                    if conn is None:
+                        conn = connect()
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT now()")
+                        batch_started = cursor.fetchone()[0]
+                    conn.commit()
+                    # Only advance the watermark once nothing older is still queued
+                    rows, committed_at = reembed(conn, sorted(batch), batch_url, None if pending else batch_started)
+                except Exception as e:
+                    # Put the batch back and retry after a pause. A failed statement leaves the
+                    # transaction aborted, so roll it back; a lost connection is reopened
+                    print(f"Error re-embedding {len(batch)} products: {e}")
+                    pending.update(notified)
+                    if conn is not None and not conn.closed and not isinstance(e, psycopg2.OperationalError):
+                        conn.rollback()
+                    elif conn is not None:
+                        conn.close()
+                        conn = None
+                    time.sleep(5)
+                    continue
+                stats.record(rows, [committed_at - at for at in notified.values()])
+                first_seen = time.perf_counter() if pending else None
+
+            if time.perf_counter() - last_report >= report_every and stats.batches:
+                print(stats.report(), flush=True)
+                last_report = time.perf_counter()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        listener.close()
+        if conn is not None:
+            conn.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-embed products whose text is edited in Postgres')
+    parser.add_argument('command', nargs='?', choices=['run', 'install', 'catch-up'], default='run',
+                        help='install: create the notify triggers; catch-up: one watermark scan, then exit')
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH, help='Products per micro-batch')
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT,
+                        help='Seconds a notification may wait for its batch to fill')
+    parser.add_argument('--report-every', type=float, default=60.0, help='Seconds between throughput/lag reports')
+    parser.add_argument('--no-catch-up', action='store_true', help='Skip the watermark scan on startup')
+
+    args = parser.parse_args()
+
+    if args.command == 'install':
+        conn = connect()
+        install(conn)
+        conn.close()
+        print(f"Installed notify triggers on products (channel '{CHANNEL}')")
+    elif args.command == 'catch-up':
+        conn = connect()
+        written = catch_up(conn, load_watermark(conn), args.max_batch, args.batch_url)
+        conn.close()
+        print(f"{written} products re-embedded")
+    else:
+        run(args.max_batch, args.max_wait, args.batch_url, args.report_every, not args.no_catch_up)
@@ -6,17 +6,27 @@ Ingests Amazon products data and generates embeddings
 
 import os
 import json
+import threading
 import psycopg2
 import requests
 import pandas as pd
-from typing import List, Dict, Optional
+from http.client import HTTPConnection, HTTPSConnection
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+from psycopg2.extras import execute_values
 from tqdm import tqdm
 from dotenv import load_dotenv
 
+from partitioning import DEFAULT_PARTITION, category_root, load_partition_map
+from stage_timing import StageTimer
+
 load_dotenv()
 
 # Configuration
 EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL', 'http://localhost:8080/embed')
+EMBEDDING_BATCH_URL = os.getenv('EMBEDDING_BATCH_URL', EMBEDDING_SERVICE_URL.rstrip('/') + '/batch')
+EMBEDDING_STREAM_URL = os.getenv('EMBEDDING_STREAM_URL', EMBEDDING_SERVICE_URL.rstrip('/') + '/stream')
+INGEST_STREAMING = os.getenv('INGEST_STREAMING', '').lower() in ('1', 'true', 'yes')
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '5432')
 DB_NAME = os.getenv('DB_NAME', 'ecommerce')
@@ -40,6 +50,79 @@ def get_embedding(text: str, service_url: str) -> Optional[List[float]]:
         return None
 
 
+def get_embeddings_batch(texts: List[str], batch_url: str, model: Optional[str] = None) -> Optional[List[List[float]]]:
+    """Get embedding vectors for many texts in one call to /embed/batch (optionally from a registry model id)"""
+    try:
+        response = requests.post(
+            batch_url,
+            json={'texts': texts, 'model': model} if model else {'texts': texts},
+            timeout=120
+        )
+        response.raise_for_status()
+        return response.json().get('embeddings')
+    except Exception as e:
+        print(f"Error getting batch embeddings: {e}")
+        return None
+
+
+def _send_chunk(sock, lines: List[str]):
+    data = ('\n'.join(lines) + '\n').encode('utf-8')
+    sock.sendall(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+
+
+def embed_stream(items: Iterable[Tuple[str, str]], stream_url: str, lines_per_chunk: int = 64,
+                 timeout: float = 300) -> Iterator[Dict]:
+    """
+    Client for /embed/stream: a sender thread uploads (id, text) pairs as
+    chunked NDJSON while the caller reads result lines as they arrive.
+
+    Sending and receiving must overlap: the service writes results before it
+    has read the whole request, so a client that only reads after uploading
+    (as requests does) deadlocks once both sides' socket buffers fill.
+    """
+    url = urlsplit(stream_url)
+    conn = (HTTPSConnection if url.scheme == 'https' else HTTPConnection)(url.hostname, url.port, timeout=timeout)
+    conn.putrequest('POST', url.path + (f"?{url.query}" if url.query else ''))
+    conn.putheader('Content-Type', 'application/x-ndjson')
+    conn.putheader('Transfer-Encoding', 'chunked')
+    conn.endheaders()
+    # Send on the socket itself: once the response starts, HTTPConnection may
+    # hand its socket to the response and would reconnect on conn.send()
+    sock = conn.sock
+
+    send_errors = []
+
+    def send():
+        try:
+            lines = []
+            for item_id, text in items:
+                lines.append(json.dumps({'id': item_id, 'text': text}))
+                if len(lines) >= lines_per_chunk:
+                    _send_chunk(sock, lines)
+                    lines = []
+            if lines:
+                _send_chunk(sock, lines)
+            sock.sendall(b"0\r\n\r\n")
+        except Exception as e:
+            send_errors.append(e)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    try:
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"Stream request failed ({response.status}): {response.read()[:500]!r}")
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        conn.close()
+        sock.close()
+        sender.join(timeout=5)
+    if send_errors:
+        raise send_errors[0]
+
+
 def create_searchable_text(row: Dict) -> str:
     """Create searchable text from product fields"""
     parts = []
@@ -77,55 +160,171 @@ def load_amazon_data(file_path: str) -> pd.DataFrame:
     return df
 
 
+def iter_amazon_records(file_path: str, chunk_size: int = BATCH_SIZE) -> Iterator[List[Dict]]:
+    """Stream the dataset in chunks of records instead of loading it whole"""
+    if file_path.endswith('.json'):
+        chunk = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    chunk.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+    elif file_path.endswith('.csv'):
+        for df in pd.read_csv(file_path, chunksize=chunk_size):
+            yield df.to_dict('records')
+    else:
+        raise ValueError(f"Unsupported file format: {file_path}")
+
+
+UPSERT_COLUMNS = (
+    'product_id', 'title', 'description', 'category', 'brand',
+    'price', 'unit_price', 'rating', 'review_count', 'ranking', 'votes', 'image_url', 'amazon_url', 'embedding'
+)
+
+UPSERT_UPDATE_CLAUSE = """
+    DO UPDATE SET
+        title = EXCLUDED.title,
+        description = EXCLUDED.description,
+        category = EXCLUDED.category,
+        brand = EXCLUDED.brand,
+        price = EXCLUDED.price,
+        unit_price = EXCLUDED.unit_price,
+        rating = EXCLUDED.rating,
+        review_count = EXCLUDED.review_count,
+        ranking = EXCLUDED.ranking,
+        votes = EXCLUDED.votes,
+        image_url = EXCLUDED.image_url,
+        amazon_url = EXCLUDED.amazon_url,
+        embedding = EXCLUDED.embedding,
+        updated_at = CURRENT_TIMESTAMP
+"""
+UPSERT_CONFLICT_CLAUSE = "ON CONFLICT (product_id)" + UPSERT_UPDATE_CLAUSE
+# Partitioned products (see partitioning.py): product_id is unique per partition
+PARTITION_CONFLICT_CLAUSE = "ON CONFLICT (product_id, category_root)" + UPSERT_UPDATE_CLAUSE
+
+# category_root -> partition table; _NOT_LOADED until first looked up, None
+# when products is not partitioned. An empty map is still partitioned: every
+# row then goes to DEFAULT_PARTITION
+_NOT_LOADED = object()
+_partition_map = _NOT_LOADED
+
+
+def partition_map(conn) -> Optional[Dict[str, str]]:
+    global _partition_map
+    if _partition_map is _NOT_LOADED:
+        _partition_map = load_partition_map(conn)
+    return _partition_map
+
+
+def product_id_of(product: Dict):
+    """Product identifier under any of the supported field aliases"""
+    return product.get('product_id') or product.get('asin') or product.get('id')
+
+
+def product_row(product: Dict, embedding: List[float]) -> Tuple:
+    """Map a raw product record (any supported field aliases) to an UPSERT_COLUMNS row"""
+    unit_price = product.get('unit_price') or product.get('price')
+    ranking = product.get('ranking') or product.get('rank')
+    votes = product.get('votes') or product.get('vote_count') or product.get('review_count') or product.get('num_reviews')
+    amazon_url = product.get('amazon_url') or product.get('url') or product.get('product_url')
+    # Generate Amazon URL from product_id if not provided
+    if not amazon_url and product.get('product_id'):
+        product_id = product_id_of(product)
+        amazon_url = f"https://www.amazon.com/dp/{product_id}"
+
+    return (
+        product_id_of(product),
+        product.get('title') or product.get('product_name'),
+        product.get('description') or product.get('product_description'),
+        product.get('category') or product.get('main_cat'),
+        product.get('brand'),
+        product.get('price'),
+        unit_price,
+        product.get('rating') or product.get('average_rating'),
+        product.get('review_count') or product.get('num_reviews'),
+        ranking,
+        votes,
+        product.get('image_url') or product.get('image'),
+        amazon_url,
+        str(embedding)  # Convert list to string for pgvector
+    )
+
+
+def insert_products_bulk(conn, rows: List[Tuple]) -> int:
+    """
+    Upsert many UPSERT_COLUMNS rows in one statement and one commit. On a
+    database error the transaction is rolled back and the error re-raised,
+    so callers never count a failed batch as written.
+    """
+    if not rows:
+        return 0
+    # Postgres rejects an upsert that touches the same product_id twice
+    unique_rows = list({row[0]: row for row in rows}.values())
+    partitions = partition_map(conn)
+    cursor = conn.cursor()
+    try:
+        if partitions is None:
+            execute_values(
+                cursor,
+                f"INSERT INTO products ({', '.join(UPSERT_COLUMNS)}) VALUES %s {UPSERT_CONFLICT_CLAUSE}",
+                unique_rows,
+                page_size=len(unique_rows)
+            )
+        else:
+            insert_routed(cursor, unique_rows, partitions)
+        conn.commit()
+        return len(unique_rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def insert_routed(cursor, rows: List[Tuple], partitions: Dict[str, str]):
+    """
+    Upsert rows straight into their category partitions, one statement per
+    partition, skipping tuple routing through the parent table
+    """
+    groups = {}
+    for row in rows:
+        root = category_root(row[3])
+        groups.setdefault(partitions.get(root, DEFAULT_PARTITION), []).append(row + (root,))
+    # A product whose category moved must leave the partition it was in
+    execute_values(cursor, """
+        DELETE FROM products p USING (VALUES %s) AS v (product_id, category_root)
+        WHERE p.product_id = v.product_id AND p.category_root <> v.category_root
+    """, [(row[0], row[-1]) for group in groups.values() for row in group], page_size=len(rows))
+    for table, group in groups.items():
+        execute_values(
+            cursor,
+            f"INSERT INTO {table} ({', '.join(UPSERT_COLUMNS)}, category_root) VALUES %s {PARTITION_CONFLICT_CLAUSE}",
+            group,
+            page_size=len(group)
+        )
+
+
 def insert_product(conn, product: Dict, embedding: List[float]):
     """Insert product with embedding into database"""
+    if partition_map(conn) is not None:
+        try:
+            insert_products_bulk(conn, [product_row(product, embedding)])
+        except Exception as e:
+            print(f"Error inserting product {product.get('product_id')}: {e}")
+        return
     cursor = conn.cursor()
     try:
-        unit_price = product.get('unit_price') or product.get('price')
-        ranking = product.get('ranking') or product.get('rank')
-        votes = product.get('votes') or product.get('vote_count') or product.get('review_count') or product.get('num_reviews')
-        amazon_url = product.get('amazon_url') or product.get('url') or product.get('product_url')
-        # Generate Amazon URL from product_id if not provided
-        if not amazon_url and product.get('product_id'):
-            product_id = product.get('product_id') or product.get('asin') or product.get('id')
-            amazon_url = f"https://www.amazon.com/dp/{product_id}"
-
-        cursor.execute("""
-            INSERT INTO products (
-                product_id, title, description, category, brand,
-                price, unit_price, rating, review_count, ranking, votes, image_url, amazon_url, embedding
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (product_id) DO UPDATE SET
-                title = EXCLUDED.title,
-                description = EXCLUDED.description,
-                category = EXCLUDED.category,
-                brand = EXCLUDED.brand,
-                price = EXCLUDED.price,
-                unit_price = EXCLUDED.unit_price,
-                rating = EXCLUDED.rating,
-                review_count = EXCLUDED.review_count,
-                ranking = EXCLUDED.ranking,
-                votes = EXCLUDED.votes,
-                image_url = EXCLUDED.image_url,
-                amazon_url = EXCLUDED.amazon_url,
-                embedding = EXCLUDED.embedding,
-                updated_at = CURRENT_TIMESTAMP
-        """, (
-            product.get('product_id') or product.get('asin') or product.get('id'),
-            product.get('title') or product.get('product_name'),
-            product.get('description') or product.get('product_description'),
-            product.get('category') or product.get('main_cat'),
-            product.get('brand'),
-            product.get('price'),
-            unit_price,
-            product.get('rating') or product.get('average_rating'),
-            product.get('review_count') or product.get('num_reviews'),
-            ranking,
-            votes,
-            product.get('image_url') or product.get('image'),
-            amazon_url,
-            str(embedding)  # Convert list to string for pgvector
-        ))
+        cursor.execute(f"""
+            INSERT INTO products ({', '.join(UPSERT_COLUMNS)})
+            VALUES ({', '.join(['%s'] * len(UPSERT_COLUMNS))})
+            {UPSERT_CONFLICT_CLAUSE}
+        """, product_row(product, embedding))
         conn.commit()
     except Exception as e:
         conn.rollback()
@@ -134,20 +333,85 @@ def insert_product(conn, product: Dict, embedding: List[float]):
         cursor.close()
 
 
-def process_batch(conn, batch: List[Dict], service_url: str):
+def process_batch(conn, batch: List[Dict], service_url: str, timer: Optional[StageTimer] = None):
     """Process a batch of products"""
+    timer = timer or StageTimer()
     for product in batch:
-        searchable_text = create_searchable_text(product)
+        with timer.stage('text'):
+            searchable_text = create_searchable_text(product)
         if not searchable_text.strip():
             continue
 
-        embedding = get_embedding(searchable_text, service_url)
+        with timer.stage('embed', latency=True):
+            embedding = get_embedding(searchable_text, service_url)
         if embedding:
-            insert_product(conn, product, embedding)
+            with timer.stage('db', latency=True):
+                insert_product(conn, product, embedding)
 
 
-def main():
-    """Main ingestion pipeline"""
+def ingest_streaming(conn, data_file: str, stream_url: str, write_batch: int = BATCH_SIZE,
+                     timer: Optional[StageTimer] = None) -> int:
+    """
+    Stream the whole file through one /embed/stream request, upserting
+    results in batches as they come back. Products wait in `pending` only
+    while in flight, which socket backpressure keeps bounded.
+
+    Parsing and text building run on the sender thread, concurrently with
+    the embed (time spent waiting for each result) and db stages, so their
+    times overlap rather than add up.
+    """
+    timer = timer or StageTimer()
+    pending = {}
+
+    def items():
+        index = 0
+        records = iter_amazon_records(data_file, BATCH_SIZE)
+        while True:
+            with timer.stage('parse') as parsed:
+                batch = next(records, None)
+                parsed['items'] = len(batch or [])
+            if batch is None:
+                break
+            for product in batch:
+                with timer.stage('text'):
+                    text = create_searchable_text(product)
+                if text.strip():
+                    pending[str(index)] = product
+                    yield str(index), text
+                    index += 1
+
+    rows, written = [], 0
+    progress = tqdm(desc="Embedding", unit="products")
+    results = embed_stream(items(), stream_url)
+    while True:
+        with timer.stage('embed', latency=True):
+            result = next(results, None)
+        if result is None:
+            break
+        if 'done' in result:
+            if not result['done']:
+                print(f"Embedding stream failed: {result.get('error')}")
+            break
+        product = pending.pop(result.get('id'), None)
+        if product is None or 'embedding' not in result:
+            print(f"Skipping product: {result.get('error', 'unknown id')}")
+            continue
+        rows.append(product_row(product, result['embedding']))
+        progress.update()
+        if len(rows) >= write_batch:
+            with timer.stage('db', items=len(rows), latency=True):
+                written += insert_products_bulk(conn, rows)
+            rows = []
+    if rows:
+        with timer.stage('db', items=len(rows), latency=True):
+            written += insert_products_bulk(conn, rows)
+    progress.close()
+    return written
+
+
+def main(timer: Optional[StageTimer] = None):
+    """Main ingestion pipeline; prints a per-stage timing summary at the end"""
+    timer = timer or StageTimer()
     # Get data file path from environment or use default
     data_file = os.getenv('DATA_FILE', 'data/amazon_products.json')
 
@@ -157,9 +421,6 @@ def main():
         print("Example: wget https://example.com/amazon_products.json -O data/amazon_products.json")
         return
 
-    # Load data
-    df = load_amazon_data(data_file)
-
     # Connect to database
     print(f"Connecting to database {DB_NAME} at {DB_HOST}:{DB_PORT}...")
     conn = psycopg2.connect(
@@ -170,17 +431,61 @@ def main():
         password=DB_PASSWORD
     )
 
+    if INGEST_STREAMING:
+        print(f"Streaming {data_file} through {EMBEDDING_STREAM_URL}...")
+        written = ingest_streaming(conn, data_file, EMBEDDING_STREAM_URL, timer=timer)
+        conn.close()
+        print(f"Data ingestion complete! {written} products written")
+        print(timer.summary())
+        return
+
+    # Load data
+    with timer.stage('parse') as parsed:
+        df = load_amazon_data(data_file)
+        products = df.to_dict('records')
+        parsed['items'] = len(products)
+
     # Process products in batches
-    print(f"Processing {len(df)} products in batches of {BATCH_SIZE}...")
-    products = df.to_dict('records')
+    print(f"Processing {len(products)} products in batches of {BATCH_SIZE}...")
 
     for i in tqdm(range(0, len(products), BATCH_SIZE), desc="Processing batches"):
         batch = products[i:i + BATCH_SIZE]
-        process_batch(conn, batch, EMBEDDING_SERVICE_URL)
+        process_batch(conn, batch, EMBEDDING_SERVICE_URL, timer)
 
     conn.close()
     print("Data ingestion complete!")
+    print(timer.summary())
 
 
 if __name__ == '__main__':
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ingest products and their embeddings (configured by env vars)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='Run under cProfile; write stats to PATH (pstats) and a text report to PATH.txt')
+    parser.add_argument('--timings', metavar='PATH', help='Write the per-stage timing report as JSON')
+
+    args = parser.parse_args()
+    run_timer = StageTimer()
+
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(main, run_timer)
+        finally:
+            profiler.dump_stats(args.profile)
+            with open(args.profile + '.txt', 'w', encoding='utf-8') as f:
+                stats = pstats.Stats(profiler, stream=f).strip_dirs()
+                stats.sort_stats('cumulative').print_stats(40)
+                stats.sort_stats('tottime').print_stats(40)
+            print(f"Profile written to {args.profile} (view with: python -m pstats {args.profile}) "
+                  f"and {args.profile}.txt")
+    else:
+        main(run_timer)
+
+    if args.timings:
+        with open(args.timings, 'w', encoding='utf-8') as f:
+            json.dump(run_timer.report(), f, indent=2)
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Category-partitioned product storage
+Plans one partition (or one partial vector index) per large top-level
+category, sizes each ivfflat index from that category's row count, and keeps
+a registry that ingest_data.py uses to route rows straight into their
+partition. A search filtered on category_root then touches one small index
+instead of scanning the global one and filtering afterwards
+"""
+
+import math
+import zlib
+from typing import Dict, List, Optional
+
+# Top-level category, e.g. "Electronics > Headphones" or "Electronics|Audio"
+# -> "Electronics". category_root() below must stay in step with this.
+CATEGORY_ROOT_SQL = "btrim(split_part(replace(coalesce(category, ''), '|', '>'), '>', 1))"
+
+DEFAULT_PARTITION = 'products_p_default'
+DEFAULT_MIN_ROWS = 10000
+DEFAULT_MAX_PARTITIONS = 64
+# Below this many rows an exact scan is cheaper than an ivfflat probe
+MIN_INDEX_ROWS = 5000
+
+REGISTRY_DDL = """
+CREATE TABLE IF NOT EXISTS product_partitions (
+    category_root VARCHAR(255) PRIMARY KEY,  -- '' only for the default partition
+    table_name TEXT NOT NULL,                -- partition, or 'products' under the partial-index layout
+    layout TEXT NOT NULL,                    -- 'partitioned' or 'partial'
+    index_name TEXT,
+    row_count BIGINT,
+    lists INTEGER,
+    probes INTEGER,
+    indexed_at TIMESTAMP
+);
+"""
+
+PRODUCT_COLUMNS_DDL = """
+    id SERIAL,
+    product_id VARCHAR(255) NOT NULL,
+    title TEXT,
+    description TEXT,
+    category VARCHAR(255),
+    category_root VARCHAR(255) NOT NULL DEFAULT '',
+    brand VARCHAR(255),
+    price DECIMAL(10, 2),
+    unit_price DECIMAL(10, 2),
+    rating DECIMAL(3, 2),
+    review_count INTEGER,
+    ranking INTEGER,
+    votes INTEGER,
+    image_url TEXT,
+    amazon_url TEXT,
+    embedding vector(384),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+"""
+
+COPY_COLUMNS = (
+    'id', 'product_id', 'title', 'description', 'category', 'brand', 'price', 'unit_price', 'rating',
+    'review_count', 'ranking', 'votes', 'image_url', 'amazon_url', 'embedding', 'created_at', 'updated_at'
+)
+
+
+def category_root(category) -> str:
+    """Python twin of CATEGORY_ROOT_SQL, used to route rows at ingest time"""
+    if category is None or (isinstance(category, float) and math.isnan(category)):
+        return ''
+    return str(category).replace('|', '>').split('>', 1)[0].strip(' ')
+
+
+def ivfflat_lists(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows <= 1000000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def ivfflat_probes(lists: int) -> int:
+    """Starting point for ivfflat.probes at good recall: sqrt(lists)"""
+    return max(1, int(round(math.sqrt(lists))))
+
+
+def partition_table_name(root: str) -> str:
+    """Stable, identifier-safe partition name (Postgres truncates names at 63 bytes)"""
+    slug = ''.join(ch if ch.isalnum() else '_' for ch in root.lower()).strip('_')[:32]
+    return f"products_p_{slug}_{zlib.crc32(root.encode('utf-8')):08x}"
+
+
+def category_counts(conn, table: str = 'products') -> Dict[str, int]:
+    """Rows per top-level category in an existing table"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT {CATEGORY_ROOT_SQL} AS root, count(*) FROM {table} GROUP BY root")
+        counts = {root: count for root, count in cursor.fetchall()}
+    conn.commit()
+    return counts
+
+
+def category_counts_from_file(data_file: str) -> Dict[str, int]:
+    """Rows per top-level category in a product file, for planning before the first load"""
+    from ingest_data import iter_amazon_records
+
+    counts = {}
+    for batch in iter_amazon_records(data_file, 10000):
+        for product in batch:
+            root = category_root(product.get('category') or product.get('main_cat'))
+            counts[root] = counts.get(root, 0) + 1
+    return counts
+
+
+def plan_partitions(counts: Dict[str, int], min_rows: int = DEFAULT_MIN_ROWS,
+                    max_partitions: int = DEFAULT_MAX_PARTITIONS) -> List[Dict]:
+    """
+    The largest categories with at least min_rows rows get their own
+    partition (at most max_partitions); everything else shares the default.
+    """
+    ranked = sorted(((count, root) for root, count in counts.items() if root), reverse=True)
+    own = [(count, root) for count, root in ranked if count >= min_rows][:max_partitions]
+    own_roots = {root for _, root in own}
+    plan = [{'category_root': root, 'table_name': partition_table_name(root), 'rows': count,
+             'lists': ivfflat_lists(count)} for count, root in own]
+    rest = sum(count for root, count in counts.items() if root not in own_roots)
+    plan.append({'category_root': '', 'table_name': DEFAULT_PARTITION, 'rows': rest, 'lists': ivfflat_lists(rest)})
+    return plan
+
+
+def register(conn, plan: List[Dict], layout: str):
+    with conn.cursor() as cursor:
+        cursor.execute(REGISTRY_DDL)
+        cursor.execute("DELETE FROM product_partitions")
+        for entry in plan:
+            cursor.execute("""
+                INSERT INTO product_partitions (category_root, table_name, layout, row_count, lists, probes)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (entry['category_root'], entry['table_name'] if layout == 'partitioned' else 'products', layout,
+                  entry['rows'], entry['lists'], ivfflat_probes(entry['lists'])))
+    conn.commit()
+
+
+def load_partition_map(conn) -> Optional[Dict[str, str]]:
+    """category_root -> partition table, or None when products is not partitioned"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('products')")
+        row = cursor.fetchone()
+        if not row or row[0] != 'p':
+            conn.commit()
+            return None
+        cursor.execute("SELECT category_root, table_name FROM product_partitions WHERE layout = 'partitioned'")
+        partitions = dict(cursor.fetchall())
+    conn.commit()
+    return partitions
+
+
+def create_partitioned(conn, plan: List[Dict], migrate: bool = True):
+    """
+    Build products_partitioned (LIST on category_root), copy the current rows
+    into it and swap it in as products; the old heap is kept as
+    products_unpartitioned until dropped by hand.
+
+    The primary key has to include the partition key, so product_id is
+    unique per partition only; ingest_data removes a product from its old
+    partition when its category moves.
+    """
+    from psycopg2 import sql
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            CREATE TABLE products_partitioned ({PRODUCT_COLUMNS_DDL},
+                PRIMARY KEY (product_id, category_root)
+            ) PARTITION BY LIST (category_root)
+        """)
+        for entry in plan:
+            if entry['category_root']:
+                cursor.execute(sql.SQL("CREATE TABLE {} PARTITION OF products_partitioned FOR VALUES IN ({})").format(
+                    sql.Identifier(entry['table_name']), sql.Literal(entry['category_root'])))
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF products_partitioned DEFAULT")
+        cursor.execute("CREATE INDEX ON products_partitioned (id)")
+        cursor.execute("CREATE INDEX ON products_partitioned USING gin(to_tsvector('english', title))")
+        cursor.execute("CREATE INDEX ON products_partitioned USING gin(to_tsvector('english', description))")
+        if migrate:
+            columns = ', '.join(COPY_COLUMNS)
+            cursor.execute(f"""
+                INSERT INTO products_partitioned ({columns}, category_root)
+                SELECT {columns}, {CATEGORY_ROOT_SQL} FROM products
+            """)
+            print(f"Copied {cursor.rowcount} products into partitions")
+            cursor.execute("""
+                SELECT setval(pg_get_serial_sequence('products_partitioned', 'id'),
+                              greatest((SELECT max(id) FROM products_partitioned), 1))
+            """)
+        # Triggers stay with the renamed heap: the updated_at trigger and the
+        # embedding worker's notify triggers. Their definitions name
+        # "products", so re-running them after the swap puts them on the new table
+        cursor.execute("""
+            SELECT pg_get_triggerdef(oid) FROM pg_trigger
+            WHERE tgrelid = 'products'::regclass AND NOT tgisinternal ORDER BY tgname
+        """)
+        triggers = [row[0] for row in cursor.fetchall()]
+        cursor.execute("ALTER TABLE products RENAME TO products_unpartitioned")
+        cursor.execute("ALTER TABLE products_partitioned RENAME TO products")
+        for definition in triggers:
+            cursor.execute(definition)
+        print(f"Recreated {len(triggers)} triggers on the partitioned products")
+    conn.commit()
+    register(conn, plan, 'partitioned')
+
+
+def create_partial(conn, plan: List[Dict]):
+    """Keep the single heap, adding category_root as a generated column for partial indexes"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            ALTER TABLE products ADD COLUMN IF NOT EXISTS category_root VARCHAR(255)
+                GENERATED ALWAYS AS ({CATEGORY_ROOT_SQL}) STORED
+        """)
+    conn.commit()
+    register(conn, plan, 'partial')
+
+
+def build_indexes(conn, min_index_rows: int = MIN_INDEX_ROWS) -> List[Dict]:
+    """
+    (Re)build each registered partition's ivfflat index with lists sized from
+    its current row count. Run after bulk loads: ivfflat centroids are fixed
+    when the index is built. Indexes are built CONCURRENTLY under a temporary
+    name and swapped in, so searches keep the old index meanwhile.
+
+    Under the partial layout the default bucket has no index of its own; its
+    filtered searches use the global products_embedding_idx.
+    """
+    from psycopg2 import sql
+
+    conn.autocommit = True
+    results = []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT category_root, table_name, layout, index_name FROM product_partitions "
+                           "ORDER BY category_root")
+            for root, table, layout, old_index in cursor.fetchall():
+                if layout == 'partial' and not root:
+                    continue
+                if layout == 'partitioned':
+                    target, where = sql.Identifier(table), sql.SQL('')
+                    index_name = f"{table}_embedding_idx"
+                else:
+                    target = sql.Identifier('products')
+                    where = sql.SQL(" WHERE category_root = {}").format(sql.Literal(root))
+                    index_name = f"{partition_table_name(root)}_embedding_idx"
+                cursor.execute(sql.SQL("SELECT count(*) FROM {}{} {} embedding IS NOT NULL").format(
+                    target, where, sql.SQL('AND' if layout == 'partial' else 'WHERE')))
+                rows = cursor.fetchone()[0]
+                lists = ivfflat_lists(rows)
+
+                building = index_name + '_new'
+                # Left behind by an interrupted run (an invalid index)
+                cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(building)))
+                if rows < min_index_rows:
+                    for name in {old_index, index_name} - {None}:
+                        cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+                    index_name, lists = None, None
+                else:
+                    cursor.execute(sql.SQL(
+                        "CREATE INDEX CONCURRENTLY {} ON {} USING ivfflat (embedding vector_cosine_ops) "
+                        "WITH (lists = {}){}").format(sql.Identifier(building), target, sql.Literal(lists), where))
+                    cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(index_name)))
+                    cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(building), sql.Identifier(index_name)))
+                cursor.execute("""
+                    UPDATE product_partitions SET index_name = %s, row_count = %s, lists = %s, probes = %s,
+                        indexed_at = now()
+                    WHERE category_root = %s
+                """, (index_name, rows, lists, ivfflat_probes(lists) if lists else None, root))
+                results.append({'category_root': root, 'table': table, 'rows': rows, 'index': index_name,
+                                'lists': lists})
+                print(f"  {root or '(default)':<40} {rows:>10} rows  "
+                      f"{'lists=' + str(lists) if lists else 'exact scan (no index)'}")
+    finally:
+        conn.autocommit = False
+    return results
+
+
+def status(conn) -> List[Dict]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT category_root, table_name, layout, index_name, row_count, lists, probes, indexed_at "
+                       "FROM product_partitions ORDER BY row_count DESC NULLS LAST")
+        columns = [d[0] for d in cursor.description]
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    conn.commit()
+    return rows
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    import psycopg2
+
+    from ingest_data import DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER
+
+    parser = argparse.ArgumentParser(description='Partition products by top-level category with per-partition vector indexes')
+    parser.add_argument('command', choices=['plan', 'create', 'index', 'status'],
+                        help='plan: show partitions; create: build the layout; index: (re)build vector indexes; '
+                             'status: show the registry')
+    parser.add_argument('--layout', choices=['partitioned', 'partial'], default='partitioned',
+                        help='LIST-partitioned table, or partial indexes on the existing table')
+    parser.add_argument('--data-file', help='Plan from this product file instead of the current products table')
+    parser.add_argument('--min-rows', type=int, default=DEFAULT_MIN_ROWS,
+                        help='Smallest category that gets its own partition')
+    parser.add_argument('--max-partitions', type=int, default=DEFAULT_MAX_PARTITIONS)
+    parser.add_argument('--min-index-rows', type=int, default=MIN_INDEX_ROWS,
+                        help='Partitions smaller than this are scanned exactly, without a vector index')
+    parser.add_argument('--no-migrate', action='store_true', help='create: do not copy existing rows')
+
+    args = parser.parse_args()
+
+    conn = None
+    if not (args.command == 'plan' and args.data_file):
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+    if args.command in ('plan', 'create'):
+        counts = category_counts_from_file(args.data_file) if args.data_file else category_counts(conn)
+        plan = plan_partitions(counts, args.min_rows, args.max_partitions)
+        for entry in plan:
+            print(f"{entry['category_root'] or '(default)':<40} {entry['rows']:>10} rows  lists={entry['lists']:<5} "
+                  f"{entry['table_name']}")
+        if args.command == 'create':
+            if args.layout == 'partitioned':
+                create_partitioned(conn, plan, migrate=not args.no_migrate)
+            else:
+                create_partial(conn, plan)
+            print(f"Created {args.layout} layout with {len(plan)} partitions; run 'index' after loading data")
+    elif args.command == 'index':
+        build_indexes(conn, args.min_index_rows)
+    else:
+        print(json.dumps(status(conn), indent=2, default=str))
+
+    if conn is not None:
+        conn.close()
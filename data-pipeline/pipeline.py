@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Pipelined ingestion for E-commerce Semantic Search
+Runs reader -> text builder -> embedder -> DB writer as concurrent stages
+connected by bounded queues, so file I/O, the embedding service and Postgres
+work at the same time instead of taking turns
+"""
+
+import os
+import time
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+import psycopg2
+
+from dedup import Deduplicator, ensure_schema as ensure_dedup_schema, insert_duplicates
+from ingest_data import (
+    BATCH_SIZE, DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL,
+    create_searchable_text, get_embeddings_batch, insert_products_bulk, iter_amazon_records, product_id_of,
+    product_row
+)
+from schema_mapping import SchemaMapper, iter_raw_frames, rows_for_upsert
+
+_DONE = object()  # end-of-stream marker passed between stages
+
+
+class Stage:
+    """
+    A pool of worker threads reading batches from `inbox` and writing
+    results to `outbox`. Bounded queues give backpressure: a slow stage makes
+    its upstream block on put() instead of buffering without limit.
+
+    Per stage we track busy time (inside the work function), time blocked
+    waiting for input, and time blocked on a full output queue.
+    """
+
+    def __init__(self, name: str, work: Callable, workers: int, inbox: Optional[queue.Queue],
+                 outbox: Optional[queue.Queue], setup: Optional[Callable] = None):
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.inbox = inbox
+        self.outbox = outbox
+        self.setup = setup
+        self.items_in = 0
+        self.items_out = 0
+        self.busy_seconds = 0.0
+        self.wait_in_seconds = 0.0
+        self.wait_out_seconds = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._remaining = workers
+        self._threads = []
+
+    def start(self, downstream_workers: int):
+        self._downstream_workers = downstream_workers
+        # Per-worker state (e.g. a DB connection) is created up front so a
+        # failure surfaces here rather than stalling the pipeline later
+        states = [self.setup() if self.setup else None for _ in range(self.workers)]
+        for i, state in enumerate(states):
+            thread = threading.Thread(target=self._run, args=(state,), name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+    def _emit(self, item):
+        start = time.perf_counter()
+        self.outbox.put(item)
+        with self._lock:
+            self.wait_out_seconds += time.perf_counter() - start
+
+    def _process(self, state, item):
+        start = time.perf_counter()
+        try:
+            result = self.work(state, item)
+        except Exception as e:
+            print(f"[{self.name}] error: {e}")
+            result = None
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            self.busy_seconds += time.perf_counter() - start
+            self.items_in += 1
+        return result
+
+    def _run(self, state):
+        try:
+            if self.inbox is None:
+                # Source stage: the work function is a generator of batches. A
+                # read error ends the stream; it is counted so the run fails
+                start = time.perf_counter()
+                try:
+                    for batch in self.work(state, None):
+                        with self._lock:
+                            self.busy_seconds += time.perf_counter() - start
+                            self.items_out += 1
+                        self._emit(batch)
+                        start = time.perf_counter()
+                except Exception as e:
+                    print(f"[{self.name}] error: {e}")
+                    with self._lock:
+                        self.errors += 1
+                return
+
+            while True:
+                start = time.perf_counter()
+                item = self.inbox.get()
+                with self._lock:
+                    self.wait_in_seconds += time.perf_counter() - start
+                if item is _DONE:
+                    break
+                result = self._process(state, item)
+                if result is not None and self.outbox is not None:
+                    with self._lock:
+                        self.items_out += 1
+                    self._emit(result)
+        finally:
+            if state is not None and hasattr(state, 'close'):
+                state.close()
+            with self._lock:
+                self._remaining -= 1
+                last = self._remaining == 0
+            # The last worker out tells every downstream worker to stop
+            if last and self.outbox is not None:
+                for _ in range(self._downstream_workers):
+                    self.outbox.put(_DONE)
+
+
+class Pipeline:
+    """Chain of stages with a background sampler for queue depths"""
+
+    def __init__(self, stages: List[Stage], queues: Dict[str, queue.Queue],
+                 totals: Optional[Dict] = None, sample_interval: float = 0.5):
+        self.stages = stages
+        self.queues = queues
+        self.totals = totals if totals is not None else {}
+        self.sample_interval = sample_interval
+        self.depth_samples = {name: [] for name in queues}
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            for name, q in self.queues.items():
+                self.depth_samples[name].append(q.qsize())
+
+    def run(self) -> Dict:
+        sampler = threading.Thread(target=self._sample, daemon=True)
+        start = time.perf_counter()
+        sampler.start()
+        for stage, downstream in zip(self.stages, self.stages[1:] + [None]):
+            stage.start(downstream.workers if downstream else 0)
+        for stage in self.stages:
+            stage.join()
+        self._stop.set()
+        sampler.join()
+        return self.report(time.perf_counter() - start)
+
+    def report(self, wall_seconds: float) -> Dict:
+        """Per-stage utilization and throughput, queue depths, and the bottleneck"""
+        stages = {}
+        for stage in self.stages:
+            capacity = wall_seconds * stage.workers
+            stages[stage.name] = {
+                'workers': stage.workers,
+                'batches_in': stage.items_in,
+                'batches_out': stage.items_out,
+                'errors': stage.errors,
+                'utilization': stage.busy_seconds / capacity if capacity else 0.0,
+                'waiting_for_input': stage.wait_in_seconds / capacity if capacity else 0.0,
+                'blocked_on_output': stage.wait_out_seconds / capacity if capacity else 0.0,
+                # What this stage could sustain on its own with its worker count
+                'batches_per_sec_capacity': (stage.items_in or stage.items_out) * stage.workers / stage.busy_seconds
+                if stage.busy_seconds else None,
+            }
+        queues = {
+            name: {
+                'maxsize': self.queues[name].maxsize,
+                'mean_depth': sum(samples) / len(samples) if samples else 0.0,
+                'max_depth': max(samples) if samples else 0,
+            }
+            for name, samples in self.depth_samples.items()
+        }
+        bottleneck = max(stages, key=lambda name: stages[name]['utilization'])
+        return {'wall_seconds': wall_seconds, 'stages': stages, 'queues': queues, 'bottleneck': bottleneck}
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def build_pipeline(
+    data_file: str,
+    batch_url: str,
+    batch_size: int = BATCH_SIZE,
+    text_workers: int = 1,
+    embed_workers: int = 4,
+    db_workers: int = 2,
+    queue_depth: int = 8,
+    connect_fn: Callable = connect,
+    vectorized: bool = False,
+    dedup: Optional[Deduplicator] = None
+) -> Pipeline:
+    """
+    Wire the four ingestion stages together. With vectorized, batches travel
+    as DataFrames and the text builder maps fields with schema_mapping's
+    column operations instead of per-row lookups. With dedup, near-duplicate
+    products are dropped (text matches before embedding, embedding matches
+    after) and recorded in product_duplicates instead of being indexed.
+    """
+    texts_q = queue.Queue(maxsize=queue_depth)
+    embed_q = queue.Queue(maxsize=queue_depth)
+    write_q = queue.Queue(maxsize=queue_depth)
+    totals = {'rows': 0, 'written': 0, 'duplicates': 0}
+    totals_lock = threading.Lock()
+
+    mapper = SchemaMapper()
+
+    def read(_, __):
+        batches = iter_raw_frames(data_file, batch_size) if vectorized else iter_amazon_records(data_file, batch_size)
+        for batch in batches:
+            with totals_lock:
+                totals['rows'] += len(batch)
+            yield batch
+
+    def split(items, keep):
+        """Kept items, plus raw records of the dropped ones keyed by product_id"""
+        if vectorized:
+            mask = pd.Series(keep, index=items.index)
+            dropped = items[~mask].drop(columns='searchable_text')
+            records = [{k: v for k, v in record.items() if pd.notna(v)} for record in dropped.to_dict('records')]
+            return items[mask], dict(zip(dropped['product_id'], records))
+        dropped = {product_id_of(product): product for (product, _), k in zip(items, keep) if not k}
+        return [item for item, k in zip(items, keep) if k], dropped
+
+    def ids_of(items):
+        return items['product_id'].tolist() if vectorized else [product_id_of(product) for product, _ in items]
+
+    def build_texts(_, batch):
+        if vectorized:
+            items = mapper.normalize(batch)
+            texts = items['searchable_text'].tolist()
+        else:
+            items = [(product, create_searchable_text(product)) for product in batch]
+            items = [(product, text) for product, text in items if text.strip()]
+            texts = [text for _, text in items]
+        if not len(items):
+            return None
+        payload = {'items': items, 'duplicates': [], 'variants': {}}
+        if dedup is not None:
+            # Drop text near-duplicates before they cost an embedding call
+            keep, payload['duplicates'] = dedup.filter_text(ids_of(items), texts)
+            payload['items'], payload['variants'] = split(items, keep)
+        return payload
+
+    def embed(_, payload):
+        items = payload['items']
+        if len(items):
+            texts = items['searchable_text'].tolist() if vectorized else [text for _, text in items]
+            embeddings = get_embeddings_batch(texts, batch_url)
+            # get_embeddings_batch logs and returns None on failure; raising makes
+            # the stage count the lost batch instead of dropping it silently
+            if not embeddings or len(embeddings) != len(texts):
+                raise RuntimeError(f"Embedding service returned {len(embeddings or [])} embeddings "
+                                   f"for {len(texts)} texts")
+            if dedup is not None:
+                keep, duplicates = dedup.filter_embeddings(ids_of(items), embeddings)
+                items, variants = split(items, keep)
+                embeddings = [embedding for embedding, k in zip(embeddings, keep) if k]
+                payload['duplicates'] = payload['duplicates'] + duplicates
+                payload['variants'] = {**payload['variants'], **variants}
+            if vectorized:
+                payload['rows'] = rows_for_upsert(items, embeddings)
+            else:
+                payload['rows'] = [product_row(product, embedding)
+                                   for (product, _), embedding in zip(items, embeddings)]
+        else:
+            payload['rows'] = []
+        return payload
+
+    def write(conn, payload):
+        written = insert_products_bulk(conn, payload['rows'])
+        duplicates = insert_duplicates(conn, payload['duplicates'], payload['variants'],
+                                       [row[0] for row in payload['rows']] if dedup is not None else ())
+        with totals_lock:
+            totals['written'] += written
+            totals['duplicates'] += duplicates
+        return None
+
+    stages = [
+        Stage('reader', read, 1, None, texts_q),
+        Stage('text_builder', build_texts, text_workers, texts_q, embed_q),
+        Stage('embedder', embed, embed_workers, embed_q, write_q),
+        Stage('db_writer', write, db_workers, write_q, None, setup=connect_fn),
+    ]
+    queues = {'read->text': texts_q, 'text->embed': embed_q, 'embed->write': write_q}
+    return Pipeline(stages, queues, totals)
+
+
+def print_report(report: Dict, totals: Dict):
+    """Human-readable summary of a pipeline run"""
+    wall = report['wall_seconds']
+    print(f"\nIngested {totals['written']}/{totals['rows']} products in {wall:.1f}s "
+          f"({totals['written'] / wall:.1f} rows/sec)")
+    print(f"{'stage':<14}{'workers':>8}{'busy':>8}{'starved':>9}{'blocked':>9}{'batches':>9}")
+    for name, s in report['stages'].items():
+        print(f"{name:<14}{s['workers']:>8}{s['utilization']:>8.0%}{s['waiting_for_input']:>9.0%}"
+              f"{s['blocked_on_output']:>9.0%}{s['batches_out'] or s['batches_in']:>9}")
+    for name, q in report['queues'].items():
+        print(f"queue {name:<14} mean depth {q['mean_depth']:.1f} / {q['maxsize']} (max {q['max_depth']})")
+    print(f"Bottleneck: {report['bottleneck']} (add workers there, or speed it up)")
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Pipelined ingestion with overlapped read, embed and DB-write stages')
+    parser.add_argument('--data-file', default=os.getenv('DATA_FILE', 'data/amazon_products.json'))
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--text-workers', type=int, default=1)
+    parser.add_argument('--embed-workers', type=int, default=4)
+    parser.add_argument('--db-workers', type=int, default=2)
+    parser.add_argument('--queue-depth', type=int, default=8, help='Max batches buffered between stages')
+    parser.add_argument('--vectorized', action='store_true',
+                        help='Map fields with column operations over DataFrame batches')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Index one product per near-duplicate cluster; record the rest in product_duplicates')
+    parser.add_argument('--dedup-jaccard', type=float, default=0.8, help='MinHash similarity threshold')
+    parser.add_argument('--dedup-cosine', type=float, default=0.97,
+                        help='Embedding cosine threshold within a batch (0 disables)')
+    parser.add_argument('--report', help='Write the stage report as JSON to this path')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.data_file):
+        print(f"Data file not found: {args.data_file}")
+        raise SystemExit(1)
+
+    dedup = None
+    if args.dedup:
+        dedup = Deduplicator(args.dedup_jaccard, args.dedup_cosine or None)
+        conn = connect()
+        ensure_dedup_schema(conn)
+        conn.close()
+
+    pipeline = build_pipeline(
+        args.data_file, args.batch_url, args.batch_size,
+        args.text_workers, args.embed_workers, args.db_workers, args.queue_depth,
+        vectorized=args.vectorized, dedup=dedup
+    )
+    report = pipeline.run()
+    print_report(report, pipeline.totals)
+    if dedup is not None:
+        report['dedup'] = dedup.summary()
+        print(f"Dedup: {json.dumps(report['dedup'])}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({**report, 'totals': pipeline.totals}, f, indent=2)
+    failed = {name: s['errors'] for name, s in report['stages'].items() if s['errors']}
+    if failed:
+        # Failed batches were not written; upserts are idempotent, so re-run the file
+        print(f"Batches failed: {failed}")
+        raise SystemExit(1)
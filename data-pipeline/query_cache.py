@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+Materialized top-k results for head queries
+Embeds the most frequent queries from a query log, computes their top-k
+products (one offline matrix multiply, or one set-based SQL query), stores
+them in query_results_cache keyed by the normalized query, and refreshes
+them incrementally as products change
+"""
+
+import os
+import re
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from ingest_data import (
+    DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL, get_embeddings_batch
+)
+from check_embeddings import column_dimension
+from reembed import embedding_version
+from topk import blocked_top_k
+
+DEFAULT_K = 20
+# updated_at is the writing transaction's start time, so a row can commit after
+# the watermark was read with an earlier timestamp. Refreshes re-read this far
+# back (as embedding_worker.py does); merging a row twice gives the same result
+WATERMARK_OVERLAP_SECONDS = 60
+
+CACHE_DDL = """
+CREATE TABLE IF NOT EXISTS query_results_cache (
+    query_key TEXT PRIMARY KEY,          -- normalize_query(query)
+    query TEXT NOT NULL,
+    hits BIGINT,                         -- frequency in the query log
+    k INTEGER NOT NULL,
+    product_ids TEXT[] NOT NULL,         -- best first
+    scores REAL[] NOT NULL,              -- cosine similarity, same order
+    query_embedding vector NOT NULL,     -- undeclared dimension: a re-embed flip can change it
+    computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS query_results_cache_state (
+    name TEXT PRIMARY KEY,
+    value TIMESTAMP
+);
+"""
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(CACHE_DDL)
+        # Tables created before the dimension was left undeclared have vector(384)
+        cursor.execute("""
+            SELECT atttypmod FROM pg_attribute
+            WHERE attrelid = 'query_results_cache'::regclass AND attname = 'query_embedding'
+        """)
+        if cursor.fetchone()[0] > 0:
+            cursor.execute("ALTER TABLE query_results_cache ALTER COLUMN query_embedding TYPE vector")
+    conn.commit()
+
+
+def normalize_query(query: str) -> str:
+    """Cache key: lowercased, whitespace collapsed. Lookups must normalize the same way"""
+    return re.sub(r'\s+', ' ', query.strip().lower())
+
+
+def load_head_queries(path: str, top_n: int) -> Tuple[List[Tuple[str, int]], int]:
+    """
+    Most frequent queries as (query, count), plus the log's total count.
+    Accepts a raw log (one query per line, or JSON lines with a "query"
+    field) or a frequency file with "query<TAB>count" lines.
+    """
+    counts = Counter()
+    display = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip():
+                continue
+            count = 1
+            if line.lstrip().startswith('{'):
+                try:
+                    line = json.loads(line).get('query', '')
+                except json.JSONDecodeError:
+                    continue
+            elif '\t' in line:
+                query, _, value = line.rpartition('\t')
+                if value.strip().isdigit():
+                    line, count = query, int(value)
+            key = normalize_query(line)
+            if key:
+                counts[key] += count
+                display.setdefault(key, line.strip())
+    return [(display[key], count) for key, count in counts.most_common(top_n)], sum(counts.values())
+
+
+def parse_vector(text: str) -> np.ndarray:
+    """pgvector text form '[0.1,0.2,...]' to float32"""
+    return np.array(text[1:-1].split(','), dtype=np.float32)
+
+
+def load_product_matrix(conn, since=None) -> Tuple[List[str], np.ndarray]:
+    """
+    Product ids and L2-normalized embeddings (optionally only rows updated
+    after `since`, less the watermark overlap)
+    """
+    ids, vectors = [], []
+    with conn.cursor(name='query_cache_products') as cursor:
+        cursor.itersize = 10000
+        if since is None:
+            cursor.execute("SELECT product_id, embedding::text FROM products WHERE embedding IS NOT NULL")
+        else:
+            cursor.execute("SELECT product_id, embedding::text FROM products WHERE embedding IS NOT NULL "
+                           f"AND updated_at > %s - interval '{WATERMARK_OVERLAP_SECONDS} seconds'", (since,))
+        for product_id, embedding in cursor:
+            ids.append(product_id)
+            vectors.append(parse_vector(embedding))
+    # With no rows, the column's declared dimension (it changes on a re-embed flip)
+    dim = None if vectors else column_dimension(conn) or 0
+    conn.commit()
+    if not vectors:
+        return ids, np.zeros((0, dim), dtype=np.float32)
+    matrix = np.vstack(vectors)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return ids, matrix
+
+
+def embed_queries(queries: List[str], batch_url: str, batch_size: int = 256) -> np.ndarray:
+    """Embed through the embedding service, the same model the search API uses"""
+    vectors = []
+    for i in range(0, len(queries), batch_size):
+        embeddings = get_embeddings_batch(queries[i:i + batch_size], batch_url)
+        if embeddings is None:
+            raise RuntimeError(f"Embedding service failed for queries {i}-{i + batch_size}")
+        vectors.extend(embeddings)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def top_k_sql(conn, query_vectors: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+    """
+    All queries in one set-based statement: a LATERAL nearest-neighbour scan
+    per query, so each one can use the ivfflat index. Approximate, like search.
+    """
+    values = [(i, str(vector.tolist())) for i, vector in enumerate(query_vectors)]
+    with conn.cursor() as cursor:
+        rows = execute_values(cursor, f"""
+            SELECT q.idx, p.product_id, 1 - (p.embedding <=> q.embedding) AS similarity
+            FROM (
+                SELECT idx, CAST(embedding_text AS vector) AS embedding FROM (VALUES %s) AS v(idx, embedding_text)
+            ) q
+            CROSS JOIN LATERAL (
+                SELECT product_id, embedding FROM products
+                WHERE embedding IS NOT NULL
+                ORDER BY embedding <=> q.embedding
+                LIMIT {int(k)}
+            ) p
+            ORDER BY q.idx, similarity DESC
+        """, values, fetch=True, page_size=len(values))
+    conn.commit()
+    results = [[] for _ in values]
+    for idx, product_id, similarity in rows:
+        results[idx].append((product_id, float(similarity)))
+    return results
+
+
+def top_k_matrix(conn, query_vectors: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+    """Exact top-k with one blocked matrix multiply over every product embedding"""
+    ids, matrix = load_product_matrix(conn)
+    if not ids:
+        return [[] for _ in query_vectors]
+    indices, scores = blocked_top_k(query_vectors, matrix, k)
+    return [[(ids[i], float(s)) for i, s in zip(row_idx, row_scores)] for row_idx, row_scores in zip(indices, scores)]
+
+
+def write_cache(conn, entries: List[Dict]):
+    if not entries:
+        return
+    with conn.cursor() as cursor:
+        execute_values(cursor, """
+            INSERT INTO query_results_cache (query_key, query, hits, k, product_ids, scores, query_embedding, computed_at)
+            VALUES %s
+            ON CONFLICT (query_key) DO UPDATE SET
+                query = EXCLUDED.query, hits = EXCLUDED.hits, k = EXCLUDED.k, product_ids = EXCLUDED.product_ids,
+                scores = EXCLUDED.scores, query_embedding = EXCLUDED.query_embedding, computed_at = EXCLUDED.computed_at
+        """, [
+            (normalize_query(e['query']), e['query'], e['hits'], e['k'], [pid for pid, _ in e['results']],
+             [score for _, score in e['results']], str(list(map(float, e['embedding']))))
+            for e in entries
+        ], template='(%s, %s, %s, %s, %s, %s, CAST(%s AS vector), CURRENT_TIMESTAMP)', page_size=1000)
+    conn.commit()
+
+
+def products_watermark(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT max(updated_at) FROM products")
+        value = cursor.fetchone()[0]
+    conn.commit()
+    return value
+
+
+def get_watermark(conn, name: str = 'products_updated_at'):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT value FROM query_results_cache_state WHERE name = %s", (name,))
+        row = cursor.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def set_watermark(conn, value, name: str = 'products_updated_at'):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO query_results_cache_state (name, value) VALUES (%s, %s)
+            ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        """, (name, value))
+    conn.commit()
+
+
+def build(conn, query_log: str, top_n: int = 1000, k: int = DEFAULT_K, method: str = 'matrix',
+          batch_url: str = EMBEDDING_BATCH_URL) -> Dict:
+    """Full (re)build for the top_n head queries of a query log"""
+    start = time.perf_counter()
+    # Read the watermarks first: changes made during the build are picked up by the next refresh
+    watermark = products_watermark(conn)
+    version = embedding_version(conn)
+    head, total = load_head_queries(query_log, top_n)
+    if not head:
+        return {'queries': 0}
+    queries = [query for query, _ in head]
+    vectors = embed_queries(queries, batch_url)
+    embed_seconds = time.perf_counter() - start
+
+    results = top_k_matrix(conn, vectors, k) if method == 'matrix' else top_k_sql(conn, vectors, k)
+    write_cache(conn, [
+        {'query': query, 'hits': hits, 'k': k, 'results': result, 'embedding': vector}
+        for (query, hits), result, vector in zip(head, results, vectors)
+    ])
+    set_watermark(conn, watermark)
+    set_watermark(conn, version, 'embedding_changed_at')
+    return {
+        'queries': len(head),
+        'k': k,
+        'method': method,
+        'traffic_share': round(sum(hits for _, hits in head) / total, 4),
+        'embed_seconds': round(embed_seconds, 2),
+        'total_seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def load_cache(conn) -> List[Dict]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT query, hits, k, product_ids, scores, query_embedding::text FROM query_results_cache")
+        rows = cursor.fetchall()
+    conn.commit()
+    return [
+        {'query': query, 'hits': hits, 'k': k, 'results': list(zip(ids, scores)), 'embedding': parse_vector(vector)}
+        for query, hits, k, ids, scores, vector in rows
+    ]
+
+
+def rebuild_all(conn, entries: List[Dict], method: str, batch_url: str) -> int:
+    """Re-embed every cached query and recompute its results from scratch"""
+    vectors = embed_queries([e['query'] for e in entries], batch_url)
+    k = max(e['k'] for e in entries)
+    results = top_k_matrix(conn, vectors, k) if method == 'matrix' else top_k_sql(conn, vectors, k)
+    write_cache(conn, [{**entry, 'results': result[:entry['k']], 'embedding': vector}
+                       for entry, result, vector in zip(entries, results, vectors)])
+    return len(entries)
+
+
+def refresh(conn, method: str = 'matrix', batch_url: str = EMBEDDING_BATCH_URL) -> Dict:
+    """
+    Incremental refresh from products changed since the last build/refresh.
+
+    Cached scores of unchanged products are still exact, and every product
+    outside a cached list scored at most its k-th score. So merging the
+    changed products' new scores into the list gives the exact top-k whenever
+    the merged k-th score is still >= the old one. Queries where it is not
+    (a listed product changed for the worse, or was deleted) are recomputed.
+
+    A re-embed flip or rollback (reembed.py) replaces every product vector
+    without moving updated_at and puts them in another model's space; when
+    embedding_version has changed, every cached query is re-embedded and
+    recomputed instead.
+    """
+    start = time.perf_counter()
+    since = get_watermark(conn)
+    watermark = products_watermark(conn)
+    version = embedding_version(conn)
+    entries = load_cache(conn)
+    if since is None or not entries:
+        return {'error': 'cache is empty; run build first'}
+
+    if version != get_watermark(conn, 'embedding_changed_at'):
+        recomputed = rebuild_all(conn, entries, method, batch_url)
+        set_watermark(conn, watermark)
+        set_watermark(conn, version, 'embedding_changed_at')
+        return {
+            'embeddings_replaced': True,
+            'cached_queries': len(entries),
+            'recomputed_queries': recomputed,
+            'seconds': round(time.perf_counter() - start, 2),
+        }
+
+    changed_ids, changed = load_product_matrix(conn, since)
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT DISTINCT c.pid FROM query_results_cache, unnest(product_ids) AS c(pid)
+            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.product_id = c.pid AND p.embedding IS NOT NULL)
+        """)
+        removed = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+
+    changed_set = set(changed_ids) | removed
+    merged, stale = [], []
+    if changed_ids or removed:
+        query_vectors = np.vstack([e['embedding'] for e in entries])
+        query_vectors /= np.maximum(np.linalg.norm(query_vectors, axis=1, keepdims=True), 1e-12)
+        new_scores = query_vectors @ changed.T if changed_ids else np.zeros((len(entries), 0), dtype=np.float32)
+        for entry, scores in zip(entries, new_scores):
+            k = entry['k']
+            old = entry['results']
+            if not old:
+                stale.append(entry)
+                continue
+            threshold = old[-1][1] if len(old) >= k else -1.0
+            candidates = [(pid, s) for pid, s in old if pid not in changed_set]
+            candidates += [(pid, float(s)) for pid, s in zip(changed_ids, scores) if s >= threshold]
+            candidates.sort(key=lambda item: -item[1])
+            candidates = candidates[:k]
+            if len(old) >= k and (len(candidates) < k or candidates[-1][1] < threshold):
+                stale.append(entry)
+            elif candidates != old:
+                merged.append({**entry, 'results': candidates})
+
+    if stale:
+        vectors = np.vstack([e['embedding'] for e in stale])
+        k = max(e['k'] for e in stale)
+        results = top_k_matrix(conn, vectors, k) if method == 'matrix' else top_k_sql(conn, vectors, k)
+        merged += [{**entry, 'results': result[:entry['k']]} for entry, result in zip(stale, results)]
+
+    write_cache(conn, merged)
+    set_watermark(conn, watermark)
+    return {
+        'changed_products': len(changed_ids),
+        'removed_products': len(removed),
+        'cached_queries': len(entries),
+        'updated_queries': len(merged),
+        'recomputed_queries': len(stale),
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def lookup(conn, query: str, limit: int = DEFAULT_K) -> Optional[List[Tuple[str, float]]]:
+    """Cached results for a query (single primary-key lookup), or None on a miss"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT product_ids, scores FROM query_results_cache WHERE query_key = %s",
+                       (normalize_query(query),))
+        row = cursor.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    return list(zip(row[0], row[1]))[:limit]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Precompute and refresh top-k results for head queries')
+    parser.add_argument('command', choices=['build', 'refresh', 'lookup'])
+    parser.add_argument('--queries', default=os.getenv('QUERY_LOG', 'data/query_log.txt'),
+                        help='Query log (one query per line, JSON lines, or query<TAB>count)')
+    parser.add_argument('--top-n', type=int, default=1000, help='Number of head queries to cache')
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    parser.add_argument('--method', choices=['matrix', 'sql'], default='matrix',
+                        help='matrix: exact, offline blocked matmul; sql: one LATERAL query using the ivfflat index')
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--query', help='Query to look up (lookup)')
+
+    args = parser.parse_args()
+
+    conn = connect()
+    ensure_schema(conn)
+    if args.command == 'build':
+        print(json.dumps(build(conn, args.queries, args.top_n, args.k, args.method, args.batch_url), indent=2))
+    elif args.command == 'refresh':
+        print(json.dumps(refresh(conn, args.method, args.batch_url), indent=2, default=str))
+    else:
+        print(json.dumps(lookup(conn, args.query or '', args.k), indent=2))
+    conn.close()
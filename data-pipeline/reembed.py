@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+Blue/green re-embedding for E-commerce Semantic Search
+Backfills vectors from a new model into a shadow column (embedding_next) in
+ascending id order at a bounded rate, builds its vector index concurrently,
+and once every product is covered swaps it in as products.embedding in one
+transaction, so searches see either all old or all new vectors, never a mix
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+
+from ingest_data import (
+    DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL, create_searchable_text,
+    get_embeddings_batch, partition_map
+)
+from partitioning import DEFAULT_PARTITION, MIN_INDEX_ROWS, ivfflat_lists
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_ROWS_PER_SEC = 200.0
+
+JOBS_DDL = """
+CREATE TABLE IF NOT EXISTS reembed_jobs (
+    job_id TEXT PRIMARY KEY,
+    model TEXT NOT NULL,               -- embedding service model id for the new vectors
+    dim INTEGER NOT NULL,
+    last_id BIGINT NOT NULL DEFAULT 0, -- backfill cursor: every id <= last_id has been visited
+    rows_done BIGINT NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'backfilling',  -- backfilling, indexed, flipped, rolled_back
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    flipped_at TIMESTAMP
+);
+"""
+
+# Wholesale swaps of products.embedding (flip, rollback) do not touch
+# updated_at, so consumers that tail it (query_cache.py refresh, the
+# vector-search sidecar and its semantic cache) also watch changed_at here and
+# rebuild from scratch when it moves. Same table as infrastructure/init-db.sql
+VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS embedding_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),   -- single row
+    model TEXT,                                       -- model of the vectors now in products.embedding, if known
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO embedding_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+"""
+
+# Keeps updated_at (and anything tailing it) untouched by backfill writes;
+# the same function is in infrastructure/init-db.sql for new databases.
+UPDATED_AT_FUNCTION = """
+CREATE OR REPLACE FUNCTION update_updated_at_column()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF current_setting('products.skip_updated_at', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    NEW.updated_at = CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+"""
+
+# A product whose text changes after it was backfilled needs a new shadow vector
+INVALIDATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION reembed_invalidate_next()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.embedding_next = NULL;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS reembed_invalidate_next ON products;
+CREATE TRIGGER reembed_invalidate_next BEFORE UPDATE OF title, description, brand, category ON products
+    FOR EACH ROW
+    WHEN (OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description
+          OR OLD.brand IS DISTINCT FROM NEW.brand OR OLD.category IS DISTINCT FROM NEW.category)
+    EXECUTE FUNCTION reembed_invalidate_next();
+"""
+
+MISSING_WHERE = "embedding IS NOT NULL AND embedding_next IS NULL"
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def vector_tables(conn) -> List[str]:
+    """Tables that hold the vector indexes: the partitions when products is partitioned"""
+    partitions = partition_map(conn)
+    if partitions is None:
+        return ['products']
+    return sorted(set(partitions.values()) | {DEFAULT_PARTITION})
+
+
+def index_name(table: str, column: str = 'embedding') -> str:
+    return f"{table}_{column}_idx"
+
+
+def get_job(conn, job_id: str) -> Optional[Dict]:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT job_id, model, dim, last_id, rows_done, status, started_at, flipped_at "
+                       "FROM reembed_jobs WHERE job_id = %s", (job_id,))
+        row = cursor.fetchone()
+        columns = [d[0] for d in cursor.description]
+    conn.commit()
+    return dict(zip(columns, row)) if row else None
+
+
+def start(conn, job_id: str, model: str, batch_url: str = EMBEDDING_BATCH_URL) -> Dict:
+    """
+    Create the shadow column (sized from one probe embedding), the invalidation
+    trigger and the job row. Safe to re-run for the same job.
+    """
+    job = get_job(conn, job_id) if table_exists(conn, 'reembed_jobs') else None
+    if job:
+        if job['model'] != model:
+            raise ValueError(f"Job '{job_id}' re-embeds with model '{job['model']}', not '{model}'")
+        return job
+    probe = get_embeddings_batch(['dimension probe'], batch_url, model)
+    if not probe:
+        raise RuntimeError(f"Could not embed with model '{model}' at {batch_url}")
+    dim = len(probe[0])
+    with conn.cursor() as cursor:
+        cursor.execute(JOBS_DDL)
+        cursor.execute("SELECT job_id FROM reembed_jobs WHERE status IN ('backfilling', 'indexed')")
+        active = cursor.fetchone()
+        if active:
+            raise ValueError(f"Job '{active[0]}' is still in progress; flip or roll it back first")
+        cursor.execute(UPDATED_AT_FUNCTION)
+        cursor.execute("ALTER TABLE products DROP COLUMN IF EXISTS embedding_next")
+        cursor.execute(f"ALTER TABLE products ADD COLUMN embedding_next vector({dim})")
+        cursor.execute(INVALIDATE_TRIGGER)
+        cursor.execute("INSERT INTO reembed_jobs (job_id, model, dim) VALUES (%s, %s, %s)", (job_id, model, dim))
+    conn.commit()
+    print(f"Started job {job_id}: model '{model}', {dim} dimensions")
+    return get_job(conn, job_id)
+
+
+def bump_embedding_version(cursor, model: Optional[str]):
+    """Mark every stored vector as replaced, in the caller's transaction"""
+    cursor.execute(VERSION_DDL)
+    cursor.execute("UPDATE embedding_version SET model = %s, changed_at = clock_timestamp()", (model,))
+
+
+def embedding_version(conn):
+    """When products.embedding was last swapped wholesale, None if it never was (or no table yet)"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('embedding_version') IS NOT NULL")
+        row = None
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT changed_at FROM embedding_version")
+            row = cursor.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def table_exists(conn, name: str) -> bool:
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        exists = cursor.fetchone()[0]
+    conn.commit()
+    return exists
+
+
+def coverage(conn) -> Tuple[int, int]:
+    """(products with a current embedding, of those still missing a shadow vector)"""
+    with conn.cursor() as cursor:
+        cursor.execute(f"SELECT count(*), count(*) FILTER (WHERE {MISSING_WHERE}) "
+                       f"FROM products WHERE embedding IS NOT NULL")
+        total, missing = cursor.fetchone()
+    conn.commit()
+    return total, missing
+
+
+def fetch_batch(cursor, after_id: int, batch_size: int, missing_only: bool) -> List[Tuple]:
+    cursor.execute(f"""
+        SELECT id, title, description, brand, category FROM products
+        WHERE id > %s AND {MISSING_WHERE if missing_only else 'embedding IS NOT NULL'}
+        ORDER BY id LIMIT %s
+    """, (after_id, batch_size))
+    return cursor.fetchall()
+
+
+def embed_rows(rows: List[Tuple], model: str, batch_url: str) -> List[Tuple[int, str]]:
+    """(id, pgvector literal) for rows with searchable text"""
+    texts = [(row[0], create_searchable_text({'title': row[1], 'description': row[2], 'brand': row[3],
+                                              'category': row[4]})) for row in rows]
+    texts = [(product_id, text) for product_id, text in texts if text.strip()]
+    if not texts:
+        return []
+    embeddings = get_embeddings_batch([text for _, text in texts], batch_url, model)
+    if embeddings is None:
+        raise RuntimeError(f"Embedding service failed for {len(texts)} rows")
+    return [(product_id, str(embedding)) for (product_id, _), embedding in zip(texts, embeddings)]
+
+
+def write_batch(cursor, job_id: str, vectors: List[Tuple[int, str]], last_id: int):
+    """Shadow vectors and the job cursor, in the caller's transaction"""
+    from psycopg2.extras import execute_values
+
+    cursor.execute("SET LOCAL products.skip_updated_at = 'on'")
+    if vectors:
+        execute_values(cursor, """
+            UPDATE products p SET embedding_next = v.embedding::vector
+            FROM (VALUES %s) AS v (id, embedding) WHERE p.id = v.id
+        """, vectors, page_size=len(vectors))
+    cursor.execute("""
+        UPDATE reembed_jobs SET last_id = greatest(last_id, %s), rows_done = rows_done + %s, updated_at = now()
+        WHERE job_id = %s
+    """, (last_id, len(vectors), job_id))
+
+
+def backfill(conn, job_id: str, rows_per_sec: float = DEFAULT_ROWS_PER_SEC, batch_size: int = DEFAULT_BATCH_SIZE,
+             batch_url: str = EMBEDDING_BATCH_URL, report_every: float = 10.0) -> Dict:
+    """
+    Fill embedding_next in ascending id order, resuming from the job's cursor,
+    at no more than rows_per_sec. Then sweep again for rows inserted or edited
+    behind the cursor until none are missing.
+    """
+    job = get_job(conn, job_id)
+    if job is None:
+        raise ValueError(f"Unknown job '{job_id}'; run 'start' first")
+    if job['status'] != 'backfilling':
+        print(f"Job {job_id} is {job['status']}; nothing to backfill")
+        return job
+
+    total, missing = coverage(conn)
+    print(f"Backfilling {missing} of {total} products from id {job['last_id']} at <= {rows_per_sec:g} rows/s")
+    started = time.perf_counter()
+    last_report = started
+    done = sweep_done = 0
+    after_id, sweep = job['last_id'], 0
+    while True:
+        batch_started = time.perf_counter()
+        with conn.cursor() as cursor:
+            rows = fetch_batch(cursor, after_id, batch_size, missing_only=sweep > 0)
+            conn.commit()
+            if not rows:
+                total, missing = coverage(conn)
+                if not missing:
+                    break
+                if sweep and not sweep_done:
+                    print(f"Stopping: {missing} products have no searchable text to embed")
+                    break
+                # Rows added or edited behind the cursor; sweep them up from the start
+                sweep += 1
+                after_id, sweep_done = 0, 0
+                print(f"Sweep {sweep}: {missing} products still missing a new vector")
+                continue
+            vectors = embed_rows(rows, job['model'], batch_url)
+            after_id = rows[-1][0]
+            write_batch(cursor, job_id, vectors, after_id if sweep == 0 else 0)
+        conn.commit()
+        done += len(vectors)
+        sweep_done += len(vectors)
+
+        # Throttle: each batch takes at least len(rows) / rows_per_sec seconds
+        if rows_per_sec > 0:
+            pause = len(rows) / rows_per_sec - (time.perf_counter() - batch_started)
+            if pause > 0:
+                time.sleep(pause)
+
+        now = time.perf_counter()
+        if now - last_report >= report_every:
+            rate = done / (now - started)
+            remaining = max(missing - done, 0)
+            eta = remaining / rate if rate else float('inf')
+            print(f"  id {after_id}: {done} rows, {rate:.1f} rows/s, ~{remaining} left, ETA {format_eta(eta)}",
+                  flush=True)
+            last_report = now
+
+    elapsed = time.perf_counter() - started
+    print(f"Backfill finished: {done} rows in {elapsed:.0f}s ({done / elapsed if elapsed else 0:.1f} rows/s), "
+          f"{total - missing} of {total} products covered")
+    return {'job_id': job_id, 'rows': done, 'seconds': round(elapsed, 1), 'total': total, 'missing': missing}
+
+
+def format_eta(seconds: float) -> str:
+    if seconds == float('inf'):
+        return 'unknown'
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
+
+
+def build_index(conn, job_id: str, min_index_rows: int = MIN_INDEX_ROWS):
+    """
+    ivfflat on embedding_next, per partition when products is partitioned,
+    built CONCURRENTLY so writes and searches carry on
+    """
+    from psycopg2 import sql
+
+    tables = vector_tables(conn)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for table in tables:
+                cursor.execute(sql.SQL("SELECT count(*) FROM {} WHERE embedding_next IS NOT NULL").format(
+                    sql.Identifier(table)))
+                rows = cursor.fetchone()[0]
+                name = index_name(table, 'embedding_next')
+                # An interrupted CONCURRENTLY build leaves an invalid index behind
+                cursor.execute(sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(name)))
+                if rows < min_index_rows and table != 'products':
+                    print(f"  {table}: {rows} rows, exact scan (no index)")
+                    continue
+                lists = ivfflat_lists(rows)
+                start_time = time.perf_counter()
+                cursor.execute(sql.SQL(
+                    "CREATE INDEX CONCURRENTLY {} ON {} USING ivfflat (embedding_next vector_cosine_ops) "
+                    "WITH (lists = {})").format(sql.Identifier(name), sql.Identifier(table), sql.Literal(lists)))
+                print(f"  {table}: {rows} rows, lists={lists}, built in {time.perf_counter() - start_time:.0f}s")
+            cursor.execute("UPDATE reembed_jobs SET status = 'indexed', updated_at = now() WHERE job_id = %s",
+                           (job_id,))
+    finally:
+        conn.autocommit = False
+
+
+def swap_columns(cursor, tables: List[str], current: str, replacement: str, retired: str):
+    """Rename replacement -> current (and its indexes), keeping the old column as retired"""
+    from psycopg2 import sql
+
+    cursor.execute(sql.SQL("ALTER TABLE products RENAME COLUMN {} TO {}").format(
+        sql.Identifier(current), sql.Identifier(retired)))
+    cursor.execute(sql.SQL("ALTER TABLE products RENAME COLUMN {} TO {}").format(
+        sql.Identifier(replacement), sql.Identifier(current)))
+    for table in tables:
+        for old, new in ((index_name(table, current), index_name(table, retired)),
+                         (index_name(table, replacement), index_name(table, current))):
+            cursor.execute(sql.SQL("ALTER INDEX IF EXISTS {} RENAME TO {}").format(
+                sql.Identifier(old), sql.Identifier(new)))
+
+
+def refresh_notify_trigger(cursor):
+    """
+    The text-change notify trigger's WHEN clause follows the embedding column
+    it was created on through renames; recreate it on the current one
+    """
+    from embedding_worker import TRIGGER_SQL
+
+    cursor.execute("SELECT 1 FROM pg_trigger WHERE tgname = 'notify_products_text_changed' AND NOT tgisinternal")
+    if cursor.fetchone():
+        cursor.execute(TRIGGER_SQL)
+
+
+def flip(conn, job_id: str, batch_url: str = EMBEDDING_BATCH_URL, max_missing: int = DEFAULT_BATCH_SIZE) -> bool:
+    """
+    Swap embedding_next in as embedding in one transaction. Writes are
+    blocked (SHARE ROW EXCLUSIVE) while the last few uncovered rows are
+    embedded and the columns renamed; searches only wait for the renames.
+    The old vectors stay in embedding_prev for rollback.
+    """
+    job = get_job(conn, job_id)
+    if job is None or job['status'] != 'indexed':
+        raise ValueError(f"Job '{job_id}' cannot be flipped (status: {job and job['status']}); run 'index' first")
+    tables = vector_tables(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE products IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(f"SELECT id, title, description, brand, category FROM products WHERE {MISSING_WHERE} "
+                       f"ORDER BY id LIMIT %s", (max_missing + 1,))
+        rows = cursor.fetchall()
+        if len(rows) > max_missing:
+            conn.rollback()
+            print(f"More than {max_missing} products still lack a new vector; run 'backfill' first")
+            return False
+        if rows:
+            write_batch(cursor, job_id, embed_rows(rows, job['model'], batch_url), 0)
+        cursor.execute("DROP TRIGGER IF EXISTS reembed_invalidate_next ON products")
+        cursor.execute("ALTER TABLE products DROP COLUMN IF EXISTS embedding_prev")
+        swap_columns(cursor, tables, 'embedding', 'embedding_next', 'embedding_prev')
+        refresh_notify_trigger(cursor)
+        bump_embedding_version(cursor, job['model'])
+        cursor.execute("UPDATE reembed_jobs SET status = 'flipped', flipped_at = now(), updated_at = now() "
+                       "WHERE job_id = %s", (job_id,))
+    conn.commit()
+    print(f"Flipped: products.embedding now holds '{job['model']}' vectors ({job['dim']} dims). "
+          f"Point query-time embedding (MODEL_NAME) at the same model.")
+    print("embedding_version.changed_at was bumped (updated_at was not): the vector-search sidecar reloads and "
+          "clears its semantic cache on its next refresh, and 'query_cache.py refresh' re-embeds every cached query.")
+    return True
+
+
+def rollback(conn, job_id: str):
+    """
+    Swap the previous vectors back in. Products edited since the flip keep
+    stale old-model vectors until they are re-ingested.
+    """
+    job = get_job(conn, job_id)
+    if job is None or job['status'] != 'flipped':
+        raise ValueError(f"Job '{job_id}' has not been flipped")
+    tables = vector_tables(conn)
+    with conn.cursor() as cursor:
+        cursor.execute("LOCK TABLE products IN SHARE ROW EXCLUSIVE MODE")
+        swap_columns(cursor, tables, 'embedding', 'embedding_prev', 'embedding_rolled_back')
+        refresh_notify_trigger(cursor)
+        bump_embedding_version(cursor, None)
+        cursor.execute("ALTER TABLE products DROP COLUMN embedding_rolled_back")
+        cursor.execute("UPDATE reembed_jobs SET status = 'rolled_back', updated_at = now() WHERE job_id = %s",
+                       (job_id,))
+    conn.commit()
+    print("Rolled back to the previous embeddings; embedding_version.changed_at was bumped, so the vector-search "
+          "sidecar and 'query_cache.py refresh' rebuild from them")
+
+
+def status(conn, job_id: str) -> Dict:
+    job = get_job(conn, job_id)
+    if job is None:
+        raise ValueError(f"Unknown job '{job_id}'")
+    if job['status'] in ('backfilling', 'indexed'):
+        total, missing = coverage(conn)
+        job['coverage'] = round((total - missing) / total, 6) if total else 1.0
+        job['missing'] = missing
+    return job
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-embed the catalog with a new model behind a shadow column')
+    parser.add_argument('command', choices=['start', 'backfill', 'index', 'flip', 'run', 'status', 'rollback'],
+                        help='run = start + backfill + index + flip')
+    parser.add_argument('--job-id', required=True)
+    parser.add_argument('--model', help='Embedding service model id for the new vectors (start/run)')
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--rows-per-sec', type=float, default=DEFAULT_ROWS_PER_SEC,
+                        help='Backfill rate limit (0 = unthrottled)')
+    parser.add_argument('--min-index-rows', type=int, default=MIN_INDEX_ROWS)
+
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        if args.command in ('start', 'run'):
+            if not args.model:
+                parser.error('--model is required for start and run')
+            start(conn, args.job_id, args.model, args.batch_url)
+        if args.command in ('backfill', 'run'):
+            backfill(conn, args.job_id, args.rows_per_sec, args.batch_size, args.batch_url)
+        if args.command in ('index', 'run'):
+            build_index(conn, args.job_id, args.min_index_rows)
+        if args.command in ('flip', 'run'):
+            if not flip(conn, args.job_id, args.batch_url, args.batch_size):
+                raise SystemExit(1)
+        if args.command == 'rollback':
+            rollback(conn, args.job_id)
+        if args.command == 'status':
+            print(json.dumps(status(conn, args.job_id), indent=2, default=str))
+    finally:
+        conn.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Vectorized field mapping for heterogeneous product files
+Resolves field aliases once per file schema, then normalizes types, builds
+searchable text and fills default URLs with column operations over whole
+batches instead of per-row dict lookups
+"""
+
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from ingest_data import UPSERT_COLUMNS
+
+# Canonical field -> source columns in priority order (same aliases as product_row)
+FIELD_ALIASES = {
+    'product_id': ['product_id', 'asin', 'id'],
+    'title': ['title', 'product_name'],
+    'description': ['description', 'product_description'],
+    'category': ['category', 'main_cat'],
+    'brand': ['brand'],
+    'price': ['price'],
+    'unit_price': ['unit_price', 'price'],
+    'rating': ['rating', 'average_rating'],
+    'review_count': ['review_count', 'num_reviews'],
+    'ranking': ['ranking', 'rank'],
+    'votes': ['votes', 'vote_count', 'review_count', 'num_reviews'],
+    'image_url': ['image_url', 'image'],
+    'amazon_url': ['amazon_url', 'url', 'product_url'],
+}
+
+TEXT_FIELDS = ['product_id', 'title', 'description', 'category', 'brand', 'image_url', 'amazon_url']
+FLOAT_FIELDS = ['price', 'unit_price', 'rating']
+INT_FIELDS = ['review_count', 'ranking', 'votes']
+
+# Searchable text parts as (field, prefix), matching create_searchable_text
+SEARCHABLE_PARTS = [('title', ''), ('description', ''), ('brand', 'Brand: '), ('category', 'Category: ')]
+
+AMAZON_URL_PREFIX = 'https://www.amazon.com/dp/'
+
+
+def infer_mapping(columns) -> Dict[str, List[str]]:
+    """Pick, per canonical field, the alias columns present in this schema"""
+    present = set(columns)
+    return {field: [c for c in aliases if c in present] for field, aliases in FIELD_ALIASES.items()}
+
+
+def _clean(series: pd.Series) -> pd.Series:
+    """Treat empty strings as null, matching what the per-row `a or b` chains skipped"""
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        return series.mask(series == '')
+    return series
+
+
+def _coalesce(df: pd.DataFrame, columns: List[str]) -> pd.Series:
+    """First non-null value across columns, column by column"""
+    if not columns:
+        return pd.Series(None, index=df.index, dtype=object)
+    result = df[columns[0]].astype(object)
+    for column in columns[1:]:
+        result = result.fillna(df[column])
+    return result
+
+
+def _as_text(series: pd.Series) -> pd.Series:
+    """Strings stay as they are; anything else non-null is converted with str()"""
+    if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        return series
+    return series.where(series.isna(), series.astype(str))
+
+
+def _as_number(series: pd.Series) -> pd.Series:
+    """Float column; unparseable values become NaN. Skips parsing for numeric columns"""
+    if pd.api.types.infer_dtype(series, skipna=True) in ('floating', 'integer', 'mixed-integer-float', 'empty'):
+        return series.astype('float64')
+    return pd.to_numeric(series, errors='coerce')
+
+
+def normalize_batch(df: pd.DataFrame, mapping: Dict[str, List[str]]) -> pd.DataFrame:
+    """
+    Map a raw batch onto canonical, typed columns plus `searchable_text`.
+
+    Numbers are coerced with to_numeric (unparseable values become null),
+    counts are nullable Int64, missing amazon_url is built from product_id,
+    and rows without a product_id or any searchable text are dropped.
+    """
+    sources = sorted({column for columns in mapping.values() for column in columns})
+    clean = pd.DataFrame({column: _clean(df[column]) for column in sources}, index=df.index)
+
+    out = pd.DataFrame(index=df.index)
+    for field, columns in mapping.items():
+        out[field] = _coalesce(clean, columns)
+
+    for field in TEXT_FIELDS:
+        out[field] = _as_text(out[field])
+    for field in FLOAT_FIELDS:
+        out[field] = _as_number(out[field])
+    for field in INT_FIELDS:
+        out[field] = _as_number(out[field]).round().astype('Int64')
+
+    no_url = out['amazon_url'].isna() & out['product_id'].notna()
+    out.loc[no_url, 'amazon_url'] = AMAZON_URL_PREFIX + out.loc[no_url, 'product_id']
+
+    text = pd.Series('', index=out.index, dtype=object)
+    for field, prefix in SEARCHABLE_PARTS:
+        values = out[field]
+        text = text + (prefix + values.fillna('') + ' ').where(values.notna(), '')
+    out['searchable_text'] = text.str[:-1]
+
+    keep = out['product_id'].notna() & (out['searchable_text'].str.strip() != '')
+    return out[keep]
+
+
+def rows_for_upsert(batch: pd.DataFrame, embeddings: List[List[float]]) -> List[Tuple]:
+    """UPSERT_COLUMNS tuples (nulls as None) for insert_products_bulk"""
+    columns = [c for c in UPSERT_COLUMNS if c != 'embedding']
+    values = batch[columns].astype(object)
+    values = values.where(values.notna(), None).to_numpy().tolist()
+    return [(*row, str(list(embedding))) for row, embedding in zip(values, embeddings)]
+
+
+def iter_raw_frames(file_path: str, batch_size: int) -> Iterator[pd.DataFrame]:
+    """Read JSON lines or CSV in DataFrame chunks"""
+    if file_path.endswith('.json'):
+        records = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+                if len(records) >= batch_size:
+                    yield pd.DataFrame.from_records(records)
+                    records = []
+        if records:
+            yield pd.DataFrame.from_records(records)
+    elif file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=batch_size)
+    else:
+        raise ValueError(f"Unsupported file format: {file_path}")
+
+
+class SchemaMapper:
+    """Caches one alias mapping per distinct column set seen in a file"""
+
+    def __init__(self):
+        self._mappings = {}
+
+    def mapping_for(self, columns) -> Dict[str, List[str]]:
+        key = frozenset(columns)
+        mapping = self._mappings.get(key)
+        if mapping is None:
+            mapping = self._mappings[key] = infer_mapping(columns)
+        return mapping
+
+    def normalize(self, df: pd.DataFrame) -> pd.DataFrame:
+        return normalize_batch(df, self.mapping_for(df.columns))
+
+
+def iter_normalized_batches(file_path: str, batch_size: int, mapper: Optional[SchemaMapper] = None):
+    """Normalized, typed batches ready for embedding and bulk loading"""
+    mapper = mapper or SchemaMapper()
+    for df in iter_raw_frames(file_path, batch_size):
+        batch = mapper.normalize(df)
+        if len(batch):
+            yield batch
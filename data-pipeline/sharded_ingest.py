@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+Sharded ingestion for E-commerce Semantic Search
+Splits one or more input files into deterministic shards (byte ranges of JSON
+lines files, or product_id hash buckets) and lets any number of worker
+processes, on any number of machines, claim shards through a coordination
+table in Postgres using FOR UPDATE SKIP LOCKED leases
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+from typing import Dict, Iterator, List, Optional
+
+import psycopg2
+
+from ingest_data import (
+    BATCH_SIZE, DB_HOST, DB_NAME, DB_PASSWORD, DB_PORT, DB_USER, EMBEDDING_BATCH_URL,
+    create_searchable_text, get_embeddings_batch, insert_products_bulk, iter_amazon_records, product_id_of,
+    product_row
+)
+
+DEFAULT_SHARD_MB = 64
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+SHARDS_DDL = """
+CREATE TABLE IF NOT EXISTS ingest_shards (
+    job_id TEXT NOT NULL,
+    shard_no INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    mode TEXT NOT NULL,                  -- 'bytes' or 'hash'
+    start_byte BIGINT,
+    end_byte BIGINT,
+    bucket INTEGER,
+    buckets INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, running, done, failed
+    worker_id TEXT,
+    lease_expires_at TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    rows_read INTEGER NOT NULL DEFAULT 0,
+    rows_written INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    PRIMARY KEY (job_id, shard_no)
+);
+CREATE INDEX IF NOT EXISTS ingest_shards_claim_idx ON ingest_shards (job_id, status, lease_expires_at);
+"""
+
+# Claim the lowest pending shard, or one whose lease ran out (its worker died).
+# SKIP LOCKED lets concurrent workers pass over rows another worker is
+# claiming instead of queueing behind it.
+CLAIM_SQL = """
+UPDATE ingest_shards s
+SET status = 'running', worker_id = %(worker_id)s, attempts = s.attempts + 1,
+    lease_expires_at = now() + %(lease)s * interval '1 second',
+    started_at = now(), error = NULL
+FROM (
+    SELECT job_id, shard_no FROM ingest_shards
+    WHERE job_id = %(job_id)s
+      AND (status = 'pending' OR (status = 'running' AND lease_expires_at < now()))
+      AND attempts < %(max_attempts)s
+    ORDER BY shard_no
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+) c
+WHERE s.job_id = c.job_id AND s.shard_no = c.shard_no
+RETURNING s.shard_no, s.file_path, s.mode, s.start_byte, s.end_byte, s.bucket, s.buckets, s.attempts
+"""
+
+
+class LeaseLost(Exception):
+    """Raised when a worker's lease was taken over by another worker"""
+
+
+def connect():
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASSWORD)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def ensure_schema(conn):
+    with conn.cursor() as cursor:
+        cursor.execute(SHARDS_DDL)
+    conn.commit()
+
+
+def plan_byte_shards(files: List[str], shard_bytes: int) -> List[Dict]:
+    """Fixed-size byte ranges per JSON lines file; a line belongs to the shard holding its first byte"""
+    shards = []
+    for path in sorted(files):
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), shard_bytes):
+            shards.append({'file_path': path, 'mode': 'bytes', 'start_byte': start,
+                           'end_byte': min(start + shard_bytes, size), 'bucket': None, 'buckets': None})
+    return shards
+
+
+def plan_hash_shards(files: List[str], buckets: int) -> List[Dict]:
+    """product_id hash buckets per file; each shard reads its whole file and keeps one bucket"""
+    return [
+        {'file_path': path, 'mode': 'hash', 'start_byte': None, 'end_byte': None, 'bucket': bucket, 'buckets': buckets}
+        for path in sorted(files) for bucket in range(buckets)
+    ]
+
+
+def plan_shards(files: List[str], mode: str = 'auto', shard_mb: int = DEFAULT_SHARD_MB,
+                buckets: int = 16) -> List[Dict]:
+    """
+    Deterministic shard list for the input files. 'auto' uses byte ranges when
+    every file is JSON lines and hash buckets otherwise (CSV rows can span
+    lines, so byte offsets are not safe split points).
+    """
+    if mode == 'auto':
+        mode = 'bytes' if all(path.endswith('.json') for path in files) else 'hash'
+    if mode == 'bytes':
+        if not all(path.endswith('.json') for path in files):
+            raise ValueError("Byte-range shards need JSON lines (.json) files; use --mode hash for CSV")
+        return plan_byte_shards(files, shard_mb * 1024 * 1024)
+    if mode == 'hash':
+        return plan_hash_shards(files, buckets)
+    raise ValueError(f"Unknown shard mode: {mode}")
+
+
+def register_job(conn, job_id: str, shards: List[Dict]) -> int:
+    """
+    Insert the shard plan for a job. Re-running with the same plan is a no-op,
+    so every worker may call this on startup; a different plan for an existing
+    job is rejected rather than mixed in.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM ingest_shards WHERE job_id = %s", (job_id,))
+        existing = cursor.fetchone()[0]
+        if existing and existing != len(shards):
+            raise ValueError(f"Job '{job_id}' already has {existing} shards; this plan has {len(shards)}")
+        for shard_no, shard in enumerate(shards):
+            cursor.execute("""
+                INSERT INTO ingest_shards (job_id, shard_no, file_path, mode, start_byte, end_byte, bucket, buckets)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (job_id, shard_no) DO NOTHING
+            """, (job_id, shard_no, shard['file_path'], shard['mode'], shard['start_byte'], shard['end_byte'],
+                  shard['bucket'], shard['buckets']))
+    conn.commit()
+    return len(shards)
+
+
+def claim_shard(conn, job_id: str, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[Dict]:
+    """Lease the next available shard, or None when nothing is claimable right now"""
+    with conn.cursor() as cursor:
+        # Expired leases with no attempts left would otherwise stay 'running' forever
+        cursor.execute("""
+            UPDATE ingest_shards SET status = 'failed', error = 'lease expired on final attempt'
+            WHERE job_id = %s AND status = 'running' AND lease_expires_at < now() AND attempts >= %s
+        """, (job_id, max_attempts))
+        cursor.execute(CLAIM_SQL, {'job_id': job_id, 'worker_id': worker_id, 'lease': lease_seconds,
+                                   'max_attempts': max_attempts})
+        row = cursor.fetchone()
+    conn.commit()
+    if row is None:
+        return None
+    keys = ('shard_no', 'file_path', 'mode', 'start_byte', 'end_byte', 'bucket', 'buckets', 'attempts')
+    return dict(zip(keys, row))
+
+
+def renew_lease(conn, job_id: str, shard_no: int, worker_id: str, lease_seconds: int, rows_read: int,
+                rows_written: int):
+    """Extend our lease and record progress; raise LeaseLost if another worker took the shard"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE ingest_shards
+            SET lease_expires_at = now() + %s * interval '1 second', rows_read = %s, rows_written = %s
+            WHERE job_id = %s AND shard_no = %s AND worker_id = %s AND status = 'running'
+        """, (lease_seconds, rows_read, rows_written, job_id, shard_no, worker_id))
+        owned = cursor.rowcount == 1
+    conn.commit()
+    if not owned:
+        raise LeaseLost(f"Lease on shard {shard_no} of job '{job_id}' was taken over")
+
+
+def finish_shard(conn, job_id: str, shard_no: int, worker_id: str, rows_read: int, rows_written: int):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE ingest_shards
+            SET status = 'done', lease_expires_at = NULL, finished_at = now(), rows_read = %s, rows_written = %s
+            WHERE job_id = %s AND shard_no = %s AND worker_id = %s
+        """, (rows_read, rows_written, job_id, shard_no, worker_id))
+    conn.commit()
+
+
+def fail_shard(conn, job_id: str, shard_no: int, worker_id: str, error: str, max_attempts: int):
+    """Release a shard after an error: back to pending, or failed once attempts run out"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            UPDATE ingest_shards
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                lease_expires_at = NULL, error = %s
+            WHERE job_id = %s AND shard_no = %s AND worker_id = %s
+        """, (max_attempts, error[:1000], job_id, shard_no, worker_id))
+    conn.commit()
+
+
+def job_status(conn, job_id: str) -> Dict:
+    """Shard counts by status plus row totals for a job"""
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT status, count(*), sum(rows_read), sum(rows_written),
+                   count(*) FILTER (WHERE status = 'running' AND lease_expires_at < now())
+            FROM ingest_shards WHERE job_id = %s GROUP BY status
+        """, (job_id,))
+        rows = cursor.fetchall()
+    conn.commit()
+    by_status = {status: count for status, count, _, _, _ in rows}
+    return {
+        'job_id': job_id,
+        'shards': sum(by_status.values()),
+        'by_status': by_status,
+        'expired_leases': sum(expired for *_, expired in rows),
+        'rows_read': sum(read or 0 for _, _, read, _, _ in rows),
+        'rows_written': sum(written or 0 for _, _, _, written, _ in rows),
+    }
+
+
+def product_bucket(product: Dict, buckets: int) -> int:
+    """Stable bucket for a product (same on every machine, unlike hash())"""
+    digest = hashlib.blake2b(str(product_id_of(product)).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % buckets
+
+
+def iter_byte_range(file_path: str, start: int, end: int, chunk_size: int) -> Iterator[List[Dict]]:
+    """Records of a JSON lines file whose first byte lies in [start, end)"""
+    chunk = []
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            # The line straddling `start` belongs to the previous shard. Seeking
+            # one byte back means a line starting exactly at `start` is kept.
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                chunk.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_shard_records(shard: Dict, chunk_size: int) -> Iterator[List[Dict]]:
+    if shard['mode'] == 'bytes':
+        yield from iter_byte_range(shard['file_path'], shard['start_byte'], shard['end_byte'], chunk_size)
+        return
+    for batch in iter_amazon_records(shard['file_path'], chunk_size):
+        mine = [product for product in batch if product_bucket(product, shard['buckets']) == shard['bucket']]
+        if mine:
+            yield mine
+
+
+def ingest_shard(conn, job_id: str, shard: Dict, worker_id: str, batch_url: str,
+                 batch_size: int = BATCH_SIZE, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Dict:
+    """
+    Embed and upsert one shard, renewing the lease after every batch. Upserts
+    are idempotent, so a shard re-run after a lost lease only repeats work.
+    """
+    rows_read = rows_written = 0
+    for batch in iter_shard_records(shard, batch_size):
+        rows_read += len(batch)
+        pairs = [(product, create_searchable_text(product)) for product in batch]
+        pairs = [(product, text) for product, text in pairs if text.strip()]
+        if pairs:
+            embeddings = get_embeddings_batch([text for _, text in pairs], batch_url)
+            if embeddings is None:
+                raise RuntimeError("Embedding service returned no embeddings")
+            rows = [product_row(product, embedding) for (product, _), embedding in zip(pairs, embeddings)]
+            rows_written += insert_products_bulk(conn, rows)
+        renew_lease(conn, job_id, shard['shard_no'], worker_id, lease_seconds, rows_read, rows_written)
+    return {'rows_read': rows_read, 'rows_written': rows_written}
+
+
+def run_worker(job_id: str, worker_id: Optional[str] = None, batch_url: str = EMBEDDING_BATCH_URL,
+               batch_size: int = BATCH_SIZE, lease_seconds: int = DEFAULT_LEASE_SECONDS,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS, poll_seconds: float = 5.0,
+               connect_fn=connect) -> Dict:
+    """
+    Claim and process shards until the job has nothing left to claim. While
+    other workers still hold live leases the worker keeps polling, so it can
+    pick up their shards if they die.
+    """
+    worker_id = worker_id or default_worker_id()
+    conn = connect_fn()
+    done = {'worker_id': worker_id, 'shards': 0, 'rows_read': 0, 'rows_written': 0, 'errors': 0}
+    try:
+        while True:
+            shard = claim_shard(conn, job_id, worker_id, lease_seconds, max_attempts)
+            if shard is None:
+                status = job_status(conn, job_id)
+                if status['by_status'].get('running', 0) - status['expired_leases'] <= 0:
+                    break
+                time.sleep(poll_seconds)
+                continue
+
+            print(f"[{worker_id}] shard {shard['shard_no']} ({shard['mode']}, attempt {shard['attempts']})")
+            start = time.perf_counter()
+            try:
+                result = ingest_shard(conn, job_id, shard, worker_id, batch_url, batch_size, lease_seconds)
+            except LeaseLost as e:
+                print(f"[{worker_id}] {e}; moving on")
+                continue
+            except Exception as e:
+                conn.rollback()
+                print(f"[{worker_id}] shard {shard['shard_no']} failed: {e}")
+                fail_shard(conn, job_id, shard['shard_no'], worker_id, str(e), max_attempts)
+                done['errors'] += 1
+                continue
+
+            finish_shard(conn, job_id, shard['shard_no'], worker_id, result['rows_read'], result['rows_written'])
+            done['shards'] += 1
+            done['rows_read'] += result['rows_read']
+            done['rows_written'] += result['rows_written']
+            print(f"[{worker_id}] shard {shard['shard_no']} done: {result['rows_written']} rows "
+                  f"in {time.perf_counter() - start:.1f}s")
+    finally:
+        conn.close()
+    return done
+
+
+def _local_worker(kwargs):
+    return run_worker(**kwargs)
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    from multiprocessing import Pool
+
+    parser = argparse.ArgumentParser(description='Sharded ingestion coordinated through Postgres leases')
+    parser.add_argument('command', choices=['plan', 'work', 'local', 'status', 'reset'],
+                        help='plan shards, run one worker, run N local workers, show status, or '
+                             'reset failed shards to pending')
+    parser.add_argument('--job-id', required=True, help='Name shared by all workers of one load')
+    parser.add_argument('--files', nargs='+', default=[os.getenv('DATA_FILE', 'data/amazon_products.json')],
+                        help='Input files or glob patterns (plan/local)')
+    parser.add_argument('--mode', choices=['auto', 'bytes', 'hash'], default='auto')
+    parser.add_argument('--shard-mb', type=int, default=DEFAULT_SHARD_MB, help='Byte-range shard size')
+    parser.add_argument('--buckets', type=int, default=16, help='Hash buckets per file')
+    parser.add_argument('--workers', type=int, default=4, help='Local worker processes (local)')
+    parser.add_argument('--worker-id', help='Defaults to hostname-pid')
+    parser.add_argument('--batch-url', default=EMBEDDING_BATCH_URL)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--lease-seconds', type=int, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    args = parser.parse_args()
+
+    conn = connect()
+    ensure_schema(conn)
+
+    if args.command in ('plan', 'local'):
+        files = sorted({path for pattern in args.files for path in glob.glob(pattern)})
+        if not files:
+            print(f"No input files match: {' '.join(args.files)}")
+            raise SystemExit(1)
+        count = register_job(conn, args.job_id, plan_shards(files, args.mode, args.shard_mb, args.buckets))
+        print(f"Job '{args.job_id}': {count} shards over {len(files)} file(s)")
+
+    if args.command == 'reset':
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE ingest_shards SET status = 'pending', attempts = 0 "
+                           "WHERE job_id = %s AND status = 'failed'", (args.job_id,))
+            print(f"Reset {cursor.rowcount} failed shard(s)")
+        conn.commit()
+    conn.close()
+
+    worker_kwargs = {'job_id': args.job_id, 'batch_url': args.batch_url, 'batch_size': args.batch_size,
+                     'lease_seconds': args.lease_seconds, 'max_attempts': args.max_attempts}
+    if args.command == 'work':
+        print(json.dumps(run_worker(worker_id=args.worker_id, **worker_kwargs)))
+    elif args.command == 'local':
+        with Pool(args.workers) as pool:
+            for summary in pool.map(_local_worker, [worker_kwargs] * args.workers):
+                print(json.dumps(summary))
+
+    if args.command in ('status', 'local'):
+        conn = connect()
+        print(json.dumps(job_status(conn, args.job_id), indent=2))
+        conn.close()
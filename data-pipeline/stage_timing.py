@@ -0,0 +1,108 @@
+"""
+Per-stage timing for the ingestion scripts
+Accumulates wall time, CPU time (of the thread running the stage), item
+counts and, for stages that make remote calls, a latency distribution, then
+prints a summary that names the stage the run spent most of its time in
+"""
+
+import time
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+import numpy as np
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class StageTimer:
+    """Thread-safe accumulator of per-stage timings for one run"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, items: int = 1, latency: bool = False):
+        """
+        Time the enclosed block as `items` items of stage `name` (the block may
+        set the yielded dict's 'items' once it knows); with latency, keep each
+        call's duration
+        """
+        counts = {'items': items}
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield counts
+        finally:
+            self.record(name, time.perf_counter() - wall, time.thread_time() - cpu, counts['items'], latency)
+
+    def record(self, name: str, wall_seconds: float, cpu_seconds: float, items: int = 1, latency: bool = False):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'calls': 0, 'items': 0, 'wall': 0.0, 'cpu': 0.0,
+                                             'latencies_ms': array('d') if latency else None}
+            stage['calls'] += 1
+            stage['items'] += items
+            stage['wall'] += wall_seconds
+            stage['cpu'] += cpu_seconds
+            if stage['latencies_ms'] is not None:
+                stage['latencies_ms'].append(wall_seconds * 1000)
+
+    def report(self, total_seconds: Optional[float] = None) -> Dict:
+        total = total_seconds if total_seconds is not None else time.perf_counter() - self.started
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                entry = {
+                    'calls': stage['calls'],
+                    'items': stage['items'],
+                    'wall_seconds': round(stage['wall'], 3),
+                    'cpu_seconds': round(stage['cpu'], 3),
+                    'share': round(stage['wall'] / total, 4) if total else None,
+                    'items_per_sec': round(stage['items'] / stage['wall'], 1) if stage['wall'] else None,
+                }
+                latencies = stage['latencies_ms']
+                if latencies:
+                    values = np.frombuffer(latencies, dtype=np.float64)
+                    entry['latency_ms'] = {f"p{p}": round(float(np.percentile(values, p)), 2) for p in (50, 95, 99)}
+                    entry['latency_ms']['max'] = round(float(values.max()), 2)
+                    counts = np.bincount(np.searchsorted(LATENCY_BUCKETS_MS, values),
+                                         minlength=len(LATENCY_BUCKETS_MS) + 1)
+                    entry['latency_histogram'] = {
+                        (f"<={bound}ms" if i < len(LATENCY_BUCKETS_MS) else f">{LATENCY_BUCKETS_MS[-1]}ms"): int(count)
+                        for i, (bound, count) in enumerate(zip(LATENCY_BUCKETS_MS + (None,), counts))
+                    }
+                stages[name] = entry
+        bottleneck = max(stages, key=lambda name: stages[name]['wall_seconds']) if stages else None
+        return {
+            'total_seconds': round(total, 3),
+            'untimed_seconds': round(max(0.0, total - sum(s['wall_seconds'] for s in stages.values())), 3),
+            'stages': stages,
+            'bottleneck': bottleneck,
+        }
+
+    def summary(self, total_seconds: Optional[float] = None) -> str:
+        """Printable table of the report, ending with the bottleneck stage"""
+        report = self.report(total_seconds)
+        lines = [f"{'stage':<10}{'items':>10}{'wall s':>10}{'cpu s':>10}{'share':>8}{'items/s':>11}"
+                 f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+        for name, s in report['stages'].items():
+            latency = s.get('latency_ms', {})
+            lines.append(
+                f"{name:<10}{s['items']:>10}{s['wall_seconds']:>10.2f}{s['cpu_seconds']:>10.2f}"
+                f"{s['share'] or 0:>8.0%}{s['items_per_sec'] or 0:>11.1f}"
+                + ''.join(f"{latency[p]:>9.1f}" if p in latency else f"{'-':>9}" for p in ('p50', 'p95', 'p99'))
+            )
+        lines.append(f"untimed: {report['untimed_seconds']:.2f}s of {report['total_seconds']:.2f}s")
+        bottleneck = report['bottleneck']
+        if bottleneck:
+            s = report['stages'][bottleneck]
+            # Wall time not spent on this thread's CPU is time blocked on I/O, the network or a remote service
+            waiting = max(0.0, 1 - s['cpu_seconds'] / s['wall_seconds']) if s['wall_seconds'] else 0.0
+            lines.append(f"Bottleneck: {bottleneck} ({s['share'] or 0:.0%} of wall time, "
+                         f"{waiting:.0%} of it waiting rather than computing)")
+        return '\n'.join(lines)
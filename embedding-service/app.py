@@ -5,9 +5,17 @@ Deployed as a Flask service for generating embeddings
 """
 
 import os
+import json
+import time
 import logging
-from flask import Flask, request, jsonify
-from sentence_transformers import SentenceTransformer
+import threading
+import weakref
+import torch
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+
+from model_registry import ModelRegistry, UnknownModelError, parse_model_registry, truncated_view
+from overload import CACHE_ONLY, FALLBACK, NORMAL, OverloadController, Overloaded, build_modes
+from shared_cache import SharedEmbeddingCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,22 +23,164 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Load model
+# Thread topology per worker (see tune_throughput.py); unset keeps torch defaults.
+# Applied before any model loads so the intra-op pool is sized once.
+TORCH_NUM_THREADS = int(os.getenv('TORCH_NUM_THREADS', '0'))
+TORCH_NUM_INTEROP_THREADS = int(os.getenv('TORCH_NUM_INTEROP_THREADS', '0'))
+ENCODE_BATCH_SIZE = int(os.getenv('ENCODE_BATCH_SIZE', '32'))
+# Texts encoded per chunk by /embed/stream (bounds memory per request)
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '256'))
+
+if TORCH_NUM_THREADS > 0:
+    torch.set_num_threads(TORCH_NUM_THREADS)
+if TORCH_NUM_INTEROP_THREADS > 0:
+    try:
+        torch.set_num_interop_threads(TORCH_NUM_INTEROP_THREADS)
+    except RuntimeError as e:
+        # Only settable before the first parallel op in this process
+        logger.warning(f"TORCH_NUM_INTEROP_THREADS ignored: {e}")
+logger.info(f"torch threads: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}, "
+            f"encode batch size {ENCODE_BATCH_SIZE}")
+
+# Model registry: MODEL_NAME is served as 'default'; MODEL_REGISTRY adds more
+# models as "id=name_or_path,..." that are loaded lazily on first request
 MODEL_NAME = os.getenv('MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
-logger.info(f"Loading model: {MODEL_NAME}")
+MODEL_REGISTRY = os.getenv('MODEL_REGISTRY', '')
+MODEL_MEMORY_LIMIT_MB = int(os.getenv('MODEL_MEMORY_LIMIT_MB', '2048'))
+
+registry = ModelRegistry(
+    parse_model_registry(MODEL_REGISTRY, MODEL_NAME),
+    memory_limit_bytes=MODEL_MEMORY_LIMIT_MB * 1024 * 1024
+)
 
+# Load the default model eagerly so a broken image fails at startup
+logger.info(f"Loading model: {MODEL_NAME}")
 try:
-    model = SentenceTransformer(MODEL_NAME)
+    registry.get('default')
     logger.info("Model loaded successfully")
 except Exception as e:
     logger.error(f"Error loading model: {e}")
     raise
 
+# Optional embedding cache shared by all gunicorn workers on this host
+EMBEDDING_CACHE_SLOTS = int(os.getenv('EMBEDDING_CACHE_SLOTS', '0'))
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '/dev/shm/embedding-cache')
+EMBEDDING_CACHE_DIM = int(os.getenv('EMBEDDING_CACHE_DIM', '384'))
+
+cache = None
+if EMBEDDING_CACHE_SLOTS > 0:
+    try:
+        cache = SharedEmbeddingCache(EMBEDDING_CACHE_PATH, num_slots=EMBEDDING_CACHE_SLOTS, dim=EMBEDDING_CACHE_DIM)
+    except (OSError, ValueError) as e:
+        logger.error(f"Shared embedding cache disabled: {e}")
+
+
+# Overload control: under load, step through cheaper modes (shorter inputs,
+# then FALLBACK_MODEL, then cache-only for bulk callers) and back again.
+# FALLBACK_MODEL must be a registry id whose vectors share the default
+# model's space, e.g. a student trained with evaluation/distill_model.py.
+OVERLOAD_CONTROL = os.getenv('OVERLOAD_CONTROL', 'true').lower() == 'true'
+REDUCED_MAX_SEQ_LENGTH = int(os.getenv('REDUCED_MAX_SEQ_LENGTH', '128'))
+FALLBACK_MODEL = os.getenv('FALLBACK_MODEL', '')
+if FALLBACK_MODEL and FALLBACK_MODEL not in registry.models:
+    raise ValueError(f"FALLBACK_MODEL '{FALLBACK_MODEL}' is not in MODEL_REGISTRY")
+
+overload = OverloadController(
+    build_modes(REDUCED_MAX_SEQ_LENGTH, FALLBACK_MODEL),
+    max_inflight=int(os.getenv('OVERLOAD_MAX_INFLIGHT', '4')),
+    recover_inflight=int(os.getenv('OVERLOAD_RECOVER_INFLIGHT', '1')),
+    p95_ms=float(os.getenv('OVERLOAD_P95_MS', '250')),
+    recover_p95_ms=float(os.getenv('OVERLOAD_RECOVER_P95_MS', '100')),
+    window_seconds=float(os.getenv('OVERLOAD_WINDOW_SECONDS', '10')),
+    step_seconds=float(os.getenv('OVERLOAD_STEP_SECONDS', '2')),
+    cooldown_seconds=float(os.getenv('OVERLOAD_COOLDOWN_SECONDS', '15')),
+    enabled=OVERLOAD_CONTROL
+)
+# Reduced-length views of loaded models (weights shared); weak keys so an
+# evicted model is not kept alive by its view
+reduced_models = weakref.WeakKeyDictionary()
+reduced_models_lock = threading.Lock()
+
+
+def reduced_model(model):
+    """The REDUCED_MAX_SEQ_LENGTH view of a model, built on first use"""
+    with reduced_models_lock:
+        view = reduced_models.get(model)
+        if view is None:
+            view = reduced_models[model] = truncated_view(model, REDUCED_MAX_SEQ_LENGTH)
+        return view
+
+
+def encode_with_cache(model_id: str, texts, mode: str = NORMAL, bulk: bool = False):
+    """
+    Encode texts, serving repeats from the shared cache when enabled.
+    Outside normal mode inputs are truncated to REDUCED_MAX_SEQ_LENGTH, the
+    default model may be swapped for FALLBACK_MODEL, and in cache-only mode
+    bulk requests with uncached texts raise Overloaded. Only full-quality
+    vectors are written to the cache.
+    """
+    cache_name = registry.models[model_id]
+    cached = cache.get_many(cache_name, texts) if cache else [None] * len(texts)
+    missing = [i for i, vector in enumerate(cached) if vector is None]
+    if missing and mode == CACHE_ONLY and bulk:
+        raise Overloaded(f"{len(missing)} of {len(texts)} texts are not cached")
+    if missing:
+        serve_id = FALLBACK_MODEL if mode in (FALLBACK, CACHE_ONLY) and FALLBACK_MODEL and model_id == 'default' \
+            else model_id
+        model = registry.get(serve_id)
+        # Never change the shared model's settings: other threads are encoding with it
+        reduced = mode != NORMAL and REDUCED_MAX_SEQ_LENGTH > 0
+        if reduced:
+            model = reduced_model(model)
+        start = time.perf_counter()
+        encoded = model.encode([texts[i] for i in missing], batch_size=ENCODE_BATCH_SIZE,
+                               convert_to_numpy=True, normalize_embeddings=True)
+        registry.record(serve_id, len(missing), (time.perf_counter() - start) * 1000)
+        for i, vector in zip(missing, encoded):
+            cached[i] = vector
+            if cache and serve_id == model_id and not reduced:
+                cache.put(cache_name, texts[i], vector)
+    return cached
+
+
+def overloaded_response(e: Overloaded):
+    overload.reject()
+    response = jsonify({'error': f'Service overloaded: {e}', 'mode': overload.mode})
+    response.headers['Retry-After'] = str(int(overload.step_seconds) + 1)
+    return response, 503
+
+
+@app.after_request
+def add_mode_header(response):
+    """Serving mode of this request (or the current mode, for requests that do not encode)"""
+    response.headers['X-Embedding-Mode'] = g.get('embedding_mode', overload.mode)
+    return response
+
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'model': MODEL_NAME}), 200
+    return jsonify({'status': 'healthy', 'model': MODEL_NAME, 'mode': overload.mode}), 200
+
+
+@app.route('/overload', methods=['GET'])
+def overload_stats():
+    """Current serving mode, load signals, thresholds and per-mode counters for this worker"""
+    return jsonify(overload.describe()), 200
+
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    """Registered models, which are loaded, and per-model latency/memory stats"""
+    return jsonify(registry.describe()), 200
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Shared cache hit rate and eviction counters, summed across workers"""
+    if cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **cache.stats()}), 200
 
 
 @app.route('/embed', methods=['POST'])
@@ -40,13 +190,15 @@ def embed():
 
     Request body:
     {
-        "text": "wireless bluetooth headphones"
+        "text": "wireless bluetooth headphones",
+        "model": "default"                       (optional model id)
     }
 
     Response:
     {
         "embedding": [0.123, -0.456, ...],
-        "dimension": 384
+        "dimension": 384,
+        "model": "default"
     }
     """
     try:
@@ -59,14 +211,22 @@ def embed():
             return jsonify({'error': 'Text must be a non-empty string'}), 400
 
         # Generate embedding
-        embedding = model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+        model_id = data.get('model') or 'default'
+        with overload.track() as mode:
+            g.embedding_mode = mode
+            start = time.perf_counter()
+            embedding = encode_with_cache(model_id, [text], mode)[0]
+            overload.observe((time.perf_counter() - start) * 1000)
         embedding_list = embedding.tolist()
 
         return jsonify({
             'embedding': embedding_list,
-            'dimension': len(embedding_list)
+            'dimension': len(embedding_list),
+            'model': model_id
         }), 200
 
+    except UnknownModelError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error generating embedding: {e}")
         return jsonify({'error': str(e)}), 500
@@ -79,13 +239,15 @@ def embed_batch():
 
     Request body:
     {
-        "texts": ["text1", "text2", ...]
+        "texts": ["text1", "text2", ...],
+        "model": "default"                       (optional model id)
     }
 
     Response:
     {
         "embeddings": [[...], [...], ...],
-        "count": 2
+        "count": 2,
+        "model": "default"
     }
     """
     try:
@@ -98,19 +260,107 @@ def embed_batch():
             return jsonify({'error': 'Texts must be a non-empty list'}), 400
 
         # Generate embeddings
-        embeddings = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
-        embeddings_list = embeddings.tolist()
+        model_id = data.get('model') or 'default'
+        with overload.track() as mode:
+            g.embedding_mode = mode
+            embeddings = encode_with_cache(model_id, texts, mode, bulk=True)
+        embeddings_list = [embedding.tolist() for embedding in embeddings]
 
         return jsonify({
             'embeddings': embeddings_list,
-            'count': len(embeddings_list)
+            'count': len(embeddings_list),
+            'model': model_id
         }), 200
 
+    except UnknownModelError as e:
+        return jsonify({'error': str(e)}), 400
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         logger.error(f"Error generating batch embeddings: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def parse_stream_line(line: bytes):
+    """One NDJSON input line: a JSON string, or an object with "text" and optional "id" """
+    item = json.loads(line)
+    if isinstance(item, str):
+        return None, item
+    if isinstance(item, dict) and isinstance(item.get('text'), str):
+        return item.get('id'), item['text']
+    raise ValueError('each line must be a JSON string or an object with a "text" field')
+
+
+@app.route('/embed/stream', methods=['POST'])
+def embed_stream():
+    """
+    Stream embeddings for an arbitrarily large NDJSON request
+
+    Request body (application/x-ndjson, may be sent chunked), one text per line:
+        {"id": "B000123", "text": "wireless bluetooth headphones"}
+        "or just a JSON string"
+
+    Query parameter: model (optional model id)
+
+    Response (application/x-ndjson), one line per input line, in order, sent
+    as soon as each chunk of STREAM_CHUNK_SIZE texts is encoded:
+        {"index": 0, "id": "B000123", "embedding": [...]}
+        {"index": 1, "error": "..."}             (for an invalid input line)
+    The last line is {"done": true, "count": N, "model": "default"}.
+    """
+    model_id = request.args.get('model') or 'default'
+    try:
+        registry.get(model_id)
+    except UnknownModelError as e:
+        return jsonify({'error': str(e)}), 400
+    if overload.mode == CACHE_ONLY:
+        return overloaded_response(Overloaded('streams are not accepted in cache-only mode'))
+    g.embedding_mode = overload.mode
+
+    def flush(pending):
+        valid = [(index, item_id, text) for index, item_id, text in pending if text is not None]
+        # Each chunk follows the current mode; a stream already under way is
+        # degraded but not cut off
+        mode = overload.mode
+        embeddings = encode_with_cache(model_id, [text for _, _, text in valid], mode) if valid else []
+        for (index, item_id, _), embedding in zip(valid, embeddings):
+            line = {'index': index}
+            if item_id is not None:
+                line['id'] = item_id
+            line['embedding'] = embedding.tolist()
+            yield json.dumps(line) + '\n'
+
+    def generate():
+        pending, count = [], 0
+        try:
+            # The stream holds a worker thread for its whole duration
+            with overload.track():
+                for raw in request.stream:
+                    if not raw.strip():
+                        continue
+                    try:
+                        item_id, text = parse_stream_line(raw)
+                        if not text.strip():
+                            raise ValueError('text must be a non-empty string')
+                        pending.append((count, item_id, text))
+                    except ValueError as e:  # includes JSONDecodeError
+                        yield from flush(pending)
+                        pending = []
+                        yield json.dumps({'index': count, 'error': str(e)}) + '\n'
+                    count += 1
+                    if len(pending) >= STREAM_CHUNK_SIZE:
+                        yield from flush(pending)
+                        pending = []
+                yield from flush(pending)
+            yield json.dumps({'done': True, 'count': count, 'model': model_id}) + '\n'
+        except Exception as e:
+            # Headers are already sent; report the failure in-band
+            logger.error(f"Error streaming embeddings: {e}")
+            yield json.dumps({'done': False, 'error': str(e)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=False)
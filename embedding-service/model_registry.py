@@ -0,0 +1,173 @@
+"""
+Model registry for the embedding service
+Loads models lazily on first use, caps total resident model memory with
+LRU eviction, and keeps per-model latency and memory stats
+"""
+
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModelError(Exception):
+    """Raised when a request names a model id that is not registered"""
+
+
+def parse_model_registry(spec: str, default_model: str) -> Dict[str, str]:
+    """
+    Parse MODEL_REGISTRY ("id=name_or_path,id2=name_or_path2") into a mapping.
+    The default model is always registered under the id 'default'.
+    """
+    models = {'default': default_model}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        model_id, sep, name = entry.partition('=')
+        if not sep or not model_id.strip() or not name.strip():
+            raise ValueError(f"Invalid MODEL_REGISTRY entry '{entry}' (expected id=model)")
+        models[model_id.strip()] = name.strip()
+    return models
+
+
+def model_memory_bytes(model: SentenceTransformer) -> int:
+    """Resident size of a model's parameters and buffers"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def truncated_view(model: SentenceTransformer, max_seq_length: int) -> SentenceTransformer:
+    """
+    A model sharing `model`'s weights and tokenizer that truncates inputs to
+    max_seq_length. Only the first (Transformer) module is copied, shallowly,
+    so `model` itself is never modified and both can encode concurrently.
+    """
+    modules = list(model)
+    first = copy.copy(modules[0])
+    first.max_seq_length = min(first.max_seq_length, max_seq_length)
+    return SentenceTransformer(modules=[first] + modules[1:], device=str(model.device))
+
+
+class ModelStats:
+    """Counters and a bounded latency window for one model id"""
+
+    def __init__(self, window: int = 1000):
+        self.requests = 0
+        self.texts = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.memory_bytes = 0
+        self.last_used = None
+        self.latencies_ms = deque(maxlen=window)
+
+    def to_dict(self) -> Dict:
+        latencies = np.asarray(self.latencies_ms) if self.latencies_ms else None
+        return {
+            'requests': self.requests,
+            'texts': self.texts,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'load_seconds': round(self.load_seconds, 3),
+            'memory_mb': round(self.memory_bytes / (1024 * 1024), 1),
+            'last_used': self.last_used,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2) if latencies is not None else None,
+            'latency_p95_ms': round(float(np.percentile(latencies, 95)), 2) if latencies is not None else None,
+        }
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, memory-capped set of SentenceTransformer models.
+
+    Each model id has its own load lock, so concurrent first requests for the
+    same model trigger a single load while requests for other, already loaded
+    models are not blocked. After a load, least recently used models are
+    evicted until the resident total fits in memory_limit_bytes (the model
+    just loaded is never evicted, even if it alone exceeds the limit).
+    """
+
+    def __init__(self, models: Dict[str, str], memory_limit_bytes: int, loader=SentenceTransformer):
+        self.models = models
+        self.memory_limit_bytes = memory_limit_bytes
+        self._loader = loader
+        self._loaded = OrderedDict()  # model_id -> model, least recently used first
+        self._lock = threading.Lock()
+        self._load_locks = {model_id: threading.Lock() for model_id in models}
+        self.stats = {model_id: ModelStats() for model_id in models}
+
+    def get(self, model_id: Optional[str] = None) -> SentenceTransformer:
+        """Return a loaded model, loading (and evicting others) if needed"""
+        model_id = model_id or 'default'
+        if model_id not in self.models:
+            raise UnknownModelError(f"Unknown model '{model_id}' (available: {', '.join(sorted(self.models))})")
+
+        with self._lock:
+            model = self._loaded.get(model_id)
+            if model is not None:
+                self._loaded.move_to_end(model_id)
+                return model
+
+        with self._load_locks[model_id]:
+            # Another request may have finished loading while we waited
+            with self._lock:
+                model = self._loaded.get(model_id)
+                if model is not None:
+                    self._loaded.move_to_end(model_id)
+                    return model
+
+            name = self.models[model_id]
+            logger.info(f"Loading model '{model_id}': {name}")
+            start = time.perf_counter()
+            model = self._loader(name)
+            stats = self.stats[model_id]
+            stats.load_seconds = time.perf_counter() - start
+            stats.loads += 1
+            stats.memory_bytes = model_memory_bytes(model)
+            logger.info(f"Model '{model_id}' loaded in {stats.load_seconds:.1f}s "
+                        f"({stats.memory_bytes / (1024 * 1024):.0f} MB)")
+
+            with self._lock:
+                self._loaded[model_id] = model
+                self._evict_locked(keep=model_id)
+            return model
+
+    def _evict_locked(self, keep: str):
+        """Evict LRU models until under the memory limit; caller holds self._lock"""
+        while self.resident_bytes() > self.memory_limit_bytes:
+            victim = next((mid for mid in self._loaded if mid != keep), None)
+            if victim is None:
+                break
+            del self._loaded[victim]
+            self.stats[victim].evictions += 1
+            logger.info(f"Evicted model '{victim}' to stay under "
+                        f"{self.memory_limit_bytes / (1024 * 1024):.0f} MB")
+
+    def resident_bytes(self) -> int:
+        return sum(self.stats[mid].memory_bytes for mid in self._loaded)
+
+    def record(self, model_id: Optional[str], texts: int, latency_ms: float):
+        """Record one encode call for a model"""
+        stats = self.stats[model_id or 'default']
+        with self._lock:
+            stats.requests += 1
+            stats.texts += texts
+            stats.last_used = time.time()
+            stats.latencies_ms.append(latency_ms)
+
+    def describe(self) -> Dict:
+        """Registry state and per-model stats for the /models endpoint"""
+        with self._lock:
+            return {
+                'memory_limit_mb': round(self.memory_limit_bytes / (1024 * 1024), 1),
+                'resident_mb': round(self.resident_bytes() / (1024 * 1024), 1),
+                'models': {
+                    model_id: {'name': name, 'loaded': model_id in self._loaded, **self.stats[model_id].to_dict()}
+                    for model_id, name in self.models.items()
+                },
+            }
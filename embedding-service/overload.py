@@ -0,0 +1,158 @@
+"""
+Overload controller for the embedding service
+Watches in-flight requests and recent /embed latency per worker and steps
+through progressively cheaper serving modes when either crosses its high
+threshold, stepping back one mode at a time only after both have stayed
+under their low thresholds for a cooldown period (hysteresis)
+"""
+
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+NORMAL = 'normal'
+REDUCED = 'reduced'        # shorter max_seq_length
+FALLBACK = 'fallback'      # cheaper model in the same embedding space
+CACHE_ONLY = 'cache-only'  # bulk callers get cached vectors or 503
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be served in the current mode"""
+
+
+def build_modes(reduced_max_seq_length: int, fallback_model: Optional[str]) -> List[str]:
+    """The degradation ladder, skipping steps that are not configured"""
+    modes = [NORMAL]
+    if reduced_max_seq_length > 0:
+        modes.append(REDUCED)
+    if fallback_model:
+        modes.append(FALLBACK)
+    modes.append(CACHE_ONLY)
+    return modes
+
+
+class OverloadController:
+    """
+    Per-process mode state machine.
+
+    Steps up one mode when in-flight requests reach max_inflight or the p95
+    of /embed latency over the last window_seconds reaches p95_ms, at most
+    once per step_seconds. Steps down one mode once in-flight has stayed at
+    or below recover_inflight and p95 at or below recover_p95_ms for
+    cooldown_seconds.
+    """
+
+    def __init__(self, modes: List[str], max_inflight: int = 4, recover_inflight: int = 1, p95_ms: float = 250.0,
+                 recover_p95_ms: float = 100.0, window_seconds: float = 10.0, step_seconds: float = 2.0,
+                 cooldown_seconds: float = 15.0, enabled: bool = True, clock=time.monotonic):
+        self.modes = modes
+        self.max_inflight = max_inflight
+        self.recover_inflight = recover_inflight
+        self.p95_ms = p95_ms
+        self.recover_p95_ms = recover_p95_ms
+        self.window_seconds = window_seconds
+        self.step_seconds = step_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=5000)  # (time, ms)
+        self.level = 0
+        self.in_flight = 0
+        self._last_change = clock()
+        self._calm_since: Optional[float] = None
+        self.transitions = 0
+        self.requests_by_mode = {mode: 0 for mode in modes}
+        self.seconds_in_mode = {mode: 0.0 for mode in modes}
+        self.rejected = 0
+
+    @property
+    def mode(self) -> str:
+        return self.modes[self.level]
+
+    def p95(self, now: Optional[float] = None) -> Optional[float]:
+        now = self._clock() if now is None else now
+        recent = [ms for at, ms in self._latencies if now - at <= self.window_seconds]
+        return float(np.percentile(recent, 95)) if recent else None
+
+    def observe(self, latency_ms: float):
+        """Record the latency of one /embed request"""
+        with self._lock:
+            self._latencies.append((self._clock(), latency_ms))
+            self._update_locked()
+
+    @contextmanager
+    def track(self):
+        """Count a request as in flight; yields the mode it should be served in"""
+        with self._lock:
+            self.in_flight += 1
+            self._update_locked()
+            mode = self.mode
+            self.requests_by_mode[mode] += 1
+        try:
+            yield mode
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self._update_locked()
+
+    def _set_level_locked(self, level: int, now: float):
+        self.seconds_in_mode[self.mode] += now - self._last_change
+        self.level = level
+        self._last_change = now
+        self._calm_since = None
+        self.transitions += 1
+        # Judge the new mode on its own latencies
+        self._latencies.clear()
+
+    def _update_locked(self):
+        if not self.enabled:
+            return
+        now = self._clock()
+        p95 = self.p95(now)
+        hot = self.in_flight >= self.max_inflight or (p95 is not None and p95 >= self.p95_ms)
+        calm = self.in_flight <= self.recover_inflight and (p95 is None or p95 <= self.recover_p95_ms)
+
+        if hot:
+            self._calm_since = None
+            if self.level < len(self.modes) - 1 and now - self._last_change >= self.step_seconds:
+                self._set_level_locked(self.level + 1, now)
+        elif calm and self.level > 0:
+            if self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.cooldown_seconds:
+                self._set_level_locked(self.level - 1, now)
+        else:
+            self._calm_since = None
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def describe(self) -> Dict:
+        with self._lock:
+            now = self._clock()
+            self._update_locked()
+            seconds = dict(self.seconds_in_mode)
+            seconds[self.mode] += now - self._last_change
+            p95 = self.p95(now)
+            return {
+                'enabled': self.enabled,
+                'mode': self.mode,
+                'modes': self.modes,
+                'in_flight': self.in_flight,
+                'p95_ms': round(p95, 2) if p95 is not None else None,
+                'thresholds': {
+                    'max_inflight': self.max_inflight, 'recover_inflight': self.recover_inflight,
+                    'p95_ms': self.p95_ms, 'recover_p95_ms': self.recover_p95_ms,
+                    'step_seconds': self.step_seconds, 'cooldown_seconds': self.cooldown_seconds,
+                },
+                'transitions': self.transitions,
+                'requests_by_mode': dict(self.requests_by_mode),
+                'seconds_in_mode': {mode: round(value, 1) for mode, value in seconds.items()},
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,237 @@
+"""
+Shared-memory embedding cache for all gunicorn workers on a host
+A fixed-size, set-associative hash table of float32 vectors in an mmap'd
+file (on /dev/shm by default). Reads are lock-free (per-slot sequence
+counters), writes take a striped lock, and full sets evict with CLOCK
+"""
+
+import os
+import mmap
+import fcntl
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x45434143484531  # "ECACHE1"
+HEADER_BYTES = 4096
+MAX_WORKERS = 256
+NUM_STRIPES = 64
+
+# Header: magic, num_sets, ways, dim, ready
+HEADER_FIELDS = 5
+# Per-worker counters: pid, hits, misses, inserts, evictions
+WORKER_FIELDS = 5
+HITS, MISSES, INSERTS, EVICTIONS = 1, 2, 3, 4
+
+SLOT_DTYPE = np.dtype([
+    ('key', '<u8'),      # first half of the key digest; 0 = empty
+    ('check', '<u8'),    # second half, guards against set-index collisions
+    ('seq', '<u4'),      # odd while a writer is updating the slot
+    ('ref', 'u1'),       # CLOCK reference bit
+    ('pad', 'u1', 3),
+])
+
+
+def cache_key(model_name: str, text: str) -> Tuple[int, int]:
+    """128-bit key for (model, text) split into two non-zero uint64 halves"""
+    digest = hashlib.blake2b(f"{model_name}\0{text}".encode('utf-8'), digest_size=16).digest()
+    key = int.from_bytes(digest[:8], 'little') or 1
+    check = int.from_bytes(digest[8:], 'little')
+    return key, check
+
+
+class SharedEmbeddingCache:
+    """
+    Embedding cache shared by every process that opens the same path.
+
+    Layout: header page, per-worker counter rows (each worker only writes its
+    own row, so counters need only a thread lock), CLOCK hands, slot metadata and the
+    vector array. Readers copy a vector and re-check the slot's sequence
+    counter, retrying if a writer touched it in between. Writers serialize per
+    stripe of sets with an fcntl byte-range lock (across processes) plus a
+    thread lock (within a process).
+    """
+
+    def __init__(self, path: str, num_slots: int = 65536, dim: int = 384, ways: int = 8):
+        self.path = path
+        self.ways = ways
+        self.dim = dim
+        self.num_sets = max(1, num_slots // ways)
+
+        self._worker_offset = HEADER_BYTES
+        self._hands_offset = self._worker_offset + MAX_WORKERS * WORKER_FIELDS * 8
+        self._slots_offset = self._hands_offset + self.num_sets * 4
+        self._vectors_offset = self._align(self._slots_offset + self.num_sets * ways * SLOT_DTYPE.itemsize)
+        self.size = self._vectors_offset + self.num_sets * ways * dim * 4
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._thread_locks = [threading.Lock() for _ in range(NUM_STRIPES)]
+        # gthread request threads share the worker's counter row; += on it is a read-modify-write
+        self._count_lock = threading.Lock()
+        self._initialize()
+
+        self._mm = mmap.mmap(self._fd, self.size)
+        self._header = np.ndarray((HEADER_FIELDS,), dtype='<u8', buffer=self._mm, offset=0)
+        self._workers = np.ndarray((MAX_WORKERS, WORKER_FIELDS), dtype='<u8', buffer=self._mm,
+                                   offset=self._worker_offset)
+        self._hands = np.ndarray((self.num_sets,), dtype='<u4', buffer=self._mm, offset=self._hands_offset)
+        self._slots = np.ndarray((self.num_sets, ways), dtype=SLOT_DTYPE, buffer=self._mm,
+                                 offset=self._slots_offset)
+        self._vectors = np.ndarray((self.num_sets, ways, dim), dtype='<f4', buffer=self._mm,
+                                   offset=self._vectors_offset)
+        self._row = self._claim_worker_row()
+
+    @staticmethod
+    def _align(offset: int, alignment: int = 64) -> int:
+        return (offset + alignment - 1) // alignment * alignment
+
+    def _initialize(self):
+        """Size and format the file once; later processes validate the header"""
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+            expected = (MAGIC, self.num_sets, self.ways, self.dim)
+            with mmap.mmap(self._fd, HEADER_BYTES) as mm:
+                header = np.ndarray((HEADER_FIELDS,), dtype='<u8', buffer=mm)
+                ready = int(header[4]) == 1
+                layout = tuple(int(v) for v in header[:4])
+                if not ready:
+                    header[:4] = expected
+                    header[4] = 1
+                del header  # release the buffer before the mmap closes
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+        if ready and layout != expected:
+            raise ValueError(f"Cache file {self.path} has a different layout; "
+                             f"remove it or change EMBEDDING_CACHE_PATH")
+        if not ready:
+            logger.info(f"Initialized shared embedding cache at {self.path} "
+                        f"({self.size / (1024 * 1024):.0f} MB)")
+
+    def _claim_worker_row(self) -> int:
+        """Take this process's counter row (reusing rows of dead processes)"""
+        pid = os.getpid()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            free = None
+            for row in range(MAX_WORKERS):
+                owner = int(self._workers[row, 0])
+                if owner == pid:
+                    return row
+                if free is None and (owner == 0 or not self._pid_alive(owner)):
+                    free = row
+            row = free if free is not None else pid % MAX_WORKERS
+            self._workers[row, 0] = pid
+            return row
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def _count(self, field: int, amount: int = 1):
+        with self._count_lock:
+            self._workers[self._row, field] += amount
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        """Cached vector for (model, text), or None; never blocks on writers"""
+        key, check = cache_key(model_name, text)
+        set_idx = key % self.num_sets
+        slots = self._slots[set_idx]
+        for way in range(self.ways):
+            if slots['key'][way] != key:
+                continue
+            for _ in range(3):
+                seq = int(slots['seq'][way])
+                if seq & 1:
+                    continue
+                vector = self._vectors[set_idx, way].copy()
+                if (int(slots['seq'][way]) == seq and slots['key'][way] == key
+                        and slots['check'][way] == check):
+                    slots['ref'][way] = 1
+                    self._count(HITS)
+                    return vector
+            break
+        self._count(MISSES)
+        return None
+
+    def put(self, model_name: str, text: str, vector: np.ndarray):
+        """Store a vector, evicting with CLOCK if the set is full"""
+        if vector.shape[-1] != self.dim:
+            return
+        key, check = cache_key(model_name, text)
+        set_idx = key % self.num_sets
+        stripe = set_idx % NUM_STRIPES
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, stripe)
+            try:
+                self._put_locked(set_idx, key, check, vector)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, stripe)
+
+    def _put_locked(self, set_idx: int, key: int, check: int, vector: np.ndarray):
+        slots = self._slots[set_idx]
+        keys = slots['key']
+        way = next((w for w in range(self.ways) if keys[w] == key and slots['check'][w] == check), None)
+        if way is None:
+            way = next((w for w in range(self.ways) if keys[w] == 0), None)
+        if way is None:
+            # CLOCK: clear reference bits until an unreferenced slot comes up
+            hand = int(self._hands[set_idx])
+            while slots['ref'][hand]:
+                slots['ref'][hand] = 0
+                hand = (hand + 1) % self.ways
+            way = hand
+            self._hands[set_idx] = (hand + 1) % self.ways
+            self._count(EVICTIONS)
+
+        slots['seq'][way] += 1  # odd: readers back off
+        keys[way] = key
+        slots['check'][way] = check
+        self._vectors[set_idx, way] = vector
+        slots['ref'][way] = 0
+        slots['seq'][way] += 1
+        self._count(INSERTS)
+
+    def get_many(self, model_name: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        return [self.get(model_name, text) for text in texts]
+
+    def stats(self) -> Dict:
+        """
+        Counters summed across all workers on this host, plus a breakdown by
+        live worker. Rows of dead workers are reused, so totals only grow.
+        """
+        rows = self._workers.copy()
+        active = rows[rows[:, 0] != 0]
+        hits, misses = int(active[:, HITS].sum()), int(active[:, MISSES].sum())
+        lookups = hits + misses
+        occupied = int(np.count_nonzero(self._slots['key']))
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            'inserts': int(active[:, INSERTS].sum()),
+            'evictions': int(active[:, EVICTIONS].sum()),
+            'workers': int(len(active)),
+            'slots': self.num_sets * self.ways,
+            'occupied': occupied,
+            'size_mb': round(self.size / (1024 * 1024), 1),
+            'per_worker': [
+                {'pid': int(row[0]), 'hits': int(row[HITS]), 'misses': int(row[MISSES])}
+                for row in active if self._pid_alive(int(row[0]))
+            ],
+        }
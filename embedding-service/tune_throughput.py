@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Throughput tuner for the embedding service
+Sweeps gunicorn workers x torch threads per worker x encode batch size on the
+current machine, drives each configuration with a synthetic or recorded text
+workload, and recommends the fastest configuration that meets a p95 target,
+printed as the env vars to set on the container
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import Dict, List, Optional
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Request threads per gthread worker, as served by the Dockerfile's CMD (--threads 4)
+GUNICORN_THREADS = 4
+
+VOCABULARY = (
+    'wireless bluetooth headphones noise cancelling earbuds charger cable usb fast laptop stand aluminum '
+    'portable speaker waterproof smart watch fitness tracker kitchen blender stainless steel coffee grinder '
+    'gaming mouse keyboard mechanical camera lens tripod backpack travel organizer led desk lamp monitor'
+).split()
+
+
+def available_cpus() -> float:
+    """vCPUs this container may use: the cgroup CPU quota if set (Fargate), else the affinity mask"""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return float(len(os.sched_getaffinity(0)))
+
+
+def powers_of_two(limit: int) -> List[int]:
+    values, n = [], 1
+    while n <= limit:
+        values.append(n)
+        n *= 2
+    return values
+
+
+def candidate_configs(cpus: float, workers: Optional[List[int]] = None, threads: Optional[List[int]] = None,
+                      batch_sizes: Optional[List[int]] = None) -> List[Dict]:
+    """Worker/thread/batch combinations that do not oversubscribe the CPUs"""
+    limit = max(1, int(round(cpus)))
+    workers = workers or powers_of_two(limit)
+    threads = threads or powers_of_two(limit)
+    batch_sizes = batch_sizes or [16, 32, 64]
+    return [
+        {'workers': w, 'threads': t, 'batch_size': b}
+        for w, t, b in product(workers, threads, batch_sizes)
+        if w * t <= limit
+    ]
+
+
+def synthetic_texts(count: int, min_words: int = 5, max_words: int = 60, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [' '.join(rng.choices(VOCABULARY, k=rng.randint(min_words, max_words))) for _ in range(count)]
+
+
+def load_workload(path: str) -> List[str]:
+    """Recorded texts: one per line, or JSON lines with a "text" or "query" field"""
+    texts = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                line = record.get('text') or record.get('query') or ''
+            if line:
+                texts.append(line)
+    return texts
+
+
+def post_json(url: str, payload: Dict, timeout: float = 300) -> Dict:
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def measure(base_url: str, texts: List[str], request_size: int, concurrency: int, duration: float = 20.0,
+            warmup_requests: int = 4) -> Dict:
+    """
+    Closed-loop load: `concurrency` clients send requests of `request_size`
+    texts (to /embed when 1, else /embed/batch) back to back for `duration`
+    seconds. Returns throughput and latency percentiles.
+    """
+    base_url = base_url.rstrip('/')
+
+    def payload(i):
+        if request_size == 1:
+            return base_url + '/embed', {'text': texts[i % len(texts)]}
+        start = (i * request_size) % len(texts)
+        chunk = (texts[start:] + texts)[:request_size]
+        return base_url + '/embed/batch', {'texts': chunk}
+
+    for i in range(warmup_requests):
+        post_json(*payload(i))
+
+    deadline = time.perf_counter() + duration
+
+    def client(worker: int):
+        latencies, errors, i = [], 0, worker
+        while time.perf_counter() < deadline:
+            url, body = payload(i)
+            start = time.perf_counter()
+            try:
+                post_json(url, body)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception:
+                errors += 1
+            i += concurrency
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.asarray([ms for lat, _ in results for ms in lat])
+    requests_done = len(latencies)
+    return {
+        'requests': requests_done,
+        'errors': sum(errors for _, errors in results),
+        'texts_per_sec': round(requests_done * request_size / elapsed, 1),
+        'requests_per_sec': round(requests_done / elapsed, 2),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 1) if requests_done else None,
+        'p95_ms': round(float(np.percentile(latencies, 95)), 1) if requests_done else None,
+        'p99_ms': round(float(np.percentile(latencies, 99)), 1) if requests_done else None,
+    }
+
+
+def config_env(config: Dict) -> Dict[str, str]:
+    """The env vars app.py and gunicorn read for this configuration"""
+    return {
+        'WEB_CONCURRENCY': str(config['workers']),
+        'TORCH_NUM_THREADS': str(config['threads']),
+        'ENCODE_BATCH_SIZE': str(config['batch_size']),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_service(config: Dict, port: int, request_threads: int = GUNICORN_THREADS,
+                  startup_timeout: float = 300) -> subprocess.Popen:
+    """
+    Run app.py under gunicorn with this configuration and wait until /health
+    answers. request_threads is gunicorn's --threads, which should match the
+    deployed value: it sets how many requests each worker encodes concurrently
+    """
+    env = {**os.environ, **config_env(config), 'EMBEDDING_CACHE_SLOTS': '0', 'OVERLOAD_CONTROL': 'false',
+           # Keep BLAS/OpenMP pools in line with torch's intra-op setting
+           'OMP_NUM_THREADS': str(config['threads']), 'MKL_NUM_THREADS': str(config['threads'])}
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--worker-class', 'gthread',
+         '--threads', str(request_threads), '--timeout', '300', 'app:app'],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited during startup (code {process.returncode})")
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=2):
+                # /health answers once one worker is up; give the rest time to load the model
+                time.sleep(2 * config['workers'])
+                return process
+        except OSError:
+            time.sleep(1)
+    process.terminate()
+    raise RuntimeError(f"Service did not become healthy within {startup_timeout:.0f}s")
+
+
+def stop_service(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def recommend(results: List[Dict], p95_target_ms: Optional[float] = None) -> Optional[Dict]:
+    """Highest throughput among error-free runs that meet the p95 target (if any)"""
+    eligible = [r for r in results if r['errors'] == 0 and r['requests']]
+    if p95_target_ms is not None:
+        within = [r for r in eligible if r['p95_ms'] <= p95_target_ms]
+        eligible = within or eligible
+    return max(eligible, key=lambda r: r['texts_per_sec']) if eligible else None
+
+
+def sweep(configs: List[Dict], texts: List[str], request_size: int, duration: float,
+          concurrency_per_worker: int = 2, request_threads: int = GUNICORN_THREADS) -> List[Dict]:
+    results = []
+    for i, config in enumerate(configs, 1):
+        label = f"workers={config['workers']} threads={config['threads']} batch={config['batch_size']}"
+        print(f"[{i}/{len(configs)}] {label}", flush=True)
+        port = free_port()
+        try:
+            process = start_service(config, port, request_threads)
+        except RuntimeError as e:
+            print(f"  skipped: {e}")
+            continue
+        try:
+            concurrency = config['workers'] * concurrency_per_worker
+            stats = measure(f'http://127.0.0.1:{port}', texts, request_size, concurrency, duration)
+        finally:
+            stop_service(process)
+        results.append({**config, 'concurrency': concurrency, **stats})
+        print(f"  {stats['texts_per_sec']} texts/s, p95 {stats['p95_ms']} ms, errors {stats['errors']}")
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    def int_list(value):
+        return [int(v) for v in value.split(',') if v]
+
+    parser = argparse.ArgumentParser(description='Find the fastest worker/thread/batch topology on this machine')
+    parser.add_argument('--workload', help='Recorded texts (one per line or JSON lines); synthetic if omitted')
+    parser.add_argument('--request-size', type=int, default=32,
+                        help='Texts per request: 1 benchmarks /embed (query traffic), more benchmarks /embed/batch')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds of load per configuration')
+    parser.add_argument('--workers', type=int_list, help='Worker counts to try, e.g. 1,2,4 (default: powers of 2)')
+    parser.add_argument('--threads', type=int_list, help='Torch threads per worker to try (default: powers of 2)')
+    parser.add_argument('--batch-sizes', type=int_list, help='Encode batch sizes to try (default: 16,32,64)')
+    parser.add_argument('--cpus', type=float, help='vCPUs to plan for (default: cgroup quota or affinity)')
+    parser.add_argument('--concurrency-per-worker', type=int, default=2)
+    parser.add_argument('--request-threads', type=int, default=GUNICORN_THREADS,
+                        help='gunicorn --threads per worker; keep it equal to the deployed value '
+                             f'(Dockerfile: {GUNICORN_THREADS})')
+    parser.add_argument('--p95-target-ms', type=float, help='Only recommend configurations under this p95')
+    parser.add_argument('--output', help='Write all results and the recommendation as JSON')
+
+    args = parser.parse_args()
+
+    cpus = args.cpus or available_cpus()
+    texts = load_workload(args.workload) if args.workload else synthetic_texts(2000)
+    batch_sizes = args.batch_sizes if args.request_size > 1 else [args.batch_sizes[0] if args.batch_sizes else 32]
+    configs = candidate_configs(cpus, args.workers, args.threads, batch_sizes)
+    print(f"{cpus:g} vCPUs, {len(configs)} configurations, {len(texts)} workload texts, "
+          f"{args.request_size} texts/request, gunicorn --threads {args.request_threads}")
+
+    results = sweep(configs, texts, args.request_size, args.duration, args.concurrency_per_worker,
+                    args.request_threads)
+    best = recommend(results, args.p95_target_ms)
+
+    print(f"\n{'workers':>8}{'threads':>8}{'batch':>7}{'texts/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+    for r in sorted(results, key=lambda r: -r['texts_per_sec']):
+        print(f"{r['workers']:>8}{r['threads']:>8}{r['batch_size']:>7}{r['texts_per_sec']:>10}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['errors']:>8}")
+
+    if best is None:
+        print("\nNo configuration completed without errors")
+        raise SystemExit(1)
+    if args.p95_target_ms is not None and best['p95_ms'] > args.p95_target_ms:
+        print(f"\nNo configuration met p95 <= {args.p95_target_ms:g} ms; showing the fastest")
+    print(f"\nRecommended configuration (gunicorn --threads {args.request_threads}):")
+    for name, value in config_env(best).items():
+        print(f"{name}={value}")
+    if args.request_threads != GUNICORN_THREADS:
+        print(f"Also change --threads {GUNICORN_THREADS} to --threads {args.request_threads} in the Dockerfile's CMD")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'cpus': cpus, 'request_size': args.request_size, 'request_threads': args.request_threads,
+                       'results': results, 'recommended': {**best, 'env': config_env(best)}}, f, indent=2)
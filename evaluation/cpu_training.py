@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+"""
+CPU-efficient training loop for sentence-transformers fine-tuning
+Adds gradient accumulation, bf16 autocast, thread tuning, checkpoint/resume
+and per-step throughput logging on top of the model.fit() defaults, and
+data-parallel training across local processes (DistributedDataParallel on
+the gloo backend)
+"""
+
+import os
+import sys
+import glob
+import time
+import socket
+import random
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass, asdict, replace
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from sentence_transformers import SentenceTransformer, InputExample, losses
+from sentence_transformers.util import batch_to_device
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, DistributedSampler, IterableDataset
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Rank 0 evaluates and checkpoints while the other ranks wait in the next
+# gradient all-reduce, so the collective timeout must outlast an evaluation
+DISTRIBUTED_TIMEOUT_MINUTES = 120
+
+
+@dataclass
+class TrainingConfig:
+    """Knobs for CPU training; defaults match a plain model.fit() run"""
+    gradient_accumulation_steps: int = 1
+    bf16: str = 'auto'                      # 'auto', 'on' or 'off'
+    num_threads: Optional[int] = None       # torch intra-op threads
+    num_interop_threads: Optional[int] = None
+    dataloader_workers: int = 0
+    checkpoint_dir: Optional[str] = None
+    checkpoint_steps: int = 500             # optimizer steps between checkpoints
+    checkpoint_limit: int = 2
+    resume: bool = False
+    log_steps: int = 50
+    learning_rate: float = 2e-5
+    weight_decay: float = 0.01
+    warmup_steps: int = 100
+    max_grad_norm: float = 1.0
+
+
+def cpu_supports_bf16() -> bool:
+    """True when the CPU has native bf16 instructions (AVX512-BF16 or AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        pass
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            flags = f.read()
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+    except OSError:
+        return False
+
+
+def resolve_bf16(setting: str) -> bool:
+    """Turn the 'auto'/'on'/'off' setting into a yes/no for this machine"""
+    if setting == 'on':
+        if not cpu_supports_bf16():
+            logger.warning("bf16 forced on, but this CPU has no native bf16 support; expect emulation slowdowns")
+        return True
+    if setting == 'off':
+        return False
+    return cpu_supports_bf16()
+
+
+def apply_thread_settings(config: TrainingConfig):
+    """Apply torch thread settings; must run before any parallel torch work"""
+    if config.num_threads:
+        torch.set_num_threads(config.num_threads)
+    if config.num_interop_threads:
+        try:
+            torch.set_num_interop_threads(config.num_interop_threads)
+        except RuntimeError as e:
+            # Only settable once per process, before inter-op work starts
+            logger.warning(f"Could not set inter-op threads: {e}")
+    logger.info(f"torch threads: intra-op={torch.get_num_threads()}, "
+                f"inter-op={torch.get_num_interop_threads()}")
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def rank_and_world() -> Tuple[int, int]:
+    """(rank, world size) of this process; (0, 1) outside distributed training"""
+    return (dist.get_rank(), dist.get_world_size()) if is_distributed() else (0, 1)
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_model(model_name: str) -> SentenceTransformer:
+    """Load a model; in distributed training rank 0 loads (and downloads) it first"""
+    rank, world_size = rank_and_world()
+    if rank > 0:
+        dist.barrier()
+    model = SentenceTransformer(model_name)
+    if world_size > 1 and rank == 0:
+        dist.barrier()
+    return model
+
+
+def make_dataloader(dataset, batch_size: int, config: TrainingConfig, shuffle: bool = False) -> DataLoader:
+    """
+    DataLoader with the configured worker count (shuffle only for map-style
+    datasets). In distributed training a map-style dataset is split across
+    ranks with a DistributedSampler; iterable datasets shard themselves.
+
+    Workers of an iterable dataset are started afresh each epoch: they
+    shuffle from their own copy of the dataset, which only picks up
+    set_epoch() when it is copied at worker start.
+    """
+    workers = config.dataloader_workers
+    iterable = isinstance(dataset, IterableDataset)
+    sampler = None
+    if is_distributed() and not iterable:
+        sampler = DistributedSampler(dataset, shuffle=shuffle)
+        shuffle = False
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=workers,
+        persistent_workers=workers > 0 and not iterable,
+        prefetch_factor=2 if workers > 0 else None
+    )
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _distributed_worker(rank: int, world_size: int, port: int, fn: Callable, config: TrainingConfig,
+                        kwargs: Dict, pin_cores: bool):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    cores = available_cores()
+    threads = config.num_threads
+    if pin_cores and hasattr(os, 'sched_setaffinity') and len(cores) >= world_size * threads:
+        # Disjoint cores per rank, so ranks' thread pools do not compete
+        os.sched_setaffinity(0, cores[rank * threads:(rank + 1) * threads])
+    if rank > 0:
+        logging.getLogger().setLevel(logging.WARNING)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size,
+                            timeout=timedelta(minutes=DISTRIBUTED_TIMEOUT_MINUTES))
+    try:
+        apply_thread_settings(config)
+        fn(config=config, **kwargs)
+        # Keep the group alive until rank 0 has finished its final evaluation and save
+        dist.barrier()
+    finally:
+        dist.destroy_process_group()
+
+
+def run_distributed(fn: Callable, nproc: int, config: TrainingConfig, pin_cores: bool = True, **kwargs):
+    """
+    Run fn(config=..., **kwargs) in nproc local processes joined in a gloo
+    process group. config.num_threads is the total thread budget (default:
+    all available cores) and is split evenly between the processes; each
+    gets one inter-op thread unless num_interop_threads says otherwise.
+    fn must be a module-level function, and kwargs picklable.
+    """
+    total_threads = config.num_threads or len(available_cores())
+    threads = max(1, total_threads // nproc)
+    rank_config = replace(
+        config,
+        num_threads=threads,
+        num_interop_threads=max(1, config.num_interop_threads // nproc) if config.num_interop_threads else 1
+    )
+    # Children read these when they first import torch, before apply_thread_settings runs
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+    if sys.platform.startswith('linux'):
+        os.environ.setdefault('GLOO_SOCKET_IFNAME', 'lo')
+    logger.info(f"Launching {nproc} training processes x {threads} threads (gloo)")
+    mp.spawn(_distributed_worker, args=(nproc, _free_port(), fn, rank_config, kwargs, pin_cores),
+             nprocs=nproc, join=True)
+
+
+def _checkpoint_paths(checkpoint_dir: str) -> List[str]:
+    paths = glob.glob(os.path.join(checkpoint_dir, 'checkpoint-*.pt'))
+    return sorted(paths, key=lambda p: int(p.rsplit('-', 1)[1].split('.')[0]))
+
+
+def rng_state() -> Dict:
+    """Python, numpy and torch RNG states, for checkpoints"""
+    return {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+
+
+def set_rng_state(states: Dict):
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+
+
+def save_checkpoint(model, optimizer, scheduler, state: Dict, config: TrainingConfig):
+    """Write model + optimizer state, keeping the newest checkpoint_limit files"""
+    os.makedirs(config.checkpoint_dir, exist_ok=True)
+    path = os.path.join(config.checkpoint_dir, f"checkpoint-{state['global_step']}.pt")
+    tmp_path = path + '.tmp'
+    torch.save({
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'scheduler': scheduler.state_dict(),
+        'state': state,
+    }, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved checkpoint {path}")
+
+    for old in _checkpoint_paths(config.checkpoint_dir)[:-config.checkpoint_limit]:
+        os.remove(old)
+
+
+def load_latest_checkpoint(model, optimizer, scheduler, config: TrainingConfig) -> Optional[Dict]:
+    """Restore the newest checkpoint in checkpoint_dir, if any"""
+    if not config.checkpoint_dir or not os.path.isdir(config.checkpoint_dir):
+        return None
+    paths = _checkpoint_paths(config.checkpoint_dir)
+    if not paths:
+        return None
+    # Our own files; the training state holds RNG states, which weights_only rejects
+    checkpoint = torch.load(paths[-1], map_location='cpu', weights_only=False)
+    model.load_state_dict(checkpoint['model'])
+    optimizer.load_state_dict(checkpoint['optimizer'])
+    scheduler.load_state_dict(checkpoint['scheduler'])
+    logger.info(f"Resumed from {paths[-1]} (step {checkpoint['state']['global_step']})")
+    return checkpoint['state']
+
+
+class ThroughputLogger:
+    """Logs examples/sec and seconds per optimizer step every log_steps steps"""
+
+    def __init__(self, log_steps: int):
+        self.log_steps = max(1, log_steps)
+        self.history = []
+        self._reset()
+
+    def _reset(self):
+        self.start = time.perf_counter()
+        self.examples = 0
+        self.steps = 0
+
+    def update(self, global_step: int, examples: int):
+        self.examples += examples
+        self.steps += 1
+        if self.steps < self.log_steps:
+            return
+        elapsed = time.perf_counter() - self.start
+        entry = {
+            'step': global_step,
+            'examples_per_sec': self.examples / elapsed,
+            'sec_per_step': elapsed / self.steps,
+        }
+        self.history.append(entry)
+        logger.info(f"step {global_step}: {entry['examples_per_sec']:.1f} examples/sec, "
+                    f"{entry['sec_per_step']:.3f} s/step")
+        self._reset()
+
+
+def fit_cpu(
+    model: SentenceTransformer,
+    train_dataloader: DataLoader,
+    train_loss: torch.nn.Module,
+    config: TrainingConfig,
+    epochs: int = 1,
+    evaluator=None,
+    evaluation_steps: int = 500,
+    output_path: Optional[str] = None,
+    max_steps: Optional[int] = None,
+    epoch_evaluator=None
+) -> Dict:
+    """
+    Train like model.fit(), with the options in TrainingConfig.
+
+    Steps are counted in optimizer steps, i.e. after gradient accumulation, so
+    evaluation_steps and checkpoint_steps keep their meaning when the
+    effective batch size changes. `evaluator` runs every evaluation_steps;
+    `epoch_evaluator` (default: the same evaluator) runs at the end of each
+    epoch and decides which model is saved as best. Returns a summary with
+    throughput history and the share of wall time spent evaluating.
+
+    Inside a process group (see run_distributed) the loss is wrapped in
+    DistributedDataParallel, which averages gradients across ranks during
+    backward; only rank 0 evaluates, checkpoints and saves. Throughput is
+    logged for all ranks together.
+    """
+    epoch_evaluator = epoch_evaluator or evaluator
+    use_bf16 = resolve_bf16(config.bf16)
+    accum = max(1, config.gradient_accumulation_steps)
+    rank, world_size = rank_and_world()
+    main_process = rank == 0
+    logger.info(f"Training config: {asdict(config)} (bf16 active: {use_bf16}, processes: {world_size})")
+
+    device = model.device
+    train_dataloader.collate_fn = model.smart_batching_collate
+    train_loss.to(device)
+
+    batches_per_epoch = len(train_dataloader)
+    if world_size > 1:
+        # Every rank must take the same number of steps, or the all-reduce of
+        # the rank with more batches waits forever
+        count = torch.tensor([batches_per_epoch])
+        dist.all_reduce(count, op=dist.ReduceOp.MIN)
+        batches_per_epoch = int(count.item())
+    steps_per_epoch = max(1, batches_per_epoch // accum)
+    total_steps = steps_per_epoch * epochs
+    if max_steps:
+        total_steps = min(total_steps, max_steps)
+
+    no_decay = ['bias', 'LayerNorm.bias', 'LayerNorm.weight']
+    params = list(train_loss.named_parameters())
+    optimizer = torch.optim.AdamW([
+        {'params': [p for n, p in params if not any(nd in n for nd in no_decay)],
+         'weight_decay': config.weight_decay},
+        {'params': [p for n, p in params if any(nd in n for nd in no_decay)],
+         'weight_decay': 0.0},
+    ], lr=config.learning_rate)
+    scheduler = SentenceTransformer._get_scheduler(
+        optimizer, scheduler='WarmupLinear', warmup_steps=config.warmup_steps, t_total=total_steps
+    )
+
+    # epoch_rng is the RNG state the epoch's shuffle was drawn from; a resumed
+    # epoch restores it so skipping the trained batches skips the same ones
+    state = {'global_step': 0, 'epoch': 0, 'batches_in_epoch': 0, 'best_score': None, 'epoch_rng': None}
+    if config.resume:
+        state = {**state, **(load_latest_checkpoint(model, optimizer, scheduler, config) or {})}
+    # RNG states at the checkpoint, restored once the trained batches are skipped
+    resume_rng = state.pop('rng', None) if main_process else None
+
+    forward_loss = train_loss
+    if world_size > 1:
+        # Pooler weights get no gradient from the loss, hence find_unused_parameters
+        forward_loss = DistributedDataParallel(train_loss, find_unused_parameters=True)
+
+    throughput = ThroughputLogger(config.log_steps)
+    eval_seconds = 0.0
+    train_start = time.perf_counter()
+
+    def evaluate(epoch: int, current_evaluator, track_best: bool):
+        nonlocal eval_seconds
+        start = time.perf_counter()
+        score = current_evaluator(model, output_path=output_path, epoch=epoch, steps=state['global_step'])
+        eval_seconds += time.perf_counter() - start
+        if track_best and output_path and (state['best_score'] is None or score > state['best_score']):
+            state['best_score'] = score
+            model.save(output_path)
+
+    for epoch in range(state['epoch'], epochs):
+        train_loss.zero_grad()
+        train_loss.train()
+        if isinstance(train_dataloader.sampler, DistributedSampler):
+            train_dataloader.sampler.set_epoch(epoch)
+        if hasattr(train_dataloader.dataset, 'set_epoch'):
+            train_dataloader.dataset.set_epoch(epoch)
+        skip = state['batches_in_epoch']
+        if skip:
+            logger.info(f"Skipping {skip} already-trained batches of epoch {epoch}")
+            if main_process and state['epoch_rng'] is not None:
+                set_rng_state(state['epoch_rng'])
+        state['epoch_rng'] = rng_state()
+
+        examples = 0
+        for batch_idx, (features, labels) in enumerate(train_dataloader):
+            if batch_idx >= batches_per_epoch:
+                break
+            if batch_idx < skip:
+                continue
+            if resume_rng is not None:
+                set_rng_state(resume_rng)
+                resume_rng = None
+            labels = labels.to(device)
+            features = [batch_to_device(f, device) for f in features]
+            examples += labels.shape[0]
+
+            step_now = (batch_idx + 1) % accum == 0
+            # Accumulating micro-batches skip the gradient all-reduce
+            with forward_loss.no_sync() if world_size > 1 and not step_now else nullcontext():
+                with torch.autocast(device_type='cpu', dtype=torch.bfloat16, enabled=use_bf16):
+                    loss = forward_loss(features, labels) / accum
+                loss.backward()
+
+            if not step_now:
+                continue
+
+            torch.nn.utils.clip_grad_norm_(train_loss.parameters(), config.max_grad_norm)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+
+            state['global_step'] += 1
+            state['batches_in_epoch'] = batch_idx + 1
+            throughput.update(state['global_step'], examples * world_size)
+            examples = 0
+
+            if (evaluator is not None and main_process and evaluation_steps > 0
+                    and state['global_step'] % evaluation_steps == 0):
+                # Mid-epoch scores only track progress; subsampled scores are
+                # not comparable with the full epoch-end evaluation
+                evaluate(epoch, evaluator, track_best=epoch_evaluator is evaluator)
+                train_loss.train()
+            if config.checkpoint_dir and main_process and state['global_step'] % config.checkpoint_steps == 0:
+                save_checkpoint(model, optimizer, scheduler, {**state, 'rng': rng_state()}, config)
+            if max_steps and state['global_step'] >= max_steps:
+                break
+
+        if resume_rng is not None:
+            # The checkpoint was at the end of the epoch: nothing was left to skip to
+            set_rng_state(resume_rng)
+            resume_rng = None
+        state['epoch'] = epoch + 1
+        state['batches_in_epoch'] = 0
+        if epoch_evaluator is not None and main_process:
+            evaluate(epoch, epoch_evaluator, track_best=True)
+        if max_steps and state['global_step'] >= max_steps:
+            break
+
+    if output_path and epoch_evaluator is None and main_process:
+        model.save(output_path)
+
+    elapsed = time.perf_counter() - train_start
+    if eval_seconds:
+        logger.info(f"Evaluation took {eval_seconds:.1f}s of {elapsed:.1f}s wall time "
+                    f"({100 * eval_seconds / elapsed:.1f}%)")
+    return {
+        'global_step': state['global_step'],
+        'train_seconds': elapsed,
+        'eval_seconds': eval_seconds,
+        'eval_fraction': eval_seconds / elapsed if elapsed else 0.0,
+        'bf16': use_bf16,
+        'world_size': world_size,
+        'throughput': throughput.history,
+    }
+
+
+SYNTHETIC_WORDS = (
+    'wireless bluetooth headphones noise cancelling earbuds charger cable usb fast '
+    'laptop stand aluminum portable speaker waterproof smart watch fitness tracker '
+    'kitchen blender stainless steel coffee grinder gaming mouse keyboard mechanical'
+).split()
+
+
+def synthetic_examples(count: int, seed: int = 0) -> List[InputExample]:
+    """Random query/product pairs with realistic lengths, for benchmarking only"""
+    rng = random.Random(seed)
+    examples = []
+    for _ in range(count):
+        query = ' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(2, 5)))
+        product = ' '.join(rng.choices(SYNTHETIC_WORDS, k=rng.randint(20, 60)))
+        examples.append(InputExample(texts=[query, product]))
+    return examples
+
+
+def benchmark_settings(
+    model_name: str,
+    settings: Dict[str, TrainingConfig],
+    batch_size: int = 16,
+    steps: int = 20
+) -> Dict[str, Dict]:
+    """
+    Train a fresh copy of the model for a few steps under each setting and
+    report average throughput. Thread settings apply process-wide, so for
+    clean inter-op numbers run one setting per process.
+    """
+    results = {}
+    for name, config in settings.items():
+        apply_thread_settings(config)
+        model = SentenceTransformer(model_name)
+        examples = synthetic_examples(batch_size * config.gradient_accumulation_steps * (steps + 2))
+        dataloader = make_dataloader(examples, batch_size, config, shuffle=True)
+        train_loss = losses.MultipleNegativesRankingLoss(model)
+
+        config.log_steps = steps
+        summary = fit_cpu(model, dataloader, train_loss, config, epochs=1, max_steps=steps)
+        examples_done = steps * batch_size * config.gradient_accumulation_steps
+        results[name] = {
+            'examples_per_sec': examples_done / summary['train_seconds'],
+            'sec_per_step': summary['train_seconds'] / max(1, summary['global_step']),
+            'bf16': summary['bf16'],
+        }
+        logger.info(f"{name}: {results[name]}")
+    return results
+
+
+def _scaling_rank(config: TrainingConfig, model_name: str, batch_size: int, steps: int, warmup: int, results):
+    """One rank of a benchmark_scaling run; rank 0 reports steady-state throughput"""
+    rank, world_size = rank_and_world()
+    model = load_model(model_name)
+    accum = config.gradient_accumulation_steps
+    examples = synthetic_examples(batch_size * accum * (steps + warmup) * world_size)
+    dataloader = make_dataloader(examples, batch_size, config, shuffle=True)
+    train_loss = losses.MultipleNegativesRankingLoss(model)
+
+    config.log_steps = 1
+    summary = fit_cpu(model, dataloader, train_loss, config, epochs=1, max_steps=steps + warmup)
+    if rank == 0:
+        timed = summary['throughput'][warmup:]
+        seconds = sum(entry['sec_per_step'] for entry in timed)
+        results.put({
+            'examples_per_sec': len(timed) * batch_size * accum * world_size / seconds,
+            'sec_per_step': seconds / len(timed),
+            'threads_per_process': torch.get_num_threads(),
+            'bf16': summary['bf16'],
+        })
+
+
+def benchmark_scaling(
+    model_name: str,
+    process_counts: Sequence[int],
+    batch_size: int = 16,
+    steps: int = 20,
+    warmup: int = 3,
+    threads_per_process: Optional[int] = None,
+    config: Optional[TrainingConfig] = None
+) -> List[Dict]:
+    """
+    Data-parallel throughput for each process count, on synthetic data.
+
+    Each process trains on batch_size examples per step, so the global batch
+    grows with the process count (weak scaling). With threads_per_process,
+    every process gets that many threads, measuring how close DDP comes to
+    linear scaling as cores are added. Without it, the machine's cores are
+    split between the processes, measuring how best to use a fixed box.
+    Speedup and efficiency are relative to the first process count.
+    """
+    config = config or TrainingConfig(bf16='off')
+    ctx = mp.get_context('spawn')
+    rows = []
+    for nproc in process_counts:
+        results = ctx.SimpleQueue()
+        run_config = replace(config, num_threads=threads_per_process * nproc if threads_per_process else config.num_threads)
+        run_distributed(_scaling_rank, nproc, run_config, model_name=model_name, batch_size=batch_size,
+                        steps=steps, warmup=warmup, results=results)
+        row = {'processes': nproc, **results.get()}
+        base = rows[0] if rows else row
+        row['speedup'] = row['examples_per_sec'] / base['examples_per_sec']
+        row['efficiency'] = row['speedup'] / (nproc / base['processes'])
+        rows.append(row)
+        logger.info(f"{nproc} processes: {row['examples_per_sec']:.1f} examples/sec, "
+                    f"speedup {row['speedup']:.2f}x, efficiency {row['efficiency']:.0%}")
+    return rows
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Benchmark CPU training settings on synthetic data')
+    parser.add_argument('--model', default='sentence-transformers/all-MiniLM-L6-v2')
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--scaling', metavar='N,N,...',
+                        help='Benchmark data-parallel training at these process counts (e.g. 1,2,4,8) instead')
+    parser.add_argument('--threads-per-process', type=int,
+                        help='--scaling: fixed threads per process (default: split --threads between processes)')
+    parser.add_argument('--bf16', choices=['auto', 'on', 'off'], default='off', help='--scaling: bf16 setting')
+
+    args = parser.parse_args()
+
+    if args.scaling:
+        rows = benchmark_scaling(args.model, [int(n) for n in args.scaling.split(',')], args.batch_size,
+                                 args.steps, threads_per_process=args.threads_per_process,
+                                 config=TrainingConfig(bf16=args.bf16, num_threads=args.threads))
+        print(f"{'processes':>9}{'threads':>9}{'examples/s':>12}{'s/step':>9}{'speedup':>9}{'efficiency':>11}")
+        for row in rows:
+            print(f"{row['processes']:>9}{row['threads_per_process']:>9}{row['examples_per_sec']:>12.1f}"
+                  f"{row['sec_per_step']:>9.3f}{row['speedup']:>8.2f}x{row['efficiency']:>11.0%}")
+        print(json.dumps(rows, indent=2))
+    else:
+        settings = {
+            'baseline_fp32': TrainingConfig(bf16='off', num_threads=args.threads),
+            'bf16': TrainingConfig(bf16='on', num_threads=args.threads),
+            'fp32_accum4': TrainingConfig(bf16='off', num_threads=args.threads, gradient_accumulation_steps=4),
+            'bf16_accum4': TrainingConfig(bf16='on', num_threads=args.threads, gradient_accumulation_steps=4),
+        }
+        results = benchmark_settings(args.model, settings, args.batch_size, args.steps)
+        print(json.dumps(results, indent=2))
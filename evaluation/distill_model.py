@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Distill the serving embedding model into a smaller, faster student
+1. Cache teacher embeddings of the product corpus and query log on disk
+2. Train a student (fewer layers, or a narrower model projected back to
+   384 dimensions so the DB schema is unchanged) with an MSE loss
+3. Report retrieval quality vs. latency for teacher and student
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer, InputExample, losses, models
+from torch.utils.data import Dataset
+
+from cpu_training import TrainingConfig, apply_thread_settings, fit_cpu, make_dataloader
+from evaluate_search import ndcg, mrr, precision_at_k, recall_at_k
+from fine_tune_model import prepare_evaluation_data
+from topk import blocked_top_k
+from training_data import CORPUS_BLOCK_SIZE, iter_jsonl, text_key
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 384  # products.embedding is vector(384)
+
+
+def load_distillation_texts(corpus_path: str, query_log_path: Optional[str] = None) -> List[str]:
+    """
+    Collect unique texts to distill on: product texts from a JSONL corpus
+    (`product_text` or `text`) plus queries from a query log (plain text, one
+    query per line, or JSONL with a `query` field).
+    """
+    seen = set()
+    texts = []
+
+    def add(text):
+        if text and text_key(text) not in seen:
+            seen.add(text_key(text))
+            texts.append(text)
+
+    for item in iter_jsonl(corpus_path):
+        add(item.get('product_text') or item.get('text'))
+
+    if query_log_path:
+        with open(query_log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if query_log_path.endswith('.jsonl') and line:
+                    try:
+                        line = json.loads(line).get('query', '')
+                    except json.JSONDecodeError:
+                        continue
+                add(line)
+
+    logger.info(f"Collected {len(texts)} unique texts for distillation")
+    return texts
+
+
+def cache_teacher_embeddings(
+    teacher_name: str,
+    texts: List[str],
+    cache_dir: str,
+    batch_size: int = 128
+) -> np.ndarray:
+    """
+    Embed texts with the teacher once and keep them in cache_dir.
+
+    The cache holds texts.jsonl, embeddings.npy and a meta.json fingerprint
+    of (teacher, texts); it is reused as long as the fingerprint matches.
+    Returns the embeddings as a read-only memory map.
+    """
+    digest = hashlib.sha1(teacher_name.encode('utf-8'))
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+    fingerprint = digest.hexdigest()
+
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    emb_path = os.path.join(cache_dir, 'embeddings.npy')
+    if os.path.exists(meta_path) and os.path.exists(emb_path):
+        with open(meta_path, 'r') as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                logger.info(f"Using cached teacher embeddings in {cache_dir}")
+                return np.load(emb_path, mmap_mode='r')
+
+    os.makedirs(cache_dir, exist_ok=True)
+    teacher = SentenceTransformer(teacher_name)
+    logger.info(f"Embedding {len(texts)} texts with teacher {teacher_name}...")
+    embeddings = teacher.encode(
+        texts, batch_size=batch_size, convert_to_numpy=True,
+        normalize_embeddings=True, show_progress_bar=True
+    ).astype(np.float32)
+
+    np.save(emb_path, embeddings)
+    with open(os.path.join(cache_dir, 'texts.jsonl'), 'w', encoding='utf-8') as f:
+        for text in texts:
+            f.write(json.dumps({'text': text}) + '\n')
+    with open(meta_path, 'w') as f:
+        json.dump({'teacher': teacher_name, 'fingerprint': fingerprint,
+                   'count': len(texts), 'dimension': embeddings.shape[1]}, f, indent=2)
+    return np.load(emb_path, mmap_mode='r')
+
+
+class TeacherEmbeddingDataset(Dataset):
+    """(text, teacher vector) examples read lazily from the embedding cache"""
+
+    def __init__(self, texts: List[str], embeddings: np.ndarray):
+        self.texts = texts
+        self.embeddings = embeddings
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def __getitem__(self, idx: int) -> InputExample:
+        return InputExample(texts=[self.texts[idx]], label=np.array(self.embeddings[idx], dtype=np.float32))
+
+
+def build_student(
+    teacher_name: str,
+    num_layers: Optional[int] = None,
+    student_base: Optional[str] = None,
+    max_seq_length: int = 128
+) -> SentenceTransformer:
+    """
+    Build the student model.
+
+    With num_layers, the teacher is copied and only num_layers evenly spaced
+    transformer layers are kept. With student_base, any (narrower) HF model is
+    used, mean-pooled and, if its hidden size is not 384, followed by a dense
+    projection back to 384 dimensions.
+    """
+    if student_base:
+        word_embedding = models.Transformer(student_base, max_seq_length=max_seq_length)
+        pooling = models.Pooling(word_embedding.get_word_embedding_dimension(), pooling_mode='mean')
+        modules = [word_embedding, pooling]
+        if pooling.get_sentence_embedding_dimension() != EMBEDDING_DIM:
+            modules.append(models.Dense(
+                in_features=pooling.get_sentence_embedding_dimension(),
+                out_features=EMBEDDING_DIM,
+                activation_function=torch.nn.Identity()
+            ))
+        modules.append(models.Normalize())
+        return SentenceTransformer(modules=modules)
+
+    student = SentenceTransformer(teacher_name)
+    auto_model = student._first_module().auto_model
+    layers = auto_model.encoder.layer
+    if num_layers and num_layers < len(layers):
+        keep = np.linspace(0, len(layers) - 1, num_layers).round().astype(int).tolist()
+        auto_model.encoder.layer = torch.nn.ModuleList([layers[i] for i in keep])
+        auto_model.config.num_hidden_layers = num_layers
+        logger.info(f"Student keeps teacher layers {keep} of {len(layers)}")
+    return student
+
+
+def train_student(
+    student: SentenceTransformer,
+    texts: List[str],
+    teacher_embeddings: np.ndarray,
+    output_path: str,
+    epochs: int = 1,
+    batch_size: int = 64,
+    config: Optional[TrainingConfig] = None
+) -> Dict:
+    """Train the student to reproduce the teacher vectors (MSE loss)"""
+    config = config or TrainingConfig(learning_rate=1e-4, warmup_steps=500)
+    apply_thread_settings(config)
+
+    dataset = TeacherEmbeddingDataset(texts, teacher_embeddings)
+    dataloader = make_dataloader(dataset, batch_size, config, shuffle=True)
+    train_loss = losses.MSELoss(model=student)
+
+    summary = fit_cpu(student, dataloader, train_loss, config, epochs=epochs, output_path=output_path)
+    logger.info(f"Student saved to {output_path}")
+    return summary
+
+
+def retrieval_metrics(model: SentenceTransformer, eval_data_path: str, k_values: List[int]) -> Dict[str, float]:
+    """Local retrieval over the eval corpus, scored with evaluate_search metrics"""
+    queries, corpus, relevant_docs = prepare_evaluation_data(eval_data_path)
+    corpus_ids = list(corpus)
+    corpus_emb = model.encode([corpus[cid] for cid in corpus_ids], convert_to_numpy=True,
+                              normalize_embeddings=True).astype(np.float32)
+    query_ids = list(queries)
+    query_emb = model.encode([queries[qid] for qid in query_ids], convert_to_numpy=True,
+                             normalize_embeddings=True).astype(np.float32)
+    indices, _ = blocked_top_k(query_emb, corpus_emb, max(k_values), CORPUS_BLOCK_SIZE)
+
+    scores = {}
+    for qid, row in zip(query_ids, indices):
+        relevant = relevant_docs[qid]
+        relevance_list = [1 if corpus_ids[i] in relevant else 0 for i in row]
+        for k in k_values:
+            scores.setdefault(f'precision@{k}', []).append(precision_at_k(relevance_list[:k], k))
+            scores.setdefault(f'recall@{k}', []).append(recall_at_k(relevance_list[:k], len(relevant), k))
+            scores.setdefault(f'ndcg@{k}', []).append(ndcg(relevance_list[:k], k))
+        scores.setdefault('mrr', []).append(mrr(relevance_list))
+    return {name: float(np.mean(values)) for name, values in scores.items()}
+
+
+def latency_benchmark(model: SentenceTransformer, texts: List[str], repeats: int = 200, batch_size: int = 64) -> Dict:
+    """Single-text latency percentiles (like /embed) and batch throughput (like /embed/batch)"""
+    sample = (texts * (repeats // max(1, len(texts)) + 1))[:repeats]
+    model.encode(sample[:8])  # warm up
+
+    latencies = []
+    for text in sample:
+        start = time.perf_counter()
+        model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    model.encode(sample, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'batch_texts_per_sec': len(sample) / batch_seconds,
+        'parameters': sum(p.numel() for p in model.parameters()),
+    }
+
+
+def tradeoff_report(
+    teacher_name: str,
+    student_path: str,
+    eval_data_path: str,
+    latency_texts: List[str],
+    k_values: List[int] = [5, 10, 20]
+) -> Dict:
+    """Quality and latency of teacher vs. student, plus relative deltas"""
+    report = {}
+    for label, name in (('teacher', teacher_name), ('student', student_path)):
+        model = SentenceTransformer(name)
+        report[label] = {
+            'model': name,
+            'metrics': retrieval_metrics(model, eval_data_path, k_values) if os.path.exists(eval_data_path) else {},
+            'latency': latency_benchmark(model, latency_texts),
+        }
+
+    teacher, student = report['teacher'], report['student']
+    report['tradeoff'] = {
+        'speedup_p50': teacher['latency']['p50_ms'] / student['latency']['p50_ms'],
+        'throughput_ratio': student['latency']['batch_texts_per_sec'] / teacher['latency']['batch_texts_per_sec'],
+        'metric_deltas': {
+            name: student['metrics'][name] - value
+            for name, value in teacher['metrics'].items() if name in student['metrics']
+        },
+    }
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Distill the embedding model into a smaller student')
+    parser.add_argument('--step', choices=['cache', 'train', 'report', 'all'], default='all')
+    parser.add_argument('--teacher', default='sentence-transformers/all-MiniLM-L6-v2',
+                        help='Base or fine-tuned model to distill')
+    parser.add_argument('--corpus', default='data/catalog.jsonl', help='JSONL product texts')
+    parser.add_argument('--query-log', help='Query log (one query per line, or JSONL with "query")')
+    parser.add_argument('--cache-dir', default='models/teacher-cache')
+    parser.add_argument('--student-layers', type=int, default=3, help='Teacher layers kept in the student')
+    parser.add_argument('--student-base', help='Narrower HF model to use instead of layer pruning')
+    parser.add_argument('--output', default='models/student-model')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--eval-data', default='data/eval_data.json')
+    parser.add_argument('--k-values', nargs='+', type=int, default=[5, 10, 20])
+
+    args = parser.parse_args()
+
+    texts = load_distillation_texts(args.corpus, args.query_log)
+
+    if args.step in ('cache', 'train', 'all'):
+        teacher_embeddings = cache_teacher_embeddings(args.teacher, texts, args.cache_dir)
+
+    if args.step in ('train', 'all'):
+        student = build_student(args.teacher, num_layers=args.student_layers, student_base=args.student_base)
+        train_student(
+            student, texts, teacher_embeddings, args.output,
+            epochs=args.epochs, batch_size=args.batch_size,
+            config=TrainingConfig(learning_rate=1e-4, warmup_steps=500, num_threads=args.threads)
+        )
+
+    if args.step in ('report', 'all'):
+        if args.threads:
+            torch.set_num_threads(args.threads)
+        report = tradeoff_report(args.teacher, args.output, args.eval_data, texts[:200], args.k_values)
+        print("\n=== Distillation Report ===")
+        print(json.dumps(report, indent=2))
@@ -4,10 +4,13 @@ Evaluation script for semantic search relevancy
 Calculates metrics: NDCG, MRR, Precision@K, Recall@K
 """
 
+import os
 import json
+import time
+import sqlite3
 import requests
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from collections import defaultdict
 import logging
 
@@ -67,10 +70,99 @@ def mrr(relevance_scores: List[float]) -> float:
     return 0.0
 
 
+class ResponseCache:
+    """
+    Search API responses on disk (SQLite), keyed by (API URL, model/version
+    tag, query, limit). Each response is committed as soon as it arrives, so
+    an interrupted run resumes from the last completed query.
+    """
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                api_url TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                query TEXT NOT NULL,
+                result_limit INTEGER NOT NULL,
+                results TEXT NOT NULL,
+                latency_ms REAL NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (api_url, tag, query, result_limit)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, api_url: str, tag: str, query: str, limit: int) -> Optional[Tuple[List[Dict], float]]:
+        """Cached (results, latency_ms); a response fetched with a larger limit is truncated to this one"""
+        row = self.conn.execute("""
+            SELECT results, latency_ms FROM responses
+            WHERE api_url = ? AND tag = ? AND query = ? AND result_limit >= ?
+            ORDER BY result_limit LIMIT 1
+        """, (api_url, tag, query, limit)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])[:limit], row[1]
+
+    def put(self, api_url: str, tag: str, query: str, limit: int, results: List[Dict], latency_ms: float):
+        self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (api_url, tag, query, limit, json.dumps(results), latency_ms, time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def fetch_results(search_api_url: str, query: str, limit: int, cache: Optional[ResponseCache] = None,
+                  tag: str = 'default', refresh: bool = False) -> Tuple[List[Dict], float, bool]:
+    """Search API results for one query as (results, latency_ms, from_cache)"""
+    if cache is not None and not refresh:
+        cached = cache.get(search_api_url, tag, query, limit)
+        if cached is not None:
+            return cached[0], cached[1], True
+
+    start = time.perf_counter()
+    response = requests.post(
+        search_api_url,
+        json={'query': query, 'limit': limit},
+        timeout=30
+    )
+    response.raise_for_status()
+    results = response.json()['results']
+    latency_ms = (time.perf_counter() - start) * 1000
+
+    if cache is not None:
+        cache.put(search_api_url, tag, query, limit, results, latency_ms)
+    return results, latency_ms, False
+
+
+def latency_summary(latencies: List[float]) -> Dict:
+    """Per-query API latency distribution (ms)"""
+    if not latencies:
+        return {'mean': 0.0, 'std': 0.0, 'values': []}
+    values = np.asarray(latencies)
+    return {
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+        'values': latencies
+    }
+
+
 def evaluate_search(
     search_api_url: str,
     test_queries: List[Dict],
-    k_values: List[int] = [5, 10, 20]
+    k_values: List[int] = [5, 10, 20],
+    cache: Optional[ResponseCache] = None,
+    tag: str = 'default',
+    refresh: bool = False
 ) -> Dict:
     """
     Evaluate search API with test queries
@@ -84,28 +176,33 @@ def evaluate_search(
         },
         ...
     ]
+
+    With a cache, responses already fetched for this (URL, tag, query, limit)
+    are scored without calling the API; refresh re-fetches and overwrites them.
+    The result also holds 'latency_ms', the per-query API latency distribution
+    (as measured when each response was fetched).
     """
-    logger.info(f"Evaluating {len(test_queries)} queries against {search_api_url}")
+    logger.info(f"Evaluating {len(test_queries)} queries against {search_api_url} (tag: {tag})")
     
     metrics = defaultdict(list)
+    latencies = []
+    cached_count = 0
     
     for query_data in test_queries:
         query = query_data['query']
         relevant_ids = set(query_data.get('relevant_product_ids', []))
         relevance_scores = query_data.get('relevance_scores', {})
         
-        # Call search API
+        # Call search API (or read the cached response)
         try:
-            response = requests.post(
-                search_api_url,
-                json={'query': query, 'limit': max(k_values)},
-                timeout=30
+            results, latency_ms, from_cache = fetch_results(
+                search_api_url, query, max(k_values), cache, tag, refresh
             )
-            response.raise_for_status()
-            results = response.json()['results']
         except Exception as e:
             logger.error(f"Error querying API for '{query}': {e}")
             continue
+        latencies.append(latency_ms)
+        cached_count += from_cache
         
         # Extract product IDs and similarity scores
         retrieved_ids = [r['productId'] for r in results]
@@ -139,7 +236,10 @@ def evaluate_search(
             'std': np.std(values),
             'values': values
         }
+    avg_metrics['latency_ms'] = latency_summary(latencies)
     
+    if cache is not None:
+        logger.info(f"{cached_count} of {len(latencies)} responses served from {cache.path}")
     return avg_metrics
 
 
@@ -147,18 +247,24 @@ def compare_models(
     base_api_url: str,
     fine_tuned_api_url: str,
     test_queries: List[Dict],
-    k_values: List[int] = [5, 10, 20]
+    k_values: List[int] = [5, 10, 20],
+    cache: Optional[ResponseCache] = None,
+    base_tag: str = 'base',
+    fine_tuned_tag: str = 'fine-tuned',
+    refresh: bool = False
 ) -> Dict:
-    """Compare base model vs fine-tuned model"""
+    """Compare base model vs fine-tuned model (base responses come from the cache when present)"""
     logger.info("Evaluating base model...")
-    base_metrics = evaluate_search(base_api_url, test_queries, k_values)
+    base_metrics = evaluate_search(base_api_url, test_queries, k_values, cache, base_tag, refresh)
     
     logger.info("Evaluating fine-tuned model...")
-    fine_tuned_metrics = evaluate_search(fine_tuned_api_url, test_queries, k_values)
+    fine_tuned_metrics = evaluate_search(fine_tuned_api_url, test_queries, k_values, cache, fine_tuned_tag, refresh)
     
     # Calculate improvements
     improvements = {}
     for metric_name in base_metrics:
+        if metric_name == 'latency_ms':
+            continue
         base_mean = base_metrics[metric_name]['mean']
         ft_mean = fine_tuned_metrics[metric_name]['mean']
         improvement = ft_mean - base_mean
@@ -171,10 +277,18 @@ def compare_models(
             'improvement_pct': improvement_pct
         }
     
+    # Lower latency is better, so it gets a signed delta (positive: fine-tuned is slower)
+    base_latency, ft_latency = base_metrics['latency_ms'], fine_tuned_metrics['latency_ms']
+    latency_delta = {
+        stat: {'base': base_latency[stat], 'fine_tuned': ft_latency[stat], 'delta': ft_latency[stat] - base_latency[stat]}
+        for stat in ('mean', 'p50', 'p95', 'p99')
+    } if base_latency['values'] and ft_latency['values'] else {}
+    
     return {
         'base': base_metrics,
         'fine_tuned': fine_tuned_metrics,
-        'improvements': improvements
+        'improvements': improvements,
+        'latency_delta_ms': latency_delta
     }
 
 
@@ -186,19 +300,38 @@ if __name__ == '__main__':
     parser.add_argument('--test-data', required=True, help='Path to test queries JSON file')
     parser.add_argument('--compare', help='Fine-tuned API URL for comparison')
     parser.add_argument('--k-values', nargs='+', type=int, default=[5, 10, 20])
+    parser.add_argument('--cache', default='.eval_cache/search_responses.sqlite',
+                        help='SQLite file of API responses, reused across runs')
+    parser.add_argument('--no-cache', action='store_true', help='Always query the API; store nothing')
+    parser.add_argument('--refresh', action='store_true', help='Re-query the API and overwrite cached responses')
+    parser.add_argument('--tag', default='base',
+                        help='Model/version behind --api-url; part of the cache key')
+    parser.add_argument('--compare-tag', default='fine-tuned', help='Model/version behind --compare')
     
     args = parser.parse_args()
+    cache = None if args.no_cache else ResponseCache(args.cache)
     
     # Load test data
     with open(args.test_data, 'r') as f:
         test_queries = json.load(f)
     
     if args.compare:
-        results = compare_models(args.api_url, args.compare, test_queries, args.k_values)
+        results = compare_models(args.api_url, args.compare, test_queries, args.k_values, cache,
+                                 args.tag, args.compare_tag, args.refresh)
         print("\n=== Comparison Results ===")
         print(json.dumps(results['improvements'], indent=2))
+        print("\n=== Latency (ms, fine-tuned minus base) ===")
+        print(json.dumps(results['latency_delta_ms'], indent=2))
     else:
-        results = evaluate_search(args.api_url, test_queries, args.k_values)
+        results = evaluate_search(args.api_url, test_queries, args.k_values, cache, args.tag, args.refresh)
         print("\n=== Evaluation Results ===")
         for metric, stats in results.items():
-            print(f"{metric}: {stats['mean']:.4f} ± {stats['std']:.4f}")
+            if metric != 'latency_ms':
+                print(f"{metric}: {stats['mean']:.4f} ± {stats['std']:.4f}")
+        latency = results['latency_ms']
+        if latency['values']:
+            print(f"latency_ms: p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  "
+                  f"max {latency['max']:.1f}")
+    
+    if cache is not None:
+        cache.close()
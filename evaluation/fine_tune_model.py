@@ -6,13 +6,17 @@ Uses sentence-transformers for fine-tuning on e-commerce data
 
 import os
 import json
-import pandas as pd
-from sentence_transformers import SentenceTransformer, InputExample, losses
-from sentence_transformers.evaluation import InformationRetrievalEvaluator
-from torch.utils.data import DataLoader
-from typing import List, Tuple
+from sentence_transformers import SentenceTransformer, losses
+from typing import List, Optional, Tuple
 import logging
 
+from cpu_training import (
+    TrainingConfig, apply_thread_settings, fit_cpu, is_distributed, load_model, make_dataloader, rank_and_world,
+    run_distributed
+)
+from ir_evaluation import CachedCorpusEvaluator, subsample_evaluation_data
+from training_data import StreamingPairDataset, iter_training_pairs
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -21,36 +25,28 @@ def load_training_data(file_path: str) -> List[Tuple[str, str, float]]:
     """
     Load training data in format: (query, product_text, relevance_score)
     Relevance score: 0.0 to 1.0 (1.0 = highly relevant)
+
+    Reads the whole file into memory; training itself streams the file
+    through StreamingPairDataset instead.
     """
     logger.info(f"Loading training data from {file_path}")
-    
-    # Example: Load from JSON with query-product pairs and relevance scores
-    with open(file_path, 'r') as f:
-        data = json.load(f)
-    
-    training_examples = []
-    for item in data:
-        query = item['query']
-        product_text = item['product_text']  # Combined title + description
-        relevance = item.get('relevance', 1.0)  # Default to 1.0 if not specified
-        training_examples.append((query, product_text, relevance))
-    
-    logger.info(f"Loaded {len(training_examples)} training examples")
-    return training_examples
 
+    training_examples = [
+        (pair['query'], pair['product_text'], pair['relevance'])
+        for pair in iter_training_pairs(file_path)
+    ]
 
-def create_training_examples(training_data: List[Tuple[str, str, float]]) -> List[InputExample]:
-    """Convert training data to InputExample format"""
-    examples = []
-    for query, product_text, score in training_data:
-        examples.append(InputExample(texts=[query, product_text], label=float(score)))
-    return examples
+    logger.info(f"Loaded {len(training_examples)} training examples")
+    return training_examples
 
 
 def prepare_evaluation_data(file_path: str) -> Tuple[dict, dict]:
     """
     Prepare evaluation data for InformationRetrievalEvaluator
     Returns: (queries, corpus, relevant_docs)
+
+    Products are deduplicated by text, so a product relevant to several
+    queries is a single corpus entry and is encoded once.
     """
     logger.info(f"Loading evaluation data from {file_path}")
     
@@ -61,8 +57,8 @@ def prepare_evaluation_data(file_path: str) -> Tuple[dict, dict]:
     corpus = {}
     relevant_docs = {}
     
+    doc_keys = {}  # normalized product text -> doc key
     query_id = 0
-    doc_id = 0
     
     for item in data:
         query = item['query']
@@ -72,10 +68,13 @@ def prepare_evaluation_data(file_path: str) -> Tuple[dict, dict]:
         # Get relevant products
         relevant = []
         for product in item.get('relevant_products', []):
-            doc_key = f"d{doc_id}"
-            corpus[doc_key] = product['text']
+            text_key = ' '.join(product['text'].split()).lower()
+            doc_key = doc_keys.get(text_key)
+            if doc_key is None:
+                doc_key = f"d{len(doc_keys)}"
+                doc_keys[text_key] = doc_key
+                corpus[doc_key] = product['text']
             relevant.append(doc_key)
-            doc_id += 1
         
         relevant_docs[query_key] = set(relevant)
         query_id += 1
@@ -90,71 +89,141 @@ def fine_tune_model(
     eval_data_path: str = 'data/eval_data.json',
     output_path: str = 'models/fine-tuned-model',
     epochs: int = 3,
-    batch_size: int = 16
+    batch_size: int = 16,
+    use_hard_negatives: bool = False,
+    shuffle_buffer: int = 10000,
+    config: Optional[TrainingConfig] = None,
+    eval_subsample: int = 200,
+    evaluation_steps: int = 500,
+    nproc: int = 1
 ):
-    """Fine-tune the sentence transformer model"""
+    """
+    Fine-tune the sentence transformer model
+
+    Training pairs are streamed from disk (JSONL recommended) and trained with
+    MultipleNegativesRankingLoss, so every other positive in the batch acts as
+    a negative. With use_hard_negatives, the training file must contain a
+    `negative_text` per pair (see training_data.py) which is added as an
+    extra negative.
+
+    `config` controls the CPU training loop (gradient accumulation, bf16,
+    threads, DataLoader workers, checkpointing); see cpu_training.py.
+
+    Every evaluation_steps, a fixed sample of eval_subsample queries is
+    evaluated to track progress; the full evaluation set runs only at the
+    end of each epoch. Set eval_subsample to 0 to always use the full set.
+
+    With nproc > 1, training runs data-parallel in nproc local processes
+    (see cpu_training.run_distributed): each trains on its own shard of the
+    pairs with batch_size examples per step, gradients are averaged across
+    processes, and the config's thread budget is split between them. Only
+    rank 0 evaluates, checkpoints and saves; the saved model is returned.
+    """
+    config = config or TrainingConfig()
+    if nproc > 1 and not is_distributed():
+        run_distributed(
+            fine_tune_model, nproc, config,
+            base_model_name=base_model_name, train_data_path=train_data_path, eval_data_path=eval_data_path,
+            output_path=output_path, epochs=epochs, batch_size=batch_size, use_hard_negatives=use_hard_negatives,
+            shuffle_buffer=shuffle_buffer, eval_subsample=eval_subsample, evaluation_steps=evaluation_steps,
+            nproc=nproc
+        )
+        logger.info(f"Fine-tuned model saved to {output_path}")
+        return SentenceTransformer(output_path)
+    if not is_distributed():
+        # run_distributed has already applied the per-process settings
+        apply_thread_settings(config)
+    rank, world_size = rank_and_world()
     
     logger.info(f"Loading base model: {base_model_name}")
-    model = SentenceTransformer(base_model_name)
+    model = load_model(base_model_name)
     
-    # Load training data
-    training_data = load_training_data(train_data_path)
-    train_examples = create_training_examples(training_data)
-    train_dataloader = DataLoader(train_examples, shuffle=True, batch_size=batch_size)
+    # Stream training data; larger batches give more in-batch negatives
+    train_dataset = StreamingPairDataset(
+        train_data_path,
+        shuffle_buffer=shuffle_buffer,
+        with_negatives=use_hard_negatives,
+        rank=rank,
+        world_size=world_size
+    )
+    train_dataloader = make_dataloader(train_dataset, batch_size, config)
     
-    # Define loss function (CosineSimilarityLoss for semantic similarity)
-    train_loss = losses.CosineSimilarityLoss(model)
+    # Define loss function (in-batch negatives ranking loss)
+    train_loss = losses.MultipleNegativesRankingLoss(model)
     
-    # Prepare evaluation data if available
+    # Prepare evaluation data if available (rank 0 evaluates for all processes)
     evaluator = None
-    if os.path.exists(eval_data_path):
+    step_evaluator = None
+    if rank == 0 and os.path.exists(eval_data_path):
         queries, corpus, relevant_docs = prepare_evaluation_data(eval_data_path)
-        evaluator = InformationRetrievalEvaluator(
+        evaluator = CachedCorpusEvaluator(
             queries=queries,
             corpus=corpus,
             relevant_docs=relevant_docs,
             name='ecommerce-search',
             show_progress_bar=True
         )
+        step_evaluator = evaluator
+        if eval_subsample and len(queries) > eval_subsample:
+            sub_queries, sub_corpus, sub_relevant = subsample_evaluation_data(
+                queries, corpus, relevant_docs, eval_subsample
+            )
+            step_evaluator = CachedCorpusEvaluator(
+                queries=sub_queries,
+                corpus=sub_corpus,
+                relevant_docs=sub_relevant,
+                name='ecommerce-search-subsample',
+                show_progress_bar=False
+            )
     
     # Fine-tune the model
-    logger.info(f"Starting fine-tuning for {epochs} epochs...")
-    model.fit(
-        train_objectives=[(train_dataloader, train_loss)],
+    logger.info(f"Starting fine-tuning for {epochs} epochs "
+                f"(effective batch size {batch_size * config.gradient_accumulation_steps * world_size})...")
+    fit_cpu(
+        model,
+        train_dataloader,
+        train_loss,
+        config,
         epochs=epochs,
-        evaluator=evaluator,
-        evaluation_steps=500,
+        evaluator=step_evaluator,
+        evaluation_steps=evaluation_steps,
         output_path=output_path,
-        show_progress_bar=True
+        epoch_evaluator=evaluator
     )
     
-    logger.info(f"Fine-tuned model saved to {output_path}")
+    if rank == 0:
+        logger.info(f"Fine-tuned model saved to {output_path}")
     return model
 
 
 def evaluate_model(
     model_path: str,
     test_data_path: str,
-    base_model_path: str = None
+    base_model_path: str = None,
+    cache_dir: Optional[str] = 'models/.eval_cache'
 ):
     """
     Evaluate fine-tuned model and compare with base model
     Returns evaluation metrics
+
+    The base model never changes, so its corpus embeddings are cached in
+    cache_dir and reused on later runs.
     """
     logger.info(f"Evaluating model: {model_path}")
     
     fine_tuned_model = SentenceTransformer(model_path)
     queries, corpus, relevant_docs = prepare_evaluation_data(test_data_path)
     
-    evaluator = InformationRetrievalEvaluator(
+    evaluator = CachedCorpusEvaluator(
         queries=queries,
         corpus=corpus,
         relevant_docs=relevant_docs,
         name='ecommerce-search-test',
-        show_progress_bar=True
+        show_progress_bar=True,
+        cache_dir=cache_dir
     )
     
-    # Evaluate fine-tuned model
+    # Evaluate fine-tuned model (weights may have changed since the last run)
     fine_tuned_metrics = evaluator(fine_tuned_model)
     
     results = {
@@ -165,6 +234,7 @@ def evaluate_model(
     if base_model_path:
         logger.info(f"Evaluating base model: {base_model_path}")
         base_model = SentenceTransformer(base_model_path)
+        evaluator.model_key = base_model_path
         base_metrics = evaluator(base_model)
         results['base'] = base_metrics
         
@@ -190,6 +260,23 @@ if __name__ == '__main__':
     parser.add_argument('--output', default='models/fine-tuned-model')
     parser.add_argument('--epochs', type=int, default=3)
     parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--hard-negatives', action='store_true',
+                        help='Train on (query, positive, negative) triplets from training_data.py')
+    parser.add_argument('--shuffle-buffer', type=int, default=10000)
+    parser.add_argument('--grad-accum', type=int, default=1, help='Micro-batches per optimizer step')
+    parser.add_argument('--bf16', choices=['auto', 'on', 'off'], default='auto')
+    parser.add_argument('--threads', type=int, help='torch intra-op threads (total across processes with --nproc)')
+    parser.add_argument('--interop-threads', type=int, help='torch inter-op threads')
+    parser.add_argument('--nproc', type=int, default=1,
+                        help='Data-parallel training processes (DistributedDataParallel, gloo backend)')
+    parser.add_argument('--dataloader-workers', type=int, default=0)
+    parser.add_argument('--checkpoint-dir', help='Directory for periodic training checkpoints')
+    parser.add_argument('--checkpoint-steps', type=int, default=500)
+    parser.add_argument('--resume', action='store_true', help='Resume from the latest checkpoint')
+    parser.add_argument('--log-steps', type=int, default=50)
+    parser.add_argument('--eval-subsample', type=int, default=200,
+                        help='Queries used for mid-training evaluation (0 = full set)')
+    parser.add_argument('--evaluation-steps', type=int, default=500)
     parser.add_argument('--evaluate-only', action='store_true')
     
     args = parser.parse_args()
@@ -205,7 +292,23 @@ if __name__ == '__main__':
             eval_data_path=args.eval_data,
             output_path=args.output,
             epochs=args.epochs,
-            batch_size=args.batch_size
+            batch_size=args.batch_size,
+            use_hard_negatives=args.hard_negatives,
+            shuffle_buffer=args.shuffle_buffer,
+            eval_subsample=args.eval_subsample,
+            evaluation_steps=args.evaluation_steps,
+            nproc=args.nproc,
+            config=TrainingConfig(
+                gradient_accumulation_steps=args.grad_accum,
+                bf16=args.bf16,
+                num_threads=args.threads,
+                num_interop_threads=args.interop_threads,
+                dataloader_workers=args.dataloader_workers,
+                checkpoint_dir=args.checkpoint_dir,
+                checkpoint_steps=args.checkpoint_steps,
+                resume=args.resume,
+                log_steps=args.log_steps
+            )
         )
         
         # Evaluate after training
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Cheaper information-retrieval evaluation during and after fine-tuning
+Subsamples evaluation data for mid-training checks, caches corpus
+embeddings for models that do not change, and times evaluation
+"""
+
+import os
+import time
+import random
+import hashlib
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+import torch
+from sentence_transformers.evaluation import InformationRetrievalEvaluator
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def subsample_evaluation_data(
+    queries: Dict[str, str],
+    corpus: Dict[str, str],
+    relevant_docs: Dict[str, Set[str]],
+    max_queries: int,
+    distractor_ratio: float = 1.0,
+    seed: int = 42
+) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, Set[str]]]:
+    """
+    Pick a fixed random subset of queries for quick mid-training evaluation.
+
+    The corpus keeps every document relevant to a sampled query plus
+    distractor_ratio times as many other documents, so the task stays
+    comparably hard while encoding cost shrinks with the sample.
+    """
+    if len(queries) <= max_queries:
+        return queries, corpus, relevant_docs
+
+    rng = random.Random(seed)
+    sampled_ids = sorted(rng.sample(sorted(queries), max_queries))
+    sampled_queries = {qid: queries[qid] for qid in sampled_ids}
+    sampled_relevant = {qid: relevant_docs[qid] for qid in sampled_ids}
+
+    needed = set().union(*sampled_relevant.values())
+    others = sorted(set(corpus) - needed)
+    n_distractors = min(len(others), int(len(needed) * distractor_ratio))
+    keep = needed | set(rng.sample(others, n_distractors))
+    sampled_corpus = {did: corpus[did] for did in corpus if did in keep}
+
+    logger.info(f"Subsampled evaluation: {len(sampled_queries)}/{len(queries)} queries, "
+                f"{len(sampled_corpus)}/{len(corpus)} documents")
+    return sampled_queries, sampled_corpus, sampled_relevant
+
+
+class CachedCorpusEvaluator(InformationRetrievalEvaluator):
+    """
+    InformationRetrievalEvaluator that encodes the corpus once per model.
+
+    When model_key is set (a model name or saved path), corpus embeddings are
+    kept in memory and, with cache_dir, on disk, so frozen models such as the
+    base model are never re-encoded. During training model_key stays None
+    because the weights change between evaluations. Wall time spent in
+    evaluation is accumulated in total_seconds.
+    """
+
+    def __init__(self, *args, model_key: Optional[str] = None, cache_dir: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model_key = model_key
+        self.cache_dir = cache_dir
+        self.total_seconds = 0.0
+        self.calls = 0
+        self._memory_cache = {}
+
+    def _cache_path(self) -> Optional[str]:
+        if not self.cache_dir or not self.model_key:
+            return None
+        digest = hashlib.sha1()
+        digest.update(self.model_key.encode('utf-8'))
+        for cid, text in zip(self.corpus_ids, self.corpus):
+            digest.update(cid.encode('utf-8'))
+            digest.update(text.encode('utf-8'))
+        return os.path.join(self.cache_dir, f"corpus-{digest.hexdigest()[:16]}.pt")
+
+    def _corpus_embeddings(self, model) -> torch.Tensor:
+        if self.model_key and self.model_key in self._memory_cache:
+            return self._memory_cache[self.model_key]
+
+        path = self._cache_path()
+        if path and os.path.exists(path):
+            embeddings = torch.load(path, map_location='cpu')
+            logger.info(f"Loaded cached corpus embeddings from {path}")
+        else:
+            embeddings = model.encode(
+                self.corpus, batch_size=self.batch_size,
+                show_progress_bar=self.show_progress_bar, convert_to_tensor=True
+            )
+            if path:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                torch.save(embeddings.cpu(), path)
+
+        if self.model_key:
+            self._memory_cache[self.model_key] = embeddings
+        return embeddings
+
+    def compute_metrices(self, model, corpus_model=None, corpus_embeddings=None):
+        if corpus_embeddings is None and corpus_model is None:
+            corpus_embeddings = self._corpus_embeddings(model)
+        return super().compute_metrices(model, corpus_model=corpus_model, corpus_embeddings=corpus_embeddings)
+
+    def __call__(self, model, output_path: str = None, epoch: int = -1, steps: int = -1, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().__call__(model, output_path, epoch, steps, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.total_seconds += elapsed
+            self.calls += 1
+            logger.info(f"Evaluation '{self.name}' took {elapsed:.1f}s "
+                        f"({self.calls} runs, {self.total_seconds:.1f}s total)")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Streaming training data for fine-tuning
+Reads query/product pairs lazily from JSONL and mines hard negatives offline
+"""
+
+import json
+import random
+import hashlib
+import logging
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from sentence_transformers import SentenceTransformer, InputExample
+from torch.utils.data import IterableDataset, get_worker_info
+
+from topk import blocked_top_k
+
+# Corpus rows scored per block (bounds the queries x block score matrix)
+CORPUS_BLOCK_SIZE = 8192
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def iter_jsonl(file_path: str) -> Iterator[Dict]:
+    """Yield one record per line, skipping blank and malformed lines"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def iter_training_pairs(file_path: str) -> Iterator[Dict]:
+    """
+    Yield training pairs as dicts with query, product_text, relevance and
+    (optionally) negative_text.
+
+    `.jsonl` files are streamed line by line. Legacy `.json` arrays are still
+    accepted but have to be loaded in full.
+    """
+    if file_path.endswith('.jsonl'):
+        records = iter_jsonl(file_path)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            records = iter(json.load(f))
+
+    for item in records:
+        if not item.get('query') or not item.get('product_text'):
+            continue
+        yield {
+            'query': item['query'],
+            'product_text': item['product_text'],
+            'relevance': float(item.get('relevance', 1.0)),
+            'negative_text': item.get('negative_text'),
+        }
+
+
+def text_key(text: str) -> str:
+    """Stable short key for a text, used to compare texts without keeping them"""
+    return hashlib.blake2b(text.strip().lower().encode('utf-8'), digest_size=8).hexdigest()
+
+
+class StreamingPairDataset(IterableDataset):
+    """
+    Iterable dataset of (query, positive[, hard_negative]) InputExamples.
+
+    Pairs are read lazily, so the training file never has to fit in memory.
+    A bounded shuffle buffer gives approximate shuffling, and each DataLoader
+    worker of each training process (`rank` of `world_size`) reads a disjoint
+    stride of the usable pairs. Pairs below `min_relevance` are skipped
+    because MultipleNegativesRankingLoss treats every pair as a positive.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        shuffle_buffer: int = 10000,
+        min_relevance: float = 0.5,
+        with_negatives: bool = False,
+        seed: int = 42,
+        rank: int = 0,
+        world_size: int = 1
+    ):
+        super().__init__()
+        self.file_path = file_path
+        self.shuffle_buffer = shuffle_buffer
+        self.min_relevance = min_relevance
+        self.with_negatives = with_negatives
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self._length = None
+
+    def _accept(self, pair: Dict) -> bool:
+        if pair['relevance'] < self.min_relevance:
+            return False
+        if self.with_negatives and not pair.get('negative_text'):
+            return False
+        return True
+
+    def _to_example(self, pair: Dict) -> InputExample:
+        texts = [pair['query'], pair['product_text']]
+        if self.with_negatives:
+            texts.append(pair['negative_text'])
+        return InputExample(texts=texts)
+
+    def _worker(self):
+        worker = get_worker_info()
+        return (worker.id, worker.num_workers) if worker else (0, 1)
+
+    def _iter_examples(self) -> Iterator[InputExample]:
+        # Rank r takes every world_size-th usable pair (not raw line), so each
+        # rank gets exactly len(self) pairs; its DataLoader workers split those
+        worker_id, num_workers = self._worker()
+        usable = (pair for pair in iter_training_pairs(self.file_path) if self._accept(pair))
+        for i, pair in enumerate(usable):
+            if i % self.world_size == self.rank and (i // self.world_size) % num_workers == worker_id:
+                yield self._to_example(pair)
+
+    def __iter__(self) -> Iterator[InputExample]:
+        examples = self._iter_examples()
+        if self.shuffle_buffer <= 1:
+            yield from examples
+            return
+
+        worker_id, num_workers = self._worker()
+        rng = random.Random(self.seed + self.epoch * 100003 + self.rank * num_workers + worker_id)
+
+        buffer = []
+        for example in examples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(example)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = example
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def set_epoch(self, epoch: int):
+        """Seed the shuffle for this epoch (fit_cpu calls it, so a resumed run replays the same order)"""
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        """Number of usable pairs this rank trains on (one streaming pass, cached)"""
+        if self._length is None:
+            self._length = sum(1 for pair in iter_training_pairs(self.file_path) if self._accept(pair))
+            logger.info(f"Counted {self._length} training pairs in {self.file_path}")
+        return len(range(self.rank, self._length, self.world_size))
+
+
+def load_catalog_texts(catalog_path: str) -> List[str]:
+    """
+    Load unique product texts for negative mining.
+
+    Accepts a JSONL catalog with `product_text` (or `text`) fields, or a
+    training file, in which case the positives themselves form the catalog.
+    """
+    seen = set()
+    texts = []
+    if catalog_path.endswith('.jsonl'):
+        records = iter_jsonl(catalog_path)
+    else:
+        with open(catalog_path, 'r', encoding='utf-8') as f:
+            records = iter(json.load(f))
+
+    for item in records:
+        text = item.get('product_text') or item.get('text')
+        if not text:
+            continue
+        key = text_key(text)
+        if key not in seen:
+            seen.add(key)
+            texts.append(text)
+
+    logger.info(f"Loaded {len(texts)} unique catalog texts from {catalog_path}")
+    return texts
+
+
+def mine_hard_negatives(
+    model_name: str,
+    train_data_path: str,
+    output_path: str,
+    catalog_path: Optional[str] = None,
+    top_k: int = 20,
+    max_score: float = 0.95,
+    query_block_size: int = 1024,
+    corpus_block_size: int = CORPUS_BLOCK_SIZE,
+    batch_size: int = 128
+) -> int:
+    """
+    Add a `negative_text` to every training pair and write the result as JSONL.
+
+    The catalog is embedded once. Queries are then embedded block by block
+    and searched against the catalog with blocked top-k. The negative is the
+    highest-scoring catalog product that is not a known positive for the
+    query. Candidates scoring above `max_score` are skipped, since they are
+    usually unlabeled positives or near-duplicates of the positive.
+    Returns the number of pairs written.
+    """
+    model = SentenceTransformer(model_name)
+    catalog = load_catalog_texts(catalog_path or train_data_path)
+    if not catalog:
+        raise ValueError("Catalog is empty; nothing to mine negatives from")
+
+    logger.info(f"Embedding catalog of {len(catalog)} products...")
+    catalog_emb = model.encode(
+        catalog, batch_size=batch_size, convert_to_numpy=True,
+        normalize_embeddings=True, show_progress_bar=True
+    ).astype(np.float32)
+    catalog_keys = [text_key(text) for text in catalog]
+
+    # Known positives per query, kept as short hashes rather than full texts
+    positives = {}
+    for pair in iter_training_pairs(train_data_path):
+        positives.setdefault(pair['query'], set()).add(text_key(pair['product_text']))
+
+    written = 0
+    missing = 0
+
+    def flush(block: List[Dict], out):
+        nonlocal written, missing
+        query_emb = model.encode(
+            [pair['query'] for pair in block], batch_size=batch_size,
+            convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)
+        indices, scores = blocked_top_k(query_emb, catalog_emb, top_k, corpus_block_size)
+        for pair, row_idx, row_scores in zip(block, indices, scores):
+            known = positives.get(pair['query'], set())
+            negative = None
+            for idx, score in zip(row_idx, row_scores):
+                if score > max_score or catalog_keys[idx] in known:
+                    continue
+                negative = catalog[idx]
+                break
+            if negative is None:
+                missing += 1
+                continue
+            pair['negative_text'] = negative
+            out.write(json.dumps(pair) + '\n')
+            written += 1
+
+    with open(output_path, 'w', encoding='utf-8') as out:
+        block = []
+        for pair in iter_training_pairs(train_data_path):
+            block.append(pair)
+            if len(block) >= query_block_size:
+                flush(block, out)
+                block = []
+        if block:
+            flush(block, out)
+
+    logger.info(f"Wrote {written} pairs with hard negatives to {output_path} "
+                f"({missing} pairs had no usable negative)")
+    return written
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mine hard negatives for fine-tuning')
+    parser.add_argument('--model', default='sentence-transformers/all-MiniLM-L6-v2')
+    parser.add_argument('--train-data', default='data/training_data.jsonl')
+    parser.add_argument('--catalog', help='JSONL catalog of product texts (default: training positives)')
+    parser.add_argument('--output', default='data/training_data_hard_negatives.jsonl')
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--max-score', type=float, default=0.95)
+    parser.add_argument('--batch-size', type=int, default=128)
+
+    args = parser.parse_args()
+
+    mine_hard_negatives(
+        model_name=args.model,
+        train_data_path=args.train_data,
+        output_path=args.output,
+        catalog_path=args.catalog,
+        top_k=args.top_k,
+        max_score=args.max_score,
+        batch_size=args.batch_size
+    )
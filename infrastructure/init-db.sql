@@ -31,10 +31,25 @@ WITH (lists = 100);
 CREATE INDEX IF NOT EXISTS products_title_idx ON products USING gin(to_tsvector('english', title));
 CREATE INDEX IF NOT EXISTS products_description_idx ON products USING gin(to_tsvector('english', description));
 
--- Function to update updated_at timestamp
+-- Bumped when products.embedding is swapped wholesale (data-pipeline/reembed.py
+-- flip and rollback), which leaves updated_at alone; consumers that tail
+-- updated_at rebuild from scratch when changed_at moves
+CREATE TABLE IF NOT EXISTS embedding_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    model TEXT,
+    changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO embedding_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+-- Function to update updated_at timestamp. Maintenance writes that do not
+-- change product content (e.g. the re-embed backfill) set
+-- products.skip_updated_at = 'on' for their transaction to leave it alone.
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
 BEGIN
+    IF current_setting('products.skip_updated_at', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
     NEW.updated_at = CURRENT_TIMESTAMP;
     RETURN NEW;
 END;
@@ -43,3 +58,26 @@ $$ language 'plpgsql';
 -- Trigger to auto-update updated_at
 CREATE TRIGGER update_products_updated_at BEFORE UPDATE ON products
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- Notify the incremental embedding worker (data-pipeline/embedding_worker.py)
+-- when product text is edited without a new embedding, or a product is
+-- inserted without one
+CREATE OR REPLACE FUNCTION notify_product_text_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('product_text_changed',
+        json_build_object('id', NEW.id, 'at', extract(epoch FROM clock_timestamp()))::text);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER notify_products_text_changed AFTER UPDATE OF title, description, brand, category ON products
+    FOR EACH ROW
+    WHEN ((OLD.title IS DISTINCT FROM NEW.title OR OLD.description IS DISTINCT FROM NEW.description
+           OR OLD.brand IS DISTINCT FROM NEW.brand OR OLD.category IS DISTINCT FROM NEW.category)
+          AND OLD.embedding IS NOT DISTINCT FROM NEW.embedding)
+    EXECUTE FUNCTION notify_product_text_changed();
+
+CREATE TRIGGER notify_products_inserted_without_embedding AFTER INSERT ON products
+    FOR EACH ROW WHEN (NEW.embedding IS NULL)
+    EXECUTE FUNCTION notify_product_text_changed();
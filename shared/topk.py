@@ -0,0 +1,52 @@
+"""
+Exact top-k by dot product, shared by the vector-search scan,
+data-pipeline/query_cache.py and evaluation/training_data.py
+The source of truth is shared/topk.py. Each of those directories deploys on
+its own, so it carries an identical copy; edit shared/topk.py, copy it over,
+and CI checks that the copies match
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+# Default corpus rows scored per block (bounds the queries x block score matrix)
+BLOCK_ROWS = 65536
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first"""
+    if len(scores) <= k:
+        return np.argsort(-scores, kind='stable')
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx], kind='stable')]
+
+
+def blocked_top_k(queries: np.ndarray, corpus: np.ndarray, k: int, block_size: int = BLOCK_ROWS,
+                  score_block=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Exact top-k by dot product for a batch of queries, scoring the corpus a
+    block at a time (argpartition per block, merged into a running best k) so
+    the full queries x corpus score matrix is never materialized.
+
+    score_block(start, stop), if given, returns the (n_queries, stop - start)
+    scores of those corpus rows instead of `queries @ corpus[start:stop].T`;
+    -inf scores can be used to exclude rows. Returns (indices, scores), each
+    (n_queries, min(k, len(corpus))), best first.
+    """
+    k = min(k, len(corpus))
+    best_idx = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(corpus), block_size):
+        stop = min(start + block_size, len(corpus))
+        scores = score_block(start, stop) if score_block else queries @ np.asarray(corpus[start:stop]).T
+        take = min(k, stop - start)
+        idx = np.argpartition(-scores, take - 1, axis=1)[:, :take]
+        best_idx = np.hstack([best_idx, idx + start])
+        best_scores = np.hstack([best_scores, np.take_along_axis(scores, idx, axis=1)])
+        if best_idx.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_idx = np.take_along_axis(best_idx, keep, axis=1)
+            best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Smoke test for the data-pipeline schema tools against a live Postgres
+Runs sharded ingestion with several worker processes (claim, lease expiry
+after a killed worker, re-claim), the vector-search sidecar index, blue/green
+re-embedding, the LISTEN/NOTIFY embedding worker and category partitioning.
+Uses the docker-compose Postgres (DB_* variables) but only touches scratch
+databases it creates and drops; embeddings come from the offline stub model
+in benchmarks/stub_stack.py, so no embedding service is needed.
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import random
+import tempfile
+import subprocess
+import traceback
+from typing import Dict, List
+
+import psycopg2
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.join(REPO_ROOT, 'data-pipeline')
+DB_HOST = os.getenv('DB_HOST', 'localhost')
+DB_PORT = os.getenv('DB_PORT', '5432')
+DB_USER = os.getenv('DB_USER', 'postgres')
+DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
+SMOKE_DB = os.getenv('SMOKE_DB_NAME', os.getenv('DB_NAME', 'ecommerce') + '_smoke')
+PARTITION_DB = SMOKE_DB + '_partitioned'
+PRODUCTS = int(os.getenv('SMOKE_PRODUCTS', '600'))
+KEEP = '--keep' in sys.argv
+
+# The pipeline modules read DB_NAME when imported, and worker subprocesses inherit it
+os.environ['DB_NAME'] = SMOKE_DB
+for directory in ('data-pipeline', 'vector-search', 'benchmarks'):
+    sys.path.insert(0, os.path.join(REPO_ROOT, directory))
+
+import ingest_data  # noqa: E402
+import partitioning  # noqa: E402
+import reembed  # noqa: E402
+import sharded_ingest  # noqa: E402
+from stub_stack import StubModel, StubServer, make_embedding_handler  # noqa: E402
+from vector_index import VectorIndex, pgvector_top_k  # noqa: E402
+
+# ANSI color codes
+GREEN = '\033[92m'
+RED = '\033[91m'
+YELLOW = '\033[93m'
+BLUE = '\033[94m'
+RESET = '\033[0m'
+BOLD = '\033[1m'
+
+CATEGORIES = ['Electronics > Headphones', 'Electronics > Cables', 'Home & Kitchen > Blenders',
+              'Sports > Fitness', 'Books', 'Toys > Puzzles']
+WORDS = ('wireless bluetooth headphones noise cancelling charger cable usb laptop stand portable speaker '
+         'waterproof smart watch fitness tracker blender stainless coffee grinder gaming mouse keyboard').split()
+
+
+def print_header(text: str):
+    """Print a formatted header"""
+    print(f"\n{BOLD}{BLUE}{'='*60}{RESET}")
+    print(f"{BOLD}{BLUE}{text}{RESET}")
+    print(f"{BOLD}{BLUE}{'='*60}{RESET}\n")
+
+
+def print_success(text: str):
+    print(f"{GREEN}✓ {text}{RESET}")
+
+
+def print_error(text: str):
+    print(f"{RED}✗ {text}{RESET}")
+
+
+def print_info(text: str):
+    print(f"{BLUE}ℹ {text}{RESET}")
+
+
+class SmokeFailure(Exception):
+    """A check did not hold"""
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise SmokeFailure(message)
+    print_success(message)
+
+
+def connect(database: str = SMOKE_DB):
+    return psycopg2.connect(host=DB_HOST, port=DB_PORT, database=database, user=DB_USER, password=DB_PASSWORD)
+
+
+def create_database(name: str):
+    """Fresh scratch database with the schema from infrastructure/init-db.sql"""
+    admin = connect('postgres')
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        cursor.execute(f'CREATE DATABASE "{name}"')
+    admin.close()
+    conn = connect(name)
+    with open(os.path.join(REPO_ROOT, 'infrastructure', 'init-db.sql'), 'r', encoding='utf-8') as f:
+        with conn.cursor() as cursor:
+            cursor.execute(f.read())
+    conn.commit()
+    return conn
+
+
+def drop_database(name: str):
+    admin = connect('postgres')
+    admin.autocommit = True
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    admin.close()
+
+
+def write_products(path: str, count: int, seed: int = 7):
+    """JSON lines products with a few words each, spread over CATEGORIES"""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({
+                'product_id': f"SMOKE{i:05d}",
+                'title': ' '.join(rng.sample(WORDS, 3)),
+                'description': ' '.join(rng.sample(WORDS, 6)),
+                'brand': rng.choice(['Acme', 'Globex', 'Initech']),
+                'category': CATEGORIES[i % len(CATEGORIES)],
+                'price': round(rng.uniform(5, 300), 2),
+            }) + '\n')
+
+
+def reset_partition_cache():
+    """ingest_data caches the partition lookup per process; reset it between databases"""
+    ingest_data._partition_map = ingest_data._NOT_LOADED
+
+
+def scalar(conn, sql: str, params=None):
+    with conn.cursor() as cursor:
+        cursor.execute(sql, params)
+        value = cursor.fetchone()[0]
+    conn.commit()
+    return value
+
+
+def start_worker(job_id: str, worker_id: str, batch_url: str, lease_seconds: int, batch_size: int):
+    return subprocess.Popen(
+        [sys.executable, 'sharded_ingest.py', 'work', '--job-id', job_id, '--worker-id', worker_id,
+         '--batch-url', batch_url, '--lease-seconds', str(lease_seconds), '--batch-size', str(batch_size)],
+        cwd=PIPELINE_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+
+
+def test_sharded_ingest(data_file: str, batch_url: str, slow_batch_url: str) -> bool:
+    """Shard claims, lease takeover, a killed worker's shard re-claimed by other processes"""
+    print_header("Sharded Ingestion (claim, lease expiry, re-claim)")
+    conn = connect()
+    sharded_ingest.ensure_schema(conn)
+    job_id = 'smoke'
+    shards = sharded_ingest.plan_byte_shards([data_file], max(1, os.path.getsize(data_file) // 6))
+    sharded_ingest.register_job(conn, job_id, shards)
+    check(sharded_ingest.register_job(conn, job_id, shards) == len(shards), f"Registered {len(shards)} shards (idempotent)")
+
+    # In process: a lease that is not renewed is taken over, and the old holder notices
+    first = sharded_ingest.claim_shard(conn, job_id, 'smoke-a', lease_seconds=1)
+    check(first is not None and first['shard_no'] == 0, "smoke-a claimed shard 0")
+    second = sharded_ingest.claim_shard(conn, job_id, 'smoke-b', lease_seconds=60)
+    check(second['shard_no'] == 1, "A live lease is skipped: smoke-b claimed shard 1")
+    result = sharded_ingest.ingest_shard(conn, job_id, second, 'smoke-b', batch_url, batch_size=50)
+    sharded_ingest.finish_shard(conn, job_id, 1, 'smoke-b', result['rows_read'], result['rows_written'])
+    check(result['rows_written'] > 0, f"smoke-b ingested shard 1 ({result['rows_written']} rows)")
+
+    time.sleep(1.5)
+    taken = sharded_ingest.claim_shard(conn, job_id, 'smoke-b', lease_seconds=60)
+    check(taken['shard_no'] == 0 and taken['attempts'] == 2, "Expired lease on shard 0 re-claimed by smoke-b (attempt 2)")
+    try:
+        sharded_ingest.renew_lease(conn, job_id, 0, 'smoke-a', 60, 0, 0)
+        check(False, "smoke-a's renewal should have raised LeaseLost")
+    except sharded_ingest.LeaseLost:
+        print_success("smoke-a's lease renewal raised LeaseLost")
+    result = sharded_ingest.ingest_shard(conn, job_id, taken, 'smoke-b', batch_url, batch_size=50)
+    sharded_ingest.finish_shard(conn, job_id, 0, 'smoke-b', result['rows_read'], result['rows_written'])
+    check(result['rows_written'] > 0, f"smoke-b finished shard 0 ({result['rows_written']} rows)")
+
+    # Separate processes: kill a worker mid-shard, the others pick its shard up once the lease runs out
+    lease = 3
+    victim = start_worker(job_id, 'smoke-killed', slow_batch_url, lease, 10)
+    deadline = time.time() + 60
+    held = None
+    while time.time() < deadline and held is None:
+        time.sleep(0.2)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT shard_no FROM ingest_shards WHERE job_id = %s AND worker_id = 'smoke-killed' "
+                           "AND status = 'running' AND rows_read > 0", (job_id,))
+            row = cursor.fetchone()
+        conn.commit()
+        held = row[0] if row else None
+    check(held is not None, f"smoke-killed is mid-way through shard {held}")
+    victim.send_signal(signal.SIGKILL)
+    victim.wait()
+    print_info("smoke-killed was sent SIGKILL (the stub may log a broken pipe for its in-flight request)")
+
+    workers = [start_worker(job_id, f"smoke-w{i}", batch_url, lease, 50) for i in range(3)]
+    for worker in workers:
+        output, _ = worker.communicate(timeout=180)
+        if worker.returncode != 0:
+            print(output)
+        check(worker.returncode == 0, f"Worker exited cleanly: {output.strip().splitlines()[-1]}")
+
+    status = sharded_ingest.job_status(conn, job_id)
+    check(status['by_status'] == {'done': len(shards)}, f"All {len(shards)} shards done")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT worker_id, attempts FROM ingest_shards WHERE job_id = %s AND shard_no = %s",
+                       (job_id, held))
+        worker_id, attempts = cursor.fetchone()
+    conn.commit()
+    check(worker_id != 'smoke-killed' and attempts >= 2,
+          f"Killed worker's shard {held} finished by {worker_id} on attempt {attempts}")
+    rows = scalar(conn, "SELECT count(*) FROM products WHERE embedding IS NOT NULL")
+    check(rows == PRODUCTS, f"{rows}/{PRODUCTS} products ingested with embeddings")
+    conn.close()
+    return True
+
+
+def search_ids(results) -> List[str]:
+    return [product_id for product_id, _ in results]
+
+
+def test_vector_index(model: StubModel) -> bool:
+    """Sidecar snapshot agrees with pgvector's exact search and picks up changes"""
+    print_header("Vector Search Index (snapshot, refresh)")
+    conn = connect()
+    directory = tempfile.mkdtemp(prefix='smoke-vectors-')
+    changes = []
+    index = VectorIndex(connect, directory, refresh_seconds=3600, on_change=changes.append)
+    index.reload()
+    check(index.snapshot.live_rows() == PRODUCTS, f"Snapshot loaded {PRODUCTS} rows")
+    for query in ('wireless headphones', 'coffee grinder stainless', 'gaming mouse keyboard'):
+        vector = model.encode_one(query)
+        ours, _ = index.search(vector, 10)
+        theirs = pgvector_top_k(conn, vector, 10)
+        check(search_ids(ours) == search_ids(theirs), f"'{query}': top-10 matches pgvector exact search")
+
+    target = model.encode_one('zebra unicorn')
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE products SET embedding = %s::vector WHERE product_id = 'SMOKE00042'",
+                       (str(target.tolist()),))
+    conn.commit()
+    time.sleep(0.01)
+    check(index.refresh() >= 1, "Refresh applied the updated row")
+    results, _ = index.search(target, 1)
+    check(results[0][0] == 'SMOKE00042', "Updated product ranks first for its new vector")
+
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO products (product_id, title, embedding) "
+                       "VALUES ('SMOKE-DELETED', 'zebra', %s::vector)", (str(target.tolist()),))
+    conn.commit()
+    time.sleep(0.01)
+    index.refresh()
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM products WHERE product_id = 'SMOKE-DELETED'")
+    conn.commit()
+    changes.clear()
+    check(index.refresh() == 0 and index.remove_deleted() == 1 and changes == [[('SMOKE-DELETED', None)]],
+          "Deletion check removed the hard-DELETEd product and reported it to on_change")
+    results, _ = index.search(target, 2)
+    check('SMOKE-DELETED' not in search_ids(results), "Deleted product no longer appears in results")
+    check(index.remove_deleted() == 0, "A second deletion check finds nothing")
+    conn.close()
+    return True
+
+
+def test_reembed(batch_url_v2: str, dim_v2: int) -> bool:
+    """Shadow-column backfill, index, flip (bumping embedding_version) and rollback"""
+    print_header("Blue/Green Re-embedding (backfill, flip, rollback)")
+    reset_partition_cache()
+    conn = connect()
+    index = VectorIndex(connect, tempfile.mkdtemp(prefix='smoke-vectors-'), refresh_seconds=3600)
+    index.reload()
+    watermark = scalar(conn, "SELECT max(updated_at) FROM products")
+    version = reembed.embedding_version(conn)
+
+    job_id = 'smoke-v2'
+    reembed.start(conn, job_id, 'v2', batch_url_v2)
+    reembed.backfill(conn, job_id, rows_per_sec=0, batch_size=100, batch_url=batch_url_v2)
+    reembed.build_index(conn, job_id, min_index_rows=100)
+    check(reembed.flip(conn, job_id, batch_url_v2), "Flip succeeded")
+    dims = scalar(conn, "SELECT array_agg(DISTINCT vector_dims(embedding)) FROM products")
+    check(dims == [dim_v2], f"products.embedding holds {dim_v2}-dim vectors after the flip")
+    check(scalar(conn, "SELECT max(updated_at) FROM products") == watermark, "Flip left updated_at alone")
+    check(reembed.embedding_version(conn) != version, "Flip bumped embedding_version")
+
+    reloads = index.stats['reloads']
+    index.refresh()
+    check(index.stats['reloads'] == reloads + 1 and index.snapshot.dim == dim_v2,
+          "Vector index did a full reload on its next refresh")
+
+    reembed.rollback(conn, job_id)
+    dims = scalar(conn, "SELECT array_agg(DISTINCT vector_dims(embedding)) FROM products")
+    check(dims == [384], "Rollback restored the 384-dim vectors")
+    index.refresh()
+    check(index.snapshot.dim == 384, "Vector index reloaded again after the rollback")
+    conn.close()
+    return True
+
+
+def wait_for(conn, sql: str, params, timeout: float = 20.0) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if scalar(conn, sql, params):
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def test_embedding_worker(batch_url: str) -> bool:
+    """Text edits and inserts without an embedding are re-embedded through LISTEN/NOTIFY"""
+    print_header("Incremental Embedding Worker (LISTEN/NOTIFY)")
+    conn = connect()
+    worker = subprocess.Popen(
+        [sys.executable, 'embedding_worker.py', 'run', '--batch-url', batch_url, '--max-wait', '0.2'],
+        cwd=PIPELINE_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        # Give the worker time to LISTEN and finish its catch-up scan
+        time.sleep(3)
+        before = scalar(conn, "SELECT embedding::text FROM products WHERE product_id = 'SMOKE00007'")
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE products SET title = 'zebra unicorn rainbow' WHERE product_id = 'SMOKE00007'")
+            cursor.execute("INSERT INTO products (product_id, title, category) "
+                           "VALUES ('SMOKE-NEW', 'solar battery pack', 'Electronics')")
+        conn.commit()
+        check(wait_for(conn, "SELECT embedding::text <> %s FROM products WHERE product_id = 'SMOKE00007'", (before,)),
+              "Edited product was re-embedded (trigger survived the re-embed flip and rollback)")
+        check(wait_for(conn, "SELECT embedding IS NOT NULL FROM products WHERE product_id = 'SMOKE-NEW'", None),
+              "Product inserted without an embedding was embedded")
+    finally:
+        worker.terminate()
+        output, _ = worker.communicate(timeout=30)
+        print_info(output.strip().splitlines()[0] if output.strip() else 'worker produced no output')
+    conn.close()
+    return True
+
+
+def test_partitioning(data_file: str, model: StubModel) -> bool:
+    """Partition swap keeps rows and triggers; routed upserts, category moves and an empty registry"""
+    print_header("Category Partitions (swap, triggers, routed upserts)")
+    reset_partition_cache()
+    conn = create_database(PARTITION_DB)
+    rows = []
+    for batch in ingest_data.iter_amazon_records(data_file, 200):
+        vectors = model.encode([ingest_data.create_searchable_text(p) for p in batch])
+        rows += [ingest_data.product_row(p, v.tolist()) for p, v in zip(batch, vectors)]
+    ingest_data.insert_products_bulk(conn, rows)
+
+    plan = partitioning.plan_partitions(partitioning.category_counts(conn), min_rows=PRODUCTS // 10)
+    partitioning.create_partitioned(conn, plan)
+    check(scalar(conn, "SELECT relkind FROM pg_class WHERE oid = 'products'::regclass") == 'p',
+          f"products is partitioned ({len(plan)} partitions)")
+    check(scalar(conn, "SELECT count(*) FROM products") == PRODUCTS, "All rows copied into the partitions")
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT tgname FROM pg_trigger WHERE tgrelid = 'products'::regclass AND NOT tgisinternal")
+        triggers = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    expected = {'update_products_updated_at', 'notify_products_text_changed',
+                'notify_products_inserted_without_embedding'}
+    check(expected <= triggers, f"Triggers recreated on the partitioned table: {', '.join(sorted(expected))}")
+
+    listener = connect(PARTITION_DB)
+    listener.autocommit = True
+    with listener.cursor() as cursor:
+        cursor.execute("LISTEN product_text_changed")
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO products (product_id, title) VALUES ('SMOKE-NOTIFY', 'no embedding yet')")
+    conn.commit()
+    deadline = time.time() + 5
+    while time.time() < deadline and not listener.notifies:
+        listener.poll()
+        time.sleep(0.1)
+    check(bool(listener.notifies), "Insert without an embedding notifies the embedding worker channel")
+    listener.close()
+
+    reset_partition_cache()
+    moved = list(rows[0])
+    moved[3] = CATEGORIES[1] if rows[0][3] != CATEGORIES[1] else CATEGORIES[0]
+    ingest_data.insert_products_bulk(conn, [tuple(moved)])
+    count = scalar(conn, "SELECT count(*) FROM products WHERE product_id = %s", (moved[0],))
+    root = scalar(conn, "SELECT category_root FROM products WHERE product_id = %s", (moved[0],))
+    check(count == 1 and root == partitioning.category_root(moved[3]),
+          f"Category change moved {moved[0]} to the '{root}' partition")
+
+    results = partitioning.build_indexes(conn, min_index_rows=PRODUCTS // 10)
+    check(any(r['index'] for r in results), f"Built {sum(1 for r in results if r['index'])} per-partition indexes")
+
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM product_partitions")
+    conn.commit()
+    reset_partition_cache()
+    check(ingest_data.partition_map(conn) == {}, "Empty registry is still seen as partitioned")
+    fresh = list(rows[1])
+    fresh[0], fresh[3] = 'SMOKE-DEFAULT', 'Garden > Tools'
+    ingest_data.insert_products_bulk(conn, [tuple(fresh)])
+    check(scalar(conn, f"SELECT count(*) FROM {partitioning.DEFAULT_PARTITION} WHERE product_id = 'SMOKE-DEFAULT'") == 1,
+          "With an empty registry, upserts go to the default partition")
+    conn.close()
+    return True
+
+
+def run_all_tests() -> Dict[str, bool]:
+    print(f"\n{BOLD}{BLUE}{'='*60}{RESET}")
+    print(f"{BOLD}{BLUE}Data Pipeline Smoke Test{RESET}")
+    print(f"{BOLD}{BLUE}{'='*60}{RESET}")
+    print_info(f"Postgres {DB_HOST}:{DB_PORT}, scratch databases {SMOKE_DB} and {PARTITION_DB}")
+
+    model, model_v2, dim_v2 = StubModel(), StubModel(dimension=128), 128
+    slow_model = StubModel(cost_per_token_ms=2.0)
+    data_file = os.path.join(tempfile.mkdtemp(prefix='smoke-data-'), 'products.json')
+    write_products(data_file, PRODUCTS)
+
+    results = {}
+    with StubServer(make_embedding_handler(model)) as stub, \
+            StubServer(make_embedding_handler(slow_model)) as slow_stub, \
+            StubServer(make_embedding_handler(model_v2)) as stub_v2:
+        create_database(SMOKE_DB).close()
+        tests = [
+            ("Sharded Ingestion", lambda: test_sharded_ingest(data_file, stub.url + '/embed/batch',
+                                                              slow_stub.url + '/embed/batch')),
+            ("Vector Search Index", lambda: test_vector_index(model)),
+            ("Re-embedding", lambda: test_reembed(stub_v2.url + '/embed/batch', dim_v2)),
+            ("Embedding Worker", lambda: test_embedding_worker(stub.url + '/embed/batch')),
+            ("Category Partitions", lambda: test_partitioning(data_file, model)),
+        ]
+        for name, test in tests:
+            try:
+                results[name] = test()
+            except Exception as e:
+                print_error(f"{name}: {e}")
+                if not isinstance(e, SmokeFailure):
+                    traceback.print_exc()
+                results[name] = False
+
+    if not KEEP:
+        for name in (SMOKE_DB, PARTITION_DB):
+            drop_database(name)
+    return results
+
+
+def print_summary(results: Dict[str, bool]) -> int:
+    print_header("Test Summary")
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        status = f"{GREEN}PASSED{RESET}" if result else f"{RED}FAILED{RESET}"
+        print(f"{test_name}: {status}")
+    print(f"\n{BOLD}Total: {passed}/{len(results)} tests passed{RESET}\n")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(print_summary(run_all_tests()))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Offline checks for the CPU training data path
+Verifies that StreamingPairDataset reshuffles every epoch and that a resumed
+epoch replays the recorded order, with and without DataLoader workers. Needs
+the evaluation/ requirements (torch, sentence-transformers) but no services.
+"""
+
+import os
+import sys
+import json
+import tempfile
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'evaluation'))
+
+from cpu_training import TrainingConfig, make_dataloader  # noqa: E402
+from training_data import StreamingPairDataset  # noqa: E402
+
+# ANSI color codes
+GREEN = '\033[92m'
+RED = '\033[91m'
+BLUE = '\033[94m'
+RESET = '\033[0m'
+BOLD = '\033[1m'
+
+PAIRS = 20
+
+
+def print_header(text: str):
+    """Print a formatted header"""
+    print(f"\n{BOLD}{BLUE}{'='*60}{RESET}")
+    print(f"{BOLD}{BLUE}{text}{RESET}")
+    print(f"{BOLD}{BLUE}{'='*60}{RESET}\n")
+
+
+def print_success(text: str):
+    print(f"{GREEN}✓ {text}{RESET}")
+
+
+def print_error(text: str):
+    print(f"{RED}✗ {text}{RESET}")
+
+
+def write_pairs(path: str, count: int):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({'query': f"q{i}", 'product_text': f"product {i}"}) + '\n')
+
+
+def epoch_order(loader, epoch: int) -> List[str]:
+    """Queries in the order one epoch yields them, as fit_cpu would iterate it"""
+    loader.dataset.set_epoch(epoch)
+    return [example.texts[0] for batch in loader for example in batch]
+
+
+def test_epoch_shuffle(data_file: str, workers: int) -> bool:
+    """Each epoch gets its own order, covering every pair once; replaying an epoch repeats it"""
+    print_header(f"Epoch Shuffle ({workers} DataLoader workers)")
+    dataset = StreamingPairDataset(data_file, shuffle_buffer=8)
+    loader = make_dataloader(dataset, 4, TrainingConfig(dataloader_workers=workers))
+    loader.collate_fn = list
+
+    orders = [epoch_order(loader, epoch) for epoch in range(3)]
+    passed = True
+    if all(sorted(order) == sorted(f"q{i}" for i in range(PAIRS)) for order in orders):
+        print_success(f"Every epoch yields all {PAIRS} pairs once")
+    else:
+        print_error(f"Epochs lost or repeated pairs: {orders}")
+        passed = False
+    if len({tuple(order) for order in orders}) == len(orders):
+        print_success("Epochs 0, 1 and 2 are shuffled differently")
+    else:
+        print_error(f"Epochs repeat the same order: {orders[0][:6]}")
+        passed = False
+    if epoch_order(loader, 1) == orders[1]:
+        print_success("Replaying epoch 1 (as a resumed run does) repeats its order")
+    else:
+        print_error("Replaying epoch 1 gave a different order")
+        passed = False
+    return passed
+
+
+def run_all_tests() -> Dict[str, bool]:
+    data_file = os.path.join(tempfile.mkdtemp(prefix='training-test-'), 'pairs.jsonl')
+    write_pairs(data_file, PAIRS)
+    return {f"Epoch Shuffle ({workers} workers)": test_epoch_shuffle(data_file, workers) for workers in (0, 1, 2)}
+
+
+def print_summary(results: Dict[str, bool]) -> int:
+    print_header("Test Summary")
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        status = f"{GREEN}PASSED{RESET}" if result else f"{RED}FAILED{RESET}"
+        print(f"{test_name}: {status}")
+    print(f"\n{BOLD}Total: {passed}/{len(results)} tests passed{RESET}\n")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(print_summary(run_all_tests()))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Offline checks for the vector-search caches
+Drives semantic_cache.ProductChangeFeed against an in-memory stand-in for
+the products table, so no Postgres or embedding service is needed.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Dict
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'vector-search'))
+
+from semantic_cache import ProductChangeFeed, SemanticCache  # noqa: E402
+
+# ANSI color codes
+GREEN = '\033[92m'
+RED = '\033[91m'
+BLUE = '\033[94m'
+RESET = '\033[0m'
+BOLD = '\033[1m'
+
+DIM = 8
+
+
+def print_header(text: str):
+    """Print a formatted header"""
+    print(f"\n{BOLD}{BLUE}{'='*60}{RESET}")
+    print(f"{BOLD}{BLUE}{text}{RESET}")
+    print(f"{BOLD}{BLUE}{'='*60}{RESET}\n")
+
+
+def print_success(text: str):
+    print(f"{GREEN}✓ {text}{RESET}")
+
+
+def print_error(text: str):
+    print(f"{RED}✗ {text}{RESET}")
+
+
+class FakeProducts:
+    """products rows (product_id -> (embedding text, updated_at)) behind a psycopg2-shaped connection"""
+
+    def __init__(self):
+        self.rows: Dict[str, tuple] = {}
+        self.now = datetime(2024, 1, 1, 12, 0, 0)
+
+    def write(self, product_id: str, vector: np.ndarray):
+        self.now += timedelta(milliseconds=100)
+        self.rows[product_id] = ('[' + ','.join(str(float(x)) for x in vector) + ']', self.now)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, table: FakeProducts):
+        self.table = table
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=None):
+        if 'to_regclass' in sql:
+            self.result = [(False,)]
+        elif 'max(updated_at)' in sql:
+            self.result = [(max((row[1] for row in self.table.rows.values()), default=None),)]
+        elif 'updated_at >' in sql:
+            since = params[0] - timedelta(seconds=int(sql.split("interval '")[1].split()[0]))
+            self.result = [(pid, text, updated_at) for pid, (text, updated_at) in self.table.rows.items()
+                           if updated_at > since]
+        else:
+            raise AssertionError(f"Unexpected query: {sql}")
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def unit(seed: int) -> np.ndarray:
+    vector = np.random.default_rng(seed).normal(size=DIM)
+    return vector / np.linalg.norm(vector)
+
+
+def test_change_feed_quiesces() -> bool:
+    """A change is invalidated once; polls without new writes leave the cache and its generation alone"""
+    print_header("Semantic Cache Change Feed")
+    products = FakeProducts()
+    for i in range(5):
+        products.write(f"p{i}", unit(i))
+    cache = SemanticCache(DIM, capacity=16, threshold=0.99, ttl_seconds=float('inf'))
+    feed = ProductChangeFeed(products.connect, cache)
+    feed.poll()
+
+    query = unit(100)
+    passed = True
+
+    def store_entry():
+        cache.store(query, 2, [('p1', 0.9), ('p2', 0.8)], generation=cache.generation)
+
+    store_entry()
+    products.write('p1', unit(1))
+    dropped = feed.poll()
+    if dropped == 1 and cache.generation == 1:
+        print_success("An updated product invalidates the cached entry that lists it")
+    else:
+        print_error(f"Expected 1 entry dropped at generation 1, got {dropped} at {cache.generation}")
+        passed = False
+
+    store_entry()
+    repeats = [feed.poll() for _ in range(3)]
+    if repeats == [0, 0, 0] and cache.generation == 1 and cache.lookup(query, 2) is not None:
+        print_success("Polls with no new writes invalidate nothing and keep the generation")
+    else:
+        print_error(f"Re-read rows were invalidated again: dropped {repeats}, generation {cache.generation}")
+        passed = False
+
+    products.write('p2', unit(2))
+    if feed.poll() == 1 and cache.lookup(query, 2) is None:
+        print_success("A later write inside the overlap window is still picked up")
+    else:
+        print_error("A write inside the overlap window was missed")
+        passed = False
+    return passed
+
+
+def run_all_tests() -> Dict[str, bool]:
+    return {'Semantic Cache Change Feed': test_change_feed_quiesces()}
+
+
+def print_summary(results: Dict[str, bool]) -> int:
+    print_header("Test Summary")
+    passed = sum(1 for v in results.values() if v)
+    for test_name, result in results.items():
+        status = f"{GREEN}PASSED{RESET}" if result else f"{RED}FAILED{RESET}"
+        print(f"{test_name}: {status}")
+    print(f"\n{BOLD}Total: {passed}/{len(results)} tests passed{RESET}\n")
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(print_summary(run_all_tests()))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Vector Search Service
+Serves exact top-k cosine search over product embeddings from an in-memory
+NumPy index, kept fresh by tailing products.updated_at
+"""
+
+import os
+import time
+import logging
+
+import requests
+import psycopg2
+from flask import Flask, request, jsonify
+
+from semantic_cache import SemanticCache, filter_key
+from vector_index import VectorIndex
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'port': int(os.getenv('DB_PORT', '5432')),
+    'database': os.getenv('DB_NAME', 'ecommerce'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', 'postgres')
+}
+EMBEDDING_SERVICE_URL = os.getenv('EMBEDDING_SERVICE_URL', 'http://localhost:8080')
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', '/tmp/vector-search')
+USE_INT8 = os.getenv('USE_INT8', 'false').lower() == 'true'
+REFRESH_SECONDS = float(os.getenv('REFRESH_SECONDS', '5'))
+FULL_RELOAD_SECONDS = float(os.getenv('FULL_RELOAD_SECONDS', '3600'))
+COMPACT_ROWS = int(os.getenv('COMPACT_ROWS', '50000'))
+DELETION_CHECK_SECONDS = float(os.getenv('DELETION_CHECK_SECONDS', '60'))
+MAX_K = int(os.getenv('MAX_K', '1000'))
+# Semantic result cache: 0 disables it
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '0'))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', '300'))
+EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', '384'))
+
+cache = None
+if SEMANTIC_CACHE_SIZE > 0:
+    cache = SemanticCache(EMBEDDING_DIM, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL_SECONDS)
+
+
+def invalidate_cache(changes):
+    """Changed rows from an index refresh, or None after a full reload"""
+    if changes is None:
+        cache.clear()
+    else:
+        cache.invalidate(changes)
+
+
+index = VectorIndex(lambda: psycopg2.connect(**DB_CONFIG), SNAPSHOT_DIR, use_int8=USE_INT8,
+                    refresh_seconds=REFRESH_SECONDS, full_reload_seconds=FULL_RELOAD_SECONDS,
+                    compact_rows=COMPACT_ROWS, on_change=invalidate_cache if cache is not None else None,
+                    deletion_check_seconds=DELETION_CHECK_SECONDS)
+
+logger.info("Loading vector index from Postgres")
+index.start()
+logger.info(f"Vector index ready: {index.describe()['snapshot']}")
+
+
+def embed_query(text: str):
+    response = requests.post(f"{EMBEDDING_SERVICE_URL}/embed", json={'text': text}, timeout=30)
+    response.raise_for_status()
+    return response.json()['embedding']
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check endpoint"""
+    snapshot = index.snapshot
+    return jsonify({
+        'status': 'healthy' if snapshot is not None else 'loading',
+        'rows': snapshot.live_rows() if snapshot is not None else 0,
+        'version': snapshot.version if snapshot is not None else None
+    }), 200 if snapshot is not None else 503
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(index.describe())
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Semantic cache hit rate and similarity distribution of hits"""
+    if cache is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **cache.describe()})
+
+
+@app.route('/search', methods=['POST'])
+def search():
+    """
+    Top-k products by cosine similarity
+
+    Body: {"embedding": [...]} or {"query": "text"}, plus optional "k",
+    "category" (string or list), "min_price" and "max_price", and
+    "cache": false to bypass the semantic cache
+    """
+    try:
+        data = request.get_json()
+        if not data or ('embedding' not in data and 'query' not in data):
+            return jsonify({'error': 'Missing "embedding" or "query" field'}), 400
+
+        k = int(data.get('k', 10))
+        if not 0 < k <= MAX_K:
+            return jsonify({'error': f'"k" must be between 1 and {MAX_K}'}), 400
+        categories = data.get('category')
+        if isinstance(categories, str):
+            categories = [categories]
+        min_price = data.get('min_price')
+        max_price = data.get('max_price')
+
+        embedding = data['embedding'] if 'embedding' in data else embed_query(data['query'])
+
+        min_price = float(min_price) if min_price is not None else None
+        max_price = float(max_price) if max_price is not None else None
+        use_cache = cache is not None and data.get('cache', True)
+        key = filter_key(categories, min_price, max_price)
+
+        start = time.perf_counter()
+        # Read before searching: a refresh landing mid-search bumps it and the results are not stored.
+        # The snapshot version alone would not do, delta refreshes keep it
+        generation = cache.generation if use_cache else None
+        cached = cache.lookup(embedding, k, key) if use_cache else None
+        if cached is not None:
+            results, version = cached[0], None
+        else:
+            results, version = index.search(embedding, k, categories, min_price, max_price)
+            if use_cache:
+                cache.store(embedding, k, results, key, generation)
+        took_ms = (time.perf_counter() - start) * 1000
+
+        response = {
+            'results': [{'product_id': pid, 'similarity': score} for pid, score in results],
+            'count': len(results),
+            'snapshot': version,
+            'took_ms': round(took_ms, 2)
+        }
+        if use_cache:
+            response['cache'] = {'hit': cached is not None,
+                                 'similarity': round(cached[1], 4) if cached is not None else None}
+        return jsonify(response)
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error searching: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 8090))
+    app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,383 @@
+"""
+Semantic result cache for product search
+Keeps recent query embeddings in a small in-memory matrix together with their
+top-k results. A query whose embedding is within a cosine threshold of a
+cached one (same k or smaller, same filters) is answered from the cache
+without a vector scan. Entries expire by TTL, are evicted LRU when full, and
+are invalidated when a product in their results changes or a changed product
+could now enter their top-k
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vector_index import WATERMARK_OVERLAP_SECONDS, embedding_version, parse_vector
+
+logger = logging.getLogger(__name__)
+
+# Similarities recorded for the hit and near-miss distributions
+SIMILARITY_HISTORY = 10000
+
+
+def filter_key(categories: Optional[Sequence[str]] = None, min_price: Optional[float] = None,
+               max_price: Optional[float] = None) -> Hashable:
+    """Filters a cached result was computed with; only equal keys can share results"""
+    return (tuple(sorted(categories)) if categories else None, min_price, max_price)
+
+
+class SemanticCache:
+    """
+    Fixed-capacity cache of (query embedding -> top-k results).
+
+    Lookups score the query against every cached embedding with one
+    matrix-vector product, so capacity should stay in the thousands to tens
+    of thousands. All methods take one lock; the matrix is small enough that
+    this is never the bottleneck next to the search it saves.
+    """
+
+    def __init__(self, dim: int, capacity: int = 10000, threshold: float = 0.95, ttl_seconds: float = 300.0,
+                 clock=time.monotonic):
+        self.dim = dim
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.queries = np.zeros((capacity, dim), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.k = np.zeros(capacity, dtype=np.int32)
+        # Score of the last result; a changed product scoring above it could enter the top-k
+        self.kth_score = np.full(capacity, -np.inf, dtype=np.float32)
+        self.key_hash = np.zeros(capacity, dtype=np.int64)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.keys: List[Optional[Hashable]] = [None] * capacity
+        self.results: List[Optional[List[Tuple[str, float]]]] = [None] * capacity
+        self.slots_by_product: Dict[str, set] = {}
+        # Bumped by every invalidate/clear; a search started under an older
+        # generation may have read data that changed since, so is not stored
+        self.generation = 0
+        self.hit_similarities = deque(maxlen=SIMILARITY_HISTORY)
+        self.miss_similarities = deque(maxlen=SIMILARITY_HISTORY)
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evicted_lru': 0, 'expired': 0,
+                      'invalidated': 0, 'cleared': 0, 'stale_stores_skipped': 0}
+
+    def _normalize(self, embedding: Sequence[float]) -> np.ndarray:
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query has {query.shape[0]} dimensions, cache expects {self.dim}")
+        return query / max(float(np.linalg.norm(query)), 1e-12)
+
+    def _drop_locked(self, slot: int):
+        for product_id, _ in self.results[slot] or []:
+            slots = self.slots_by_product.get(product_id)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del self.slots_by_product[product_id]
+        self.valid[slot] = False
+        self.results[slot] = None
+        self.keys[slot] = None
+
+    def _expire_locked(self, now: float):
+        expired = np.flatnonzero(self.valid & (now - self.created > self.ttl_seconds))
+        for slot in expired:
+            self._drop_locked(int(slot))
+        self.stats['expired'] += len(expired)
+
+    def lookup(self, embedding: Sequence[float], k: int,
+               key: Hashable = None) -> Optional[Tuple[List[Tuple[str, float]], float]]:
+        """Cached (results, similarity to the cached query) for a close enough query, else None"""
+        query = self._normalize(embedding)
+        with self._lock:
+            now = self._clock()
+            self._expire_locked(now)
+            candidates = self.valid & (self.key_hash == hash(key)) & (self.k >= k)
+            best, similarity = -1, -1.0
+            if candidates.any():
+                scores = np.where(candidates, self.queries @ query, -np.inf)
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+            if best >= 0 and similarity >= self.threshold and self.keys[best] == key:
+                self.last_used[best] = now
+                self.stats['hits'] += 1
+                self.hit_similarities.append(similarity)
+                return self.results[best][:k], similarity
+            self.stats['misses'] += 1
+            if best >= 0:
+                self.miss_similarities.append(similarity)
+            return None
+
+    def store(self, embedding: Sequence[float], k: int, results: List[Tuple[str, float]], key: Hashable = None,
+              generation: Optional[int] = None):
+        """
+        Cache the results of a search that missed. Pass the generation read
+        before the search: if the cache was invalidated meanwhile, the results
+        may predate the change and are dropped.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stats['stale_stores_skipped'] += 1
+                return
+            now = self._clock()
+            free = np.flatnonzero(~self.valid)
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self.last_used))
+                self._drop_locked(slot)
+                self.stats['evicted_lru'] += 1
+            self.queries[slot] = query
+            self.valid[slot] = True
+            self.k[slot] = k
+            self.kth_score[slot] = results[-1][1] if len(results) >= k else -np.inf
+            self.key_hash[slot] = hash(key)
+            self.keys[slot] = key
+            self.created[slot] = now
+            self.last_used[slot] = now
+            self.results[slot] = list(results)
+            for product_id, _ in results:
+                self.slots_by_product.setdefault(product_id, set()).add(slot)
+            self.stats['stores'] += 1
+
+    def invalidate(self, changes: Sequence[Tuple[str, Optional[np.ndarray]]]) -> int:
+        """
+        Drop entries made stale by changed products, given as (product_id,
+        new embedding or None if removed). An entry is stale when a changed
+        product is among its results, or when the new embedding scores above
+        the entry's k-th result (ignoring filters, so this over-invalidates
+        rather than miss). Returns the number of entries dropped.
+        """
+        if not changes:
+            return 0
+        with self._lock:
+            self.generation += 1
+            stale = set()
+            for product_id, _ in changes:
+                stale.update(self.slots_by_product.get(product_id, ()))
+            vectors = [vector for _, vector in changes if vector is not None]
+            if vectors and self.valid.any():
+                matrix = np.asarray(vectors, dtype=np.float32)
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+                live = np.flatnonzero(self.valid)
+                best = (self.queries[live] @ matrix.T).max(axis=1)
+                stale.update(int(slot) for slot in live[best >= self.kth_score[live]])
+            for slot in stale:
+                self._drop_locked(slot)
+            self.stats['invalidated'] += len(stale)
+            return len(stale)
+
+    def clear(self) -> int:
+        """Drop every entry; returns the number dropped"""
+        with self._lock:
+            self.generation += 1
+            live = np.flatnonzero(self.valid)
+            for slot in live:
+                self._drop_locked(int(slot))
+            self.stats['cleared'] += 1
+            return len(live)
+
+    def describe(self) -> Dict:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            hits = np.asarray(self.hit_similarities, dtype=np.float64)
+            misses = np.asarray(self.miss_similarities, dtype=np.float64)
+            # Hit similarities fall in [threshold, 1]
+            edges = np.linspace(self.threshold, 1.0, 11)
+            counts, _ = np.histogram(hits, bins=edges) if len(hits) else (np.zeros(10, dtype=int), edges)
+            return {
+                'entries': int(self.valid.sum()),
+                'capacity': self.capacity,
+                'threshold': self.threshold,
+                'ttl_seconds': self.ttl_seconds,
+                'hit_rate': round(self.stats['hits'] / lookups, 4) if lookups else None,
+                **self.stats,
+                'hit_similarity': similarity_summary(hits),
+                'hit_similarity_histogram': [
+                    {'from': round(float(lo), 4), 'to': round(float(hi), 4), 'count': int(count)}
+                    for lo, hi, count in zip(edges[:-1], edges[1:], counts)
+                ],
+                # Nearest cached query on a miss: how much a lower threshold would gain
+                'miss_nearest_similarity': similarity_summary(misses),
+            }
+
+
+def similarity_summary(values: np.ndarray) -> Optional[Dict]:
+    if not len(values):
+        return None
+    return {f"p{p}": round(float(np.percentile(values, p)), 4) for p in (5, 25, 50, 75, 95)}
+
+
+class ProductChangeFeed:
+    """
+    Polls products.updated_at and invalidates a cache with the changed rows,
+    for a cache sitting in front of Postgres rather than the vector index
+    (which reports its own changes). A change of embedding_version (a
+    re-embed flip or rollback) clears the whole cache.
+    """
+
+    def __init__(self, connect_fn, cache: SemanticCache, poll_seconds: float = 5.0):
+        self.connect_fn = connect_fn
+        self.cache = cache
+        self.poll_seconds = poll_seconds
+        self.watermark = None
+        self.embedding_version = None
+        # product_id -> updated_at of rows already invalidated inside the overlap window
+        self.seen: Dict[str, object] = {}
+        self._stop = threading.Event()
+
+    def poll(self) -> int:
+        conn = self.connect_fn()
+        try:
+            with conn.cursor() as cursor:
+                first = self.watermark is None
+                version = embedding_version(cursor)
+                replaced = not first and version != self.embedding_version
+                self.embedding_version = version
+                if first or replaced:
+                    cursor.execute("SELECT max(updated_at) FROM products")
+                    self.watermark = cursor.fetchone()[0]
+                    rows = []
+                else:
+                    cursor.execute(
+                        f"SELECT product_id, embedding::text, updated_at FROM products "
+                        f"WHERE updated_at > %s - interval '{WATERMARK_OVERLAP_SECONDS} seconds'",
+                        (self.watermark,))
+                    rows = cursor.fetchall()
+            conn.commit()
+        finally:
+            conn.close()
+        if replaced:
+            self.seen = {}
+            return self.cache.clear()
+        # The overlap re-reads rows already invalidated; skip those that did not
+        # change since, or every poll would evict the same entries (and bump the
+        # cache generation) again
+        fresh = [row for row in rows if self.seen.get(row[0]) != row[2]]
+        if rows:
+            self.watermark = max(self.watermark, max(row[2] for row in rows))
+        self.seen = {pid: updated_at for pid, _, updated_at in rows}
+        return self.cache.invalidate([(pid, parse_vector(text) if text is not None else None) for pid, text, _ in fresh])
+
+    def _loop(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Semantic cache change poll failed: {e}")
+
+    def start(self):
+        self.poll()
+        threading.Thread(target=self._loop, name='semantic-cache-changes', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+
+def load_queries(path: str) -> List[str]:
+    """Recorded queries: one per line, or JSON lines with a "query" or "text" field"""
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('{'):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                line = record.get('query') or record.get('text') or ''
+            if line:
+                queries.append(line)
+    return queries
+
+
+def replay(conn, queries: List[str], embed_url: str, k: int = 10, threshold: float = 0.95,
+           capacity: int = 10000, check: bool = False) -> Dict:
+    """
+    Run recorded queries in order through a cache in front of pgvector's exact
+    search. With check, hits are also searched in Postgres to measure how many
+    of the cached top-k the fresh search agrees with.
+    """
+    import requests
+
+    from vector_index import pgvector_top_k
+
+    embeddings = []
+    for i in range(0, len(queries), 256):
+        response = requests.post(embed_url, json={'texts': queries[i:i + 256]}, timeout=120)
+        response.raise_for_status()
+        embeddings.extend(response.json()['embeddings'])
+
+    cache = SemanticCache(len(embeddings[0]), capacity, threshold, ttl_seconds=float('inf'))
+    overlaps, db_seconds, cache_seconds = [], 0.0, 0.0
+    for embedding in embeddings:
+        start = time.perf_counter()
+        cached = cache.lookup(embedding, k)
+        cache_seconds += time.perf_counter() - start
+        if cached is None or check:
+            start = time.perf_counter()
+            fresh = pgvector_top_k(conn, embedding, k)
+            db_seconds += time.perf_counter() - start
+            if cached is None:
+                cache.store(embedding, k, fresh)
+            else:
+                ids = {pid for pid, _ in fresh}
+                overlaps.append(len(ids & {pid for pid, _ in cached[0]}) / max(len(ids), 1))
+
+    report = cache.describe()
+    report = {
+        'queries': len(embeddings),
+        'k': k,
+        'threshold': threshold,
+        'hit_rate': report['hit_rate'],
+        'database_searches_skipped': report['hits'],
+        'hit_similarity': report['hit_similarity'],
+        'hit_similarity_histogram': report['hit_similarity_histogram'],
+        'miss_nearest_similarity': report['miss_nearest_similarity'],
+        'mean_lookup_ms': round(cache_seconds * 1000 / max(len(embeddings), 1), 3),
+        'database_seconds': round(db_seconds, 2),
+    }
+    if check:
+        report['hit_overlap_at_k'] = round(float(np.mean(overlaps)), 4) if overlaps else None
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Measure the semantic result cache on recorded queries')
+    parser.add_argument('command', choices=['replay'], help='replay: run queries in order through the cache')
+    parser.add_argument('queries', help='Recorded queries (one per line or JSON lines)')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=0.95, help='Minimum cosine similarity for a hit')
+    parser.add_argument('--capacity', type=int, default=10000)
+    parser.add_argument('--check', action='store_true',
+                        help='Also search Postgres on hits and report top-k overlap with the cached results')
+    parser.add_argument('--embed-url',
+                        default=os.getenv('EMBEDDING_SERVICE_URL', 'http://localhost:8080') + '/embed/batch')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=int(os.getenv('DB_PORT', '5432')),
+        database=os.getenv('DB_NAME', 'ecommerce'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'postgres')
+    )
+    try:
+        print(json.dumps(replay(conn, load_queries(args.queries), args.embed_url, args.k, args.threshold,
+                                args.capacity, args.check), indent=2))
+    finally:
+        conn.close()
@@ -0,0 +1,553 @@
+"""
+In-memory vector index over products.embedding
+A snapshot is an immutable, memory-mapped float32 matrix of L2-normalized
+embeddings (plus category codes and prices for pre-filtering), a small delta
+of rows changed since it was built, and a tombstone mask over replaced rows.
+Readers grab the current snapshot reference once per query, so a refresh or
+full reload swaps in a new snapshot without ever blocking a search
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from topk import BLOCK_ROWS, blocked_top_k, top_k
+
+logger = logging.getLogger(__name__)
+
+# Below this fraction of selected rows, gather them and scan only those
+PREFILTER_FRACTION = 0.2
+# int8 scans over-fetch this many times k, then rerank with float32 rows
+INT8_OVERSAMPLE = 4
+# Re-read rows updated this long before the watermark, to catch transactions
+# that committed late with an earlier updated_at
+WATERMARK_OVERLAP_SECONDS = 5
+# Snapshot ids sent per anti-join statement when looking for hard DELETEs
+DELETION_CHECK_CHUNK = 50000
+
+PRODUCT_COLUMNS = "product_id, category, price, embedding::text"
+
+
+def parse_vector(text: str) -> np.ndarray:
+    """pgvector text form '[0.1,0.2,...]' to float32"""
+    return np.array(text[1:-1].split(','), dtype=np.float32)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def embedding_version(cursor):
+    """
+    embedding_version.changed_at, bumped by data-pipeline/reembed.py when it
+    swaps products.embedding wholesale without touching updated_at; None
+    when there is no such table
+    """
+    cursor.execute("SELECT to_regclass('embedding_version') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return None
+    cursor.execute("SELECT changed_at FROM embedding_version")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization (row ~= q * scale), a block at a time"""
+    q8 = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + BLOCK_ROWS])
+        block_scales = np.maximum(np.abs(block).max(axis=1), 1e-12) / 127.0
+        q8[start:start + BLOCK_ROWS] = np.round(block / block_scales[:, None])
+        scales[start:start + BLOCK_ROWS] = block_scales
+    return q8, scales
+
+
+class Delta:
+    """Rows added or changed since the base matrix was built (small, in memory)"""
+
+    def __init__(self, rows: Optional[Dict[str, Tuple[np.ndarray, Optional[str], Optional[float]]]] = None):
+        self.rows = rows or {}
+        ids = list(self.rows)
+        self.ids = np.array(ids, dtype=object)
+        if ids:
+            self.vectors = np.vstack([self.rows[pid][0] for pid in ids])
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.categories = np.array([self.rows[pid][1] for pid in ids], dtype=object)
+        self.prices = np.array([np.nan if self.rows[pid][2] is None else self.rows[pid][2] for pid in ids],
+                               dtype=np.float32)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Snapshot:
+    """
+    Immutable view of the catalog used to answer queries.
+
+    Base rows live in a memory-mapped float32 matrix (optionally also held as
+    int8 for faster, smaller scans); rows changed after the base was built are
+    tombstoned in the base and served from the delta instead.
+    """
+
+    def __init__(self, version: str, ids: np.ndarray, vectors: np.ndarray, category_codes: np.ndarray,
+                 category_names: List[str], prices: np.ndarray, watermark, path: Optional[str] = None,
+                 quantized: Optional[Tuple[np.ndarray, np.ndarray]] = None, delta: Optional[Delta] = None,
+                 tombstones: Optional[np.ndarray] = None, embedding_version=None):
+        self.version = version
+        self.embedding_version = embedding_version
+        self.ids = ids
+        self.vectors = vectors
+        self.category_codes = category_codes
+        self.category_names = category_names
+        self._category_lookup = {name: code for code, name in enumerate(category_names)}
+        self.prices = prices
+        self.watermark = watermark
+        self.path = path
+        self.quantized = quantized
+        self.delta = delta or Delta()
+        self.tombstones = tombstones if tombstones is not None else np.zeros(len(ids), dtype=bool)
+        self.row_of = None  # product_id -> base row, built lazily for refreshes
+        self.created_at = time.time()
+
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def base_mask(self, categories: Optional[Sequence[str]], min_price: Optional[float],
+                  max_price: Optional[float]) -> Optional[np.ndarray]:
+        """Rows of the base matrix that pass the filters and are not tombstoned (None = all rows)"""
+        mask = None if not self.tombstones.any() else ~self.tombstones
+        if categories is not None:
+            codes = [self._category_lookup[c] for c in categories if c in self._category_lookup]
+            selected = np.isin(self.category_codes, codes)
+            mask = selected if mask is None else mask & selected
+        # NaN prices never pass a price filter, matching SQL NULL comparisons
+        if min_price is not None:
+            mask = (self.prices >= min_price) if mask is None else mask & (self.prices >= min_price)
+        if max_price is not None:
+            mask = (self.prices <= max_price) if mask is None else mask & (self.prices <= max_price)
+        return mask
+
+    def _scan_base(self, query: np.ndarray, k: int, mask: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k base rows as (rows, scores): blocked matmul + argpartition, or a gather under a tight filter"""
+        n = len(self.ids)
+        if n == 0 or k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if mask is not None and mask.sum() < n * PREFILTER_FRACTION:
+            rows = np.flatnonzero(mask)
+            scores = np.concatenate([self.vectors[rows[i:i + BLOCK_ROWS]] @ query
+                                     for i in range(0, len(rows), BLOCK_ROWS)] or [np.zeros(0, np.float32)])
+            best = top_k(scores, k)
+            return rows[best], scores[best]
+
+        def score_block(start, stop):
+            if self.quantized is not None:
+                q8, scales = self.quantized
+                scores = (q8[start:stop].astype(np.float32) @ query) * scales[start:stop]
+            else:
+                scores = self.vectors[start:stop] @ query
+            if mask is not None:
+                scores = np.where(mask[start:stop], scores, -np.inf)
+            return scores[None, :]
+
+        fetch = k * INT8_OVERSAMPLE if self.quantized is not None else k
+        rows, scores = blocked_top_k(query[None, :], self.vectors, fetch, BLOCK_ROWS, score_block)
+        finite = np.isfinite(scores[0])
+        rows, scores = rows[0][finite], scores[0][finite]
+        if self.quantized is not None:
+            # Rerank the int8 candidates with exact float32 scores
+            order = np.argsort(rows)
+            rows = rows[order]
+            scores = self.vectors[rows] @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def _scan_delta(self, query: np.ndarray, k: int, categories: Optional[Sequence[str]],
+                    min_price: Optional[float], max_price: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+        delta = self.delta
+        if not len(delta):
+            return np.zeros(0, dtype=object), np.zeros(0, dtype=np.float32)
+        mask = np.ones(len(delta), dtype=bool)
+        if categories is not None:
+            mask &= np.isin(delta.categories, list(categories))
+        if min_price is not None:
+            mask &= delta.prices >= min_price
+        if max_price is not None:
+            mask &= delta.prices <= max_price
+        scores = np.where(mask, delta.vectors @ query, -np.inf)
+        best = top_k(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return delta.ids[best], scores[best]
+
+    def search(self, query: Sequence[float], k: int = 10, categories: Optional[Sequence[str]] = None,
+               min_price: Optional[float] = None, max_price: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Exact top-k by cosine similarity, best first, as (product_id, similarity).
+        Same ordering as `ORDER BY embedding <=> query` with an exact scan.
+        """
+        query = normalize_rows(np.asarray(query, dtype=np.float32))
+        if len(self.ids) and query.shape[0] != self.dim:
+            raise ValueError(f"Query has dimension {query.shape[0]}, index has {self.dim}")
+        rows, base_scores = self._scan_base(query, k, self.base_mask(categories, min_price, max_price))
+        delta_ids, delta_scores = self._scan_delta(query, k, categories, min_price, max_price)
+        results = [(self.ids[r], float(s)) for r, s in zip(rows, base_scores)]
+        results += [(pid, float(s)) for pid, s in zip(delta_ids, delta_scores)]
+        # Exact ties are ordered by product_id so results are deterministic
+        results.sort(key=lambda item: (-item[1], item[0]))
+        return results[:k]
+
+    def live_rows(self) -> int:
+        return int(len(self.ids) - self.tombstones.sum() + len(self.delta))
+
+    def live_ids(self) -> List[str]:
+        return self.ids[~self.tombstones].tolist() + list(self.delta.rows)
+
+    def describe(self) -> Dict:
+        return {
+            'version': self.version,
+            'rows': self.live_rows(),
+            'base_rows': len(self.ids),
+            'delta_rows': len(self.delta),
+            'tombstones': int(self.tombstones.sum()),
+            'dim': self.dim,
+            'dtype': 'int8' if self.quantized is not None else 'float32',
+            'categories': len(self.category_names),
+            'watermark': self.watermark.isoformat() if self.watermark is not None else None,
+            'embedding_version': self.embedding_version.isoformat() if self.embedding_version is not None else None,
+            'age_seconds': round(time.time() - self.created_at, 1),
+        }
+
+
+def build_snapshot(conn, directory: str, use_int8: bool = False, fetch_rows: int = 20000) -> Snapshot:
+    """
+    Bulk-load every product embedding into a new memory-mapped file.
+
+    The watermark, row count and scan all run in one REPEATABLE READ
+    transaction, so they describe the same database snapshot; anything
+    committed during the load is picked up by the next refresh.
+    """
+    start = time.perf_counter()
+    version = time.strftime('%Y%m%d-%H%M%S') + f"-{os.getpid()}"
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT max(updated_at) FROM products")
+        watermark = cursor.fetchone()[0]
+        version_marker = embedding_version(cursor)
+        cursor.execute("SELECT count(*), max(vector_dims(embedding)) FROM products WHERE embedding IS NOT NULL")
+        expected, dim = cursor.fetchone()
+    expected, dim = int(expected or 0), int(dim or 0)
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"vectors-{version}.f32")
+    matrix = np.memmap(path, dtype=np.float32, mode='w+', shape=(max(expected, 1), max(dim, 1)))
+    ids, categories, prices = [], [], []
+    with conn.cursor(name='vector_search_snapshot') as cursor:
+        cursor.itersize = fetch_rows
+        cursor.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE embedding IS NOT NULL ORDER BY id")
+        for product_id, category, price, embedding in cursor:
+            vector = parse_vector(embedding)
+            norm = np.linalg.norm(vector)
+            if norm == 0:
+                continue  # cosine distance is undefined; pgvector never ranks these
+            matrix[len(ids)] = vector / norm
+            ids.append(product_id)
+            categories.append(category)
+            prices.append(np.nan if price is None else float(price))
+    conn.commit()
+    matrix.flush()
+    n = len(ids)
+
+    category_names = sorted({c for c in categories if c is not None})
+    lookup = {name: code for code, name in enumerate(category_names)}
+    category_codes = np.array([lookup.get(c, -1) for c in categories], dtype=np.int32)
+    vectors = np.memmap(path, dtype=np.float32, mode='r', shape=(max(expected, 1), max(dim, 1)))[:n]
+    quantized = quantize_int8(vectors) if use_int8 and n else None
+
+    snapshot = Snapshot(version, np.array(ids, dtype=object), vectors, category_codes, category_names,
+                        np.array(prices, dtype=np.float32), watermark, path=path, quantized=quantized,
+                        embedding_version=version_marker)
+    snapshot.row_of = {pid: row for row, pid in enumerate(ids)}
+    logger.info(f"Built snapshot {version}: {n} rows x {dim} dims in {time.perf_counter() - start:.1f}s")
+    return snapshot
+
+
+def apply_changes(snapshot: Snapshot, changes: List[Tuple], watermark) -> Snapshot:
+    """
+    New snapshot sharing the base matrix, with changed rows tombstoned in the
+    base and moved to the delta. A NULL embedding removes the product.
+    """
+    if snapshot.row_of is None:
+        snapshot.row_of = {pid: row for row, pid in enumerate(snapshot.ids)}
+    tombstones = snapshot.tombstones.copy()
+    rows = dict(snapshot.delta.rows)
+    for product_id, category, price, embedding in changes:
+        row = snapshot.row_of.get(product_id)
+        if row is not None:
+            tombstones[row] = True
+        vector = parse_vector(embedding) if embedding is not None else None
+        if vector is None or not np.linalg.norm(vector):
+            rows.pop(product_id, None)
+            continue
+        rows[product_id] = (normalize_rows(vector), category, None if price is None else float(price))
+    refreshed = Snapshot(snapshot.version, snapshot.ids, snapshot.vectors, snapshot.category_codes,
+                         snapshot.category_names, snapshot.prices, watermark, path=snapshot.path,
+                         quantized=snapshot.quantized, delta=Delta(rows), tombstones=tombstones,
+                         embedding_version=snapshot.embedding_version)
+    refreshed.row_of = snapshot.row_of
+    return refreshed
+
+
+class VectorIndex:
+    """
+    Holds the current snapshot and keeps it fresh from Postgres.
+
+    Queries read `self.snapshot` once and use it throughout, so swaps are
+    atomic from the reader's side and never wait for a reload. Writers (the
+    refresh and reload paths) serialize on a lock among themselves.
+    on_change, if given, is called with the (product_id, embedding or None)
+    pairs of each refresh, and with None after a full reload. A re-embed
+    flip or rollback replaces every vector without moving updated_at, so a
+    refresh that sees embedding_version change does a full reload instead.
+    A hard DELETE leaves no updated_at to tail, so every
+    deletion_check_seconds the live ids are anti-joined against products.
+    """
+
+    def __init__(self, connect_fn, directory: str, use_int8: bool = False, refresh_seconds: float = 5.0,
+                 full_reload_seconds: float = 3600.0, compact_rows: int = 50000, on_change=None,
+                 deletion_check_seconds: float = 60.0):
+        self.connect_fn = connect_fn
+        self.directory = directory
+        self.use_int8 = use_int8
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.compact_rows = compact_rows
+        self.on_change = on_change
+        self.deletion_check_seconds = deletion_check_seconds
+        self.snapshot: Optional[Snapshot] = None
+        # Reentrant: refresh falls back to a full reload while holding it
+        self._write_lock = threading.RLock()
+        self._stop = threading.Event()
+        self.stats = {'reloads': 0, 'refreshes': 0, 'changes_applied': 0, 'deletions_applied': 0,
+                      'last_refresh': None, 'last_error': None}
+
+    def search(self, query, k=10, categories=None, min_price=None, max_price=None):
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise RuntimeError('Index is not loaded yet')
+        return snapshot.search(query, k, categories, min_price, max_price), snapshot.version
+
+    def reload(self):
+        """Build a fresh base snapshot and swap it in; the old file is removed once replaced"""
+        with self._write_lock:
+            conn = self.connect_fn()
+            try:
+                snapshot = build_snapshot(conn, self.directory, self.use_int8)
+            finally:
+                conn.close()
+            old, self.snapshot = self.snapshot, snapshot
+            self.stats['reloads'] += 1
+            if self.on_change is not None:
+                self.on_change(None)
+        if old is not None and old.path and old.path != snapshot.path:
+            # Queries still holding the old snapshot keep their mapping after unlink
+            try:
+                os.remove(old.path)
+            except OSError:
+                pass
+
+    def refresh(self) -> int:
+        """Apply rows updated since the snapshot's watermark; returns the number applied"""
+        with self._write_lock:
+            snapshot = self.snapshot
+            if snapshot is None:
+                return 0
+            conn = self.connect_fn()
+            try:
+                with conn.cursor() as cursor:
+                    replaced = embedding_version(cursor) != snapshot.embedding_version
+                    if snapshot.watermark is None:
+                        cursor.execute(f"SELECT {PRODUCT_COLUMNS}, updated_at FROM products ORDER BY updated_at")
+                    else:
+                        cursor.execute(
+                            f"SELECT {PRODUCT_COLUMNS}, updated_at FROM products "
+                            f"WHERE updated_at > %s - interval '{WATERMARK_OVERLAP_SECONDS} seconds' "
+                            f"ORDER BY updated_at", (snapshot.watermark,))
+                    rows = cursor.fetchall()
+                conn.commit()
+            finally:
+                conn.close()
+            if replaced:
+                logger.info("Embeddings were replaced wholesale (embedding_version changed); reloading")
+                self.reload()
+                return 0
+            self.stats['refreshes'] += 1
+            self.stats['last_refresh'] = time.time()
+            # The overlap re-reads rows already applied; skip those that did not change since
+            fresh = [row for row in rows if snapshot.watermark is None or row[4] > snapshot.watermark
+                     or row[0] not in snapshot.delta.rows]
+            if not fresh:
+                return 0
+            watermark = max(row[4] for row in rows)
+            self.snapshot = apply_changes(snapshot, [row[:4] for row in fresh], watermark)
+            self.stats['changes_applied'] += len(fresh)
+            if self.on_change is not None:
+                self.on_change([(row[0], parse_vector(row[3]) if row[3] is not None else None) for row in fresh])
+            return len(fresh)
+
+    def remove_deleted(self) -> int:
+        """Drop snapshot products that no longer exist in products; returns the number removed"""
+        with self._write_lock:
+            snapshot = self.snapshot
+            if snapshot is None:
+                return 0
+            live = snapshot.live_ids()
+            deleted = []
+            conn = self.connect_fn()
+            try:
+                with conn.cursor() as cursor:
+                    for start in range(0, len(live), DELETION_CHECK_CHUNK):
+                        cursor.execute("""
+                            SELECT s.product_id FROM unnest(%s::text[]) AS s(product_id)
+                            WHERE NOT EXISTS (SELECT 1 FROM products p WHERE p.product_id = s.product_id)
+                        """, (live[start:start + DELETION_CHECK_CHUNK],))
+                        deleted += [row[0] for row in cursor.fetchall()]
+                conn.commit()
+            finally:
+                conn.close()
+            if not deleted:
+                return 0
+            self.snapshot = apply_changes(snapshot, [(pid, None, None, None) for pid in deleted], snapshot.watermark)
+            self.stats['deletions_applied'] += len(deleted)
+            if self.on_change is not None:
+                self.on_change([(pid, None) for pid in deleted])
+            return len(deleted)
+
+    def _loop(self):
+        last_reload = last_deletion_check = time.time()
+        while not self._stop.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+                if time.time() - last_deletion_check >= self.deletion_check_seconds:
+                    self.remove_deleted()
+                    last_deletion_check = time.time()
+                delta = len(self.snapshot.delta) if self.snapshot else 0
+                if delta >= self.compact_rows or time.time() - last_reload >= self.full_reload_seconds:
+                    self.reload()
+                    last_reload = time.time()
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                logger.error(f"Vector index refresh failed: {e}")
+
+    def start(self):
+        """Initial load, then refresh in a background thread"""
+        self.reload()
+        threading.Thread(target=self._loop, name='vector-index-refresh', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def describe(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            'snapshot': snapshot.describe() if snapshot else None,
+            **self.stats,
+        }
+
+
+def pgvector_top_k(conn, query: Sequence[float], k: int) -> List[Tuple[str, float]]:
+    """Exact pgvector ordering (index scans off), as (product_id, similarity)"""
+    literal = '[' + ','.join(str(float(x)) for x in query) + ']'
+    with conn.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_indexscan = off")
+        cursor.execute("""
+            SELECT product_id, 1 - (embedding <=> %s::vector) AS similarity
+            FROM products
+            WHERE embedding IS NOT NULL
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+        """, (literal, literal, k))
+        rows = cursor.fetchall()
+    conn.rollback()
+    return [(pid, float(sim)) for pid, sim in rows]
+
+
+def verify(conn, snapshot: Snapshot, queries: int = 50, k: int = 10, seed: int = 42) -> Dict:
+    """
+    Compare index results with pgvector's exact scan for random product
+    embeddings used as queries. Rankings agree when the id lists are equal,
+    allowing swaps between scores that tie to within float32 precision.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(snapshot.ids), size=min(queries, len(snapshot.ids)), replace=False)
+    overlap, exact, max_score_error = [], 0, 0.0
+    for row in rows:
+        query = np.asarray(snapshot.vectors[row])
+        ours = snapshot.search(query, k)
+        theirs = pgvector_top_k(conn, query, k)
+        overlap.append(len({p for p, _ in ours} & {p for p, _ in theirs}) / max(len(theirs), 1))
+        same = [p for p, _ in ours] == [p for p, _ in theirs]
+        tied = all(abs(a[1] - b[1]) < 1e-5 for a, b in zip(ours, theirs))
+        exact += same or tied
+        max_score_error = max([max_score_error] + [abs(a[1] - b[1]) for a, b in zip(ours, theirs)])
+    return {
+        'queries': len(rows),
+        'k': k,
+        'mean_overlap': round(float(np.mean(overlap)), 4) if overlap else None,
+        'ordering_matches': int(exact),
+        'max_score_error': round(max_score_error, 6),
+    }
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description='Build the in-memory vector index and check or benchmark it')
+    parser.add_argument('command', choices=['verify', 'bench'],
+                        help='verify: compare with pgvector exact search; bench: time index queries')
+    parser.add_argument('--snapshot-dir', default=os.getenv('SNAPSHOT_DIR', '/tmp/vector-search'))
+    parser.add_argument('--int8', action='store_true', help='Scan int8 vectors and rerank in float32')
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--category', help='bench: restrict to one category')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        port=int(os.getenv('DB_PORT', '5432')),
+        database=os.getenv('DB_NAME', 'ecommerce'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASSWORD', 'postgres')
+    )
+    snapshot = None
+    try:
+        snapshot = build_snapshot(conn, args.snapshot_dir, args.int8)
+        conn.set_session(isolation_level='READ COMMITTED', readonly=False)
+        if args.command == 'verify':
+            print(json.dumps(verify(conn, snapshot, args.queries, args.k), indent=2))
+        else:
+            rng = np.random.default_rng(0)
+            categories = [args.category] if args.category else None
+            latencies = []
+            for row in rng.choice(len(snapshot.ids), size=args.queries):
+                start = time.perf_counter()
+                snapshot.search(snapshot.vectors[row], args.k, categories)
+                latencies.append((time.perf_counter() - start) * 1000)
+            print(f"{len(snapshot.ids)} rows, {args.queries} queries: "
+                  f"p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms")
+    finally:
+        if snapshot is not None:
+            os.remove(snapshot.path)
+        conn.close()